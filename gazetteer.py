@@ -0,0 +1,443 @@
+"""
+Module de gazetteer hors-ligne des localités du Sénégal
+Fichier binaire compact, projeté en mémoire (mmap), avec index trié sur le nom normalisé
+
+Format (petit-boutiste):
+    en-tête   : magic "SNGZ", version, réservé, nb enregistrements, nb régions, taille du bloc texte
+    régions   : (offset, longueur) dans le bloc texte
+    index     : enregistrements triés par clé normalisée
+                (offset clé, longueur clé, offset nom, longueur nom, région, lon, lat)
+    bloc texte: chaînes UTF-8 concaténées
+
+Construction:
+    python gazetteer.py --csv data/senegal_localities.csv --download
+        (télécharge l'export GeoNames du Sénégal: toutes les localités habitées, classe P)
+    python gazetteer.py --csv data/senegal_localities.csv [--geonames SN.txt --admin1 admin1CodesASCII.txt]
+"""
+
+import csv
+import io
+import mmap
+import os
+import re
+import struct
+import threading
+import unicodedata
+import urllib.request
+import zipfile
+from collections import defaultdict
+
+MAGIC = b"SNGZ"
+VERSION = 1
+
+_HEADER = struct.Struct("<4sHHIII")
+_REGION = struct.Struct("<IH")
+_RECORD = struct.Struct("<IHIHHff")
+
+DEFAULT_GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "senegal_gazetteer.bin")
+
+GEONAMES_DUMP_URL = "https://download.geonames.org/export/dump"
+
+
+def normalize_city_key(name):
+    """Normalise un nom de ville pour les correspondances hors-ligne (sans accents/espaces/ponctuations)."""
+    if not isinstance(name, str):
+        return ""
+    s = name.strip().lower()
+    s = unicodedata.normalize("NFKD", s)
+    s = s.encode("ascii", "ignore").decode("ascii")
+    # Unifier les variantes de 'saint', 'ste', 'st'
+    s = re.sub(r"\bste\b", "saint", s)
+    s = re.sub(r"\bst\b", "saint", s)
+    # Supprimer tout sauf alphanumérique
+    s = re.sub(r"[^a-z0-9]", "", s)
+    return s
+
+
+class Gazetteer:
+    """Lecture d'un gazetteer binaire projeté en mémoire (recherche dichotomique sur la clé)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, n_records, n_regions, blob_size = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Gazetteer invalide ou version non supportée: {path}")
+        self.n_records = n_records
+        self._regions_offset = _HEADER.size
+        self._records_offset = self._regions_offset + n_regions * _REGION.size
+        self._blob_offset = self._records_offset + n_records * _RECORD.size
+        self._regions = []
+        for i in range(n_regions):
+            off, length = _REGION.unpack_from(self._mm, self._regions_offset + i * _REGION.size)
+            self._regions.append(self._text(off, length))
+
+    def __len__(self):
+        return self.n_records
+
+    def _text(self, off, length):
+        start = self._blob_offset + off
+        return self._mm[start:start + length].decode("utf-8")
+
+    def _key_bytes(self, i):
+        key_off, key_len = _RECORD.unpack_from(self._mm, self._records_offset + i * _RECORD.size)[:2]
+        start = self._blob_offset + key_off
+        return self._mm[start:start + key_len]
+
+    def _record(self, i):
+        key_off, key_len, name_off, name_len, region_idx, lon, lat = _RECORD.unpack_from(
+            self._mm, self._records_offset + i * _RECORD.size
+        )
+        return {
+            "key": self._text(key_off, key_len),
+            "name": self._text(name_off, name_len),
+            "region": self._regions[region_idx] if region_idx < len(self._regions) else "",
+            "lon": lon,
+            "lat": lat,
+        }
+
+    def _lower_bound(self, key_bytes):
+        lo, hi = 0, self.n_records
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_bytes(mid) < key_bytes:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def lookup_all(self, name):
+        """Toutes les localités dont la clé normalisée correspond (homonymes inclus)."""
+        key = normalize_city_key(name).encode("ascii")
+        if not key:
+            return []
+        matches = []
+        i = self._lower_bound(key)
+        while i < self.n_records and self._key_bytes(i) == key:
+            matches.append(self._record(i))
+            i += 1
+        return matches
+
+    def lookup(self, name):
+        """Coordonnées (lon, lat) de la localité la plus importante portant ce nom, sinon None."""
+        matches = self.lookup_all(name)
+        if not matches:
+            return None
+        # Arrondi: les coordonnées sont stockées en float32
+        return (round(float(matches[0]["lon"]), 5), round(float(matches[0]["lat"]), 5))
+
+    def iter_keys(self):
+        """Clés normalisées distinctes, dans l'ordre de l'index."""
+        previous = None
+        for i in range(self.n_records):
+            key = self._key_bytes(i)
+            if key != previous:
+                previous = key
+                yield key.decode("ascii")
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+
+
+def get_gazetteer(path=None):
+    """Gazetteer partagé, ouvert à la première utilisation. None si le fichier est absent."""
+    global _gazetteer
+    if _gazetteer is None:
+        with _gazetteer_lock:
+            if _gazetteer is None:
+                target = path or os.getenv("SENEGAL_GAZETTEER_PATH") or DEFAULT_GAZETTEER_PATH
+                if not os.path.exists(target):
+                    return None
+                _gazetteer = Gazetteer(target)
+    return _gazetteer
+
+
+def lookup_city(name):
+    """Recherche hors-ligne d'une localité: (lon, lat) ou None."""
+    gazetteer = get_gazetteer()
+    return gazetteer.lookup(name) if gazetteer else None
+
+
+def _trigrams(key):
+    padded = f"$${key}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, max_distance=None):
+    """Distance de Damerau-Levenshtein (transpositions adjacentes), arrêt anticipé au-delà de max_distance."""
+    if a == b:
+        return 0
+    if max_distance is not None and abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if previous2 is not None and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if max_distance is not None and min(current) > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class FuzzyCityIndex:
+    """
+    Index trigrammes sur les clés normalisées du gazetteer
+
+    Les trigrammes présélectionnent une poignée de candidats, classés ensuite
+    par distance d'édition: une requête coûte une fraction de milliseconde.
+    """
+
+    def __init__(self, keys):
+        self.keys = list(keys)
+        self._postings = defaultdict(list)
+        for idx, key in enumerate(self.keys):
+            for trigram in _trigrams(key):
+                self._postings[trigram].append(idx)
+
+    def search(self, name, limit=5, max_distance=2, shortlist=25):
+        """Retourne [(clé, distance)] triés par distance croissante (limit=None: tous)."""
+        key = normalize_city_key(name)
+        if not key:
+            return []
+        shared = defaultdict(int)
+        for trigram in _trigrams(key):
+            for idx in self._postings.get(trigram, ()):
+                shared[idx] += 1
+        candidates = sorted(shared.items(), key=lambda item: -item[1])[:shortlist]
+        scored = []
+        for idx, common in candidates:
+            candidate = self.keys[idx]
+            distance = edit_distance(key, candidate, max_distance)
+            if distance <= max_distance:
+                scored.append((distance, -common, candidate))
+        scored.sort()
+        return [(candidate, distance) for distance, _, candidate in scored[:limit]]
+
+
+_fuzzy_index = None
+
+
+def get_fuzzy_index():
+    """Index flou construit à la première utilisation à partir du gazetteer (None si absent)."""
+    global _fuzzy_index
+    if _fuzzy_index is None:
+        gazetteer = get_gazetteer()
+        if gazetteer is None:
+            return None
+        with _gazetteer_lock:
+            if _fuzzy_index is None:
+                _fuzzy_index = FuzzyCityIndex(gazetteer.iter_keys())
+    return _fuzzy_index
+
+
+def suggest_cities(name, limit=5, max_distance=2):
+    """
+    Suggestions de localités proches d'un nom mal orthographié
+
+    Une localité n'apparaît qu'une fois, sous sa graphie la plus proche
+    (les noms alternatifs d'un même lieu ne sont pas des suggestions distinctes).
+
+    Returns:
+        list: dicts {name, key, region, lon, lat, distance} triés par distance
+    """
+    index = get_fuzzy_index()
+    if index is None:
+        return []
+    gazetteer = get_gazetteer()
+    suggestions = []
+    seen = set()
+    for key, distance in index.search(name, limit=None, max_distance=max_distance):
+        record = gazetteer.lookup_all(key)[0]
+        record["lon"], record["lat"] = round(record["lon"], 5), round(record["lat"], 5)
+        locality = (record["name"], record["region"], record["lon"], record["lat"])
+        if locality in seen:
+            continue
+        seen.add(locality)
+        record["distance"] = distance
+        suggestions.append(record)
+        if limit is not None and len(suggestions) >= limit:
+            break
+    return suggestions
+
+
+def autocorrect_city(name):
+    """
+    Correction automatique d'une faute de frappe évidente
+
+    Retourne la localité (dict comme suggest_cities) si le nom est absent du gazetteer,
+    qu'un seul candidat est le plus proche et que l'écart reste faible
+    (1 caractère jusqu'à 5 lettres, 2 au-delà). Sinon None.
+    """
+    key = normalize_city_key(name)
+    if len(key) < 4:
+        return None
+    gazetteer = get_gazetteer()
+    if gazetteer is None or gazetteer.lookup_all(key):
+        return None
+    allowed = 1 if len(key) <= 5 else 2
+    suggestions = suggest_cities(key, limit=2, max_distance=allowed)
+    if not suggestions:
+        return None
+    if len(suggestions) > 1 and suggestions[1]["distance"] == suggestions[0]["distance"]:
+        # Ambigu entre deux localités distinctes: laisser l'utilisateur choisir
+        return None
+    return suggestions[0]
+
+
+def build_gazetteer(entries, out_path):
+    """
+    Écrit un gazetteer binaire
+
+    Args:
+        entries: Itérable de tuples (nom, région, lon, lat, population[, noms alternatifs])
+        out_path: Fichier de sortie
+
+    Returns:
+        int: Nombre d'enregistrements écrits
+    """
+    blob = bytearray()
+    text_offsets = {}
+
+    def add_text(text):
+        if text not in text_offsets:
+            data = text.encode("utf-8")
+            text_offsets[text] = (len(blob), len(data))
+            blob.extend(data)
+        return text_offsets[text]
+
+    regions = []
+    region_index = {}
+    rows = {}
+    for entry in entries:
+        name, region, lon, lat, population = entry[:5]
+        alternates = entry[5] if len(entry) > 5 else ()
+        if region not in region_index:
+            region_index[region] = len(regions)
+            regions.append(region)
+        for label in (name,) + tuple(alternates):
+            key = normalize_city_key(label)
+            if not key:
+                continue
+            # Un seul enregistrement par (clé, nom, région): garder la population la plus forte
+            ident = (key, name, region)
+            if ident not in rows or population > rows[ident][5]:
+                rows[ident] = (key, name, region_index[region], float(lon), float(lat), population)
+
+    # Tri par clé puis population décroissante: lookup() retourne la localité principale
+    ordered = sorted(rows.values(), key=lambda r: (r[0].encode("ascii"), -r[5], r[1]))
+
+    region_table = [add_text(r) for r in regions]
+    records = []
+    for key, name, region_idx, lon, lat, _ in ordered:
+        key_off, key_len = add_text(key)
+        name_off, name_len = add_text(name)
+        records.append(_RECORD.pack(key_off, key_len, name_off, name_len, region_idx, lon, lat))
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    with open(out_path, "wb") as fh:
+        fh.write(_HEADER.pack(MAGIC, VERSION, 0, len(records), len(region_table), len(blob)))
+        for off, length in region_table:
+            fh.write(_REGION.pack(off, length))
+        for record in records:
+            fh.write(record)
+        fh.write(bytes(blob))
+    return len(records)
+
+
+def read_localities_csv(path):
+    """
+    Lit un CSV (nom, region, lon, lat[, population, alternatifs]) et retourne les entrées pour build_gazetteer
+
+    La colonne alternatifs contient les autres graphies séparées par "|".
+    """
+    entries = []
+    with open(path, encoding="utf-8", newline="") as fh:
+        for row in csv.DictReader(fh):
+            try:
+                population = int(row.get("population") or 0)
+                alternates = tuple(a.strip() for a in (row.get("alternatifs") or "").split("|") if a.strip())
+                entries.append((row["nom"], row.get("region", ""), float(row["lon"]), float(row["lat"]),
+                                population, alternates))
+            except (KeyError, ValueError):
+                continue
+    return entries
+
+
+def read_geonames(path, admin1_path=None):
+    """Lit un export GeoNames pays (ex. SN.txt) et retourne les lieux habités (classe P)."""
+    admin1 = {}
+    if admin1_path:
+        with open(admin1_path, encoding="utf-8") as fh:
+            for line in fh:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) >= 2 and parts[0].startswith("SN."):
+                    admin1[parts[0][3:]] = parts[1]
+    entries = []
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) < 15 or parts[6] != "P":
+                continue
+            alternates = tuple(a for a in parts[3].split(",") if a)[:20]
+            region = admin1.get(parts[10], parts[10])
+            try:
+                population = int(parts[14] or 0)
+                entries.append((parts[1], region, float(parts[5]), float(parts[4]), population, (parts[2],) + alternates))
+            except ValueError:
+                continue
+    return entries
+
+
+def download_geonames(country="SN", dest_dir=None, timeout=120):
+    """
+    Télécharge l'export GeoNames d'un pays et la table des régions (admin1)
+
+    Returns:
+        tuple: (chemin du fichier pays .txt, chemin de admin1CodesASCII.txt)
+    """
+    dest_dir = dest_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "geonames")
+    os.makedirs(dest_dir, exist_ok=True)
+    country_path = os.path.join(dest_dir, f"{country}.txt")
+    with urllib.request.urlopen(f"{GEONAMES_DUMP_URL}/{country}.zip", timeout=timeout) as resp:
+        with zipfile.ZipFile(io.BytesIO(resp.read())) as archive:
+            with open(country_path, "wb") as fh:
+                fh.write(archive.read(f"{country}.txt"))
+    admin1_path = os.path.join(dest_dir, "admin1CodesASCII.txt")
+    with urllib.request.urlopen(f"{GEONAMES_DUMP_URL}/admin1CodesASCII.txt", timeout=timeout) as resp:
+        with open(admin1_path, "wb") as fh:
+            fh.write(resp.read())
+    return country_path, admin1_path
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Construit le gazetteer binaire des localités du Sénégal")
+    parser.add_argument("--csv", action="append", default=[], help="CSV nom,region,lon,lat[,population]")
+    parser.add_argument("--geonames", help="Export GeoNames du Sénégal (SN.txt)")
+    parser.add_argument("--admin1", help="admin1CodesASCII.txt pour nommer les régions GeoNames")
+    parser.add_argument("--download", action="store_true",
+                        help="Télécharger l'export GeoNames du Sénégal (toutes les localités) avant la construction")
+    parser.add_argument("-o", "--output", default=DEFAULT_GAZETTEER_PATH)
+    args = parser.parse_args()
+
+    all_entries = []
+    for csv_path in args.csv:
+        all_entries.extend(read_localities_csv(csv_path))
+    if args.download:
+        args.geonames, args.admin1 = download_geonames("SN")
+    if args.geonames:
+        all_entries.extend(read_geonames(args.geonames, args.admin1))
+    count = build_gazetteer(all_entries, args.output)
+    print(f"{count} enregistrements écrits dans {args.output}")
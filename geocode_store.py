@@ -0,0 +1,154 @@
+"""
+Module de stockage persistant des résultats de géocodage
+Base SQLite partagée entre processus et redémarrages (clé = nom de ville normalisé)
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+# Provenance des coordonnées enregistrées
+PROVIDER_NOMINATIM = "nominatim"
+PROVIDER_GRAPHHOPPER = "graphhopper"
+PROVIDER_OFFLINE = "offline"
+# Correction floue d'une faute de frappe: jamais enregistrée comme résultat de géocodage
+PROVIDER_FUZZY = "fuzzy"
+# Résultat négatif (ville introuvable), conservé avec un TTL court
+PROVIDER_NONE = "none"
+
+DEFAULT_TTL_SECONDS = 30 * 24 * 3600
+DEFAULT_NEGATIVE_TTL_SECONDS = 30 * 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS geocode (
+    city_key   TEXT PRIMARY KEY,
+    query      TEXT,
+    lon        REAL,
+    lat        REAL,
+    provider   TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+)
+"""
+
+
+class GeocodeStore:
+    """
+    Cache de géocodage durable, partagé par tous les workers d'un même hôte
+
+    Les entrées sont lues en priorité depuis une copie mémoire (chargée au
+    démarrage par warm_load), puis depuis la base SQLite, ce qui permet à une
+    nouvelle réplique de profiter des villes déjà géocodées par les autres.
+    """
+
+    def __init__(self, db_path, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.db_path = db_path
+        self.ttl_seconds = int(ttl_seconds)
+        self._lock = threading.Lock()
+        self._memory = {}
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+        with self._lock:
+            # WAL: lectures concurrentes pendant qu'un autre processus écrit
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(_SCHEMA)
+            self._conn.commit()
+
+    def warm_load(self):
+        """Charge en mémoire toutes les entrées non expirées. Retourne leur nombre."""
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT city_key, lon, lat, provider, expires_at FROM geocode WHERE expires_at > ?",
+                (now,)
+            ).fetchall()
+            for city_key, lon, lat, provider, expires_at in rows:
+                self._memory[city_key] = (lon, lat, provider, expires_at)
+        return len(rows)
+
+    def _get_entry(self, city_key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(city_key)
+            if entry and entry[3] > now:
+                return entry
+            row = self._conn.execute(
+                "SELECT lon, lat, provider, expires_at FROM geocode WHERE city_key = ?",
+                (city_key,)
+            ).fetchone()
+            if row and row[3] > now:
+                self._memory[city_key] = row
+                return row
+            self._memory.pop(city_key, None)
+        return None
+
+    def get(self, city_key):
+        """Retourne (lon, lat) si la ville est connue et non expirée, sinon None."""
+        if not city_key:
+            return None
+        entry = self._get_entry(city_key)
+        if not entry or entry[0] is None or entry[1] is None:
+            return None
+        return (entry[0], entry[1])
+
+    def get_provider(self, city_key):
+        """Provenance de l'entrée (nominatim, graphhopper, offline, none) ou None."""
+        entry = self._get_entry(city_key) if city_key else None
+        return entry[2] if entry else None
+
+    def put(self, city_key, coords, provider, query=None, ttl_seconds=None):
+        """Enregistre les coordonnées (lon, lat) d'une ville avec leur provenance."""
+        if not city_key or not coords:
+            return
+        now = time.time()
+        expires_at = now + (self.ttl_seconds if ttl_seconds is None else int(ttl_seconds))
+        lon, lat = float(coords[0]), float(coords[1])
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode (city_key, query, lon, lat, provider, created_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (city_key, query, lon, lat, provider, now, expires_at)
+            )
+            self._conn.commit()
+            self._memory[city_key] = (lon, lat, provider, expires_at)
+
+    def put_negative(self, city_key, query=None, ttl_seconds=DEFAULT_NEGATIVE_TTL_SECONDS):
+        """Mémorise un échec de géocodage pour ne pas réinterroger les fournisseurs avant expiration."""
+        if not city_key:
+            return
+        now = time.time()
+        expires_at = now + int(ttl_seconds)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode (city_key, query, lon, lat, provider, created_at, expires_at) "
+                "VALUES (?, ?, NULL, NULL, ?, ?, ?)",
+                (city_key, query, PROVIDER_NONE, now, expires_at)
+            )
+            self._conn.commit()
+            self._memory[city_key] = (None, None, PROVIDER_NONE, expires_at)
+
+    def is_negative(self, city_key):
+        """True si un échec récent (non expiré) est mémorisé pour cette ville."""
+        entry = self._get_entry(city_key) if city_key else None
+        return bool(entry) and entry[2] == PROVIDER_NONE
+
+    def purge_expired(self):
+        """Supprime les entrées expirées. Retourne le nombre de lignes supprimées."""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM geocode WHERE expires_at <= ?", (now,))
+            self._conn.commit()
+            self._memory = {k: v for k, v in self._memory.items() if v[3] > now}
+            return cur.rowcount
+
+    def stats(self):
+        """Nombre d'entrées valides par provenance."""
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT provider, COUNT(*) FROM geocode WHERE expires_at > ? GROUP BY provider",
+                (now,)
+            ).fetchall()
+        return {provider: count for provider, count in rows}
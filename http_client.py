@@ -0,0 +1,196 @@
+"""
+Module client HTTP partagé pour les fournisseurs externes (OSRM, GraphHopper, DeepSeek)
+- une session keep-alive (pool de connexions) par hôte
+- nouvelles tentatives unifiées avec backoff exponentiel, en respectant Retry-After
+  (requêtes non idempotentes: seulement si la requête n'a pas pu être envoyée ou sur 429)
+- délai d'attente et nombre d'appels simultanés par fournisseur
+- intégration optionnelle avec les disjoncteurs de provider_health
+"""
+
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+# Réglages par fournisseur: délai (s) et nombre maximal de requêtes simultanées
+DEFAULT_PROVIDER_SETTINGS = {
+    "osrm": {"timeout": 30, "max_concurrency": 8},
+    "graphhopper": {"timeout": 30, "max_concurrency": 4},
+    "deepseek": {"timeout": 60, "max_concurrency": 2},
+    "default": {"timeout": 20, "max_concurrency": 8},
+}
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Méthodes rejouables sans risque (RFC 9110); un POST n'est rejoué que s'il n'a pas été traité
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+
+class ProviderUnavailableError(requests.exceptions.RequestException):
+    """Fournisseur ignoré: disjoncteur ouvert (pannes récentes)."""
+
+
+def _request_not_sent(error):
+    """True si l'erreur est survenue avant l'envoi de la requête (connexion impossible)."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError):
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        return isinstance(reason, NewConnectionError)
+    return False
+
+
+def _retry_after_seconds(response):
+    """Délai demandé par l'en-tête Retry-After (secondes ou date HTTP), sinon None."""
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except Exception:
+        return None
+
+
+class HttpClient:
+    """
+    Client HTTP thread-safe partagé par tout le processus
+
+    Les sessions sont créées à la demande (une par hôte) et réutilisent leurs
+    connexions TLS; les nouvelles tentatives sont gérées ici plutôt qu'à chaque
+    point d'appel.
+    """
+
+    def __init__(self, provider_settings=None, pool_maxsize=16, max_retries=2,
+                 backoff_seconds=1.0, max_retry_after=20.0):
+        self.provider_settings = dict(DEFAULT_PROVIDER_SETTINGS)
+        self.provider_settings.update(provider_settings or {})
+        self.pool_maxsize = int(pool_maxsize)
+        self.max_retries = int(max_retries)
+        self.backoff_seconds = float(backoff_seconds)
+        self.max_retry_after = float(max_retry_after)
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._semaphores = {}
+
+    def _settings(self, provider):
+        return self.provider_settings.get(provider) or self.provider_settings["default"]
+
+    def _session(self, url):
+        parts = urlsplit(url)
+        host = f"{parts.scheme}://{parts.netloc}"
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize, max_retries=0)
+                session.mount(host, adapter)
+                self._sessions[host] = session
+            return session
+
+    def _semaphore(self, provider):
+        key = provider or "default"
+        with self._lock:
+            semaphore = self._semaphores.get(key)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(max(1, int(self._settings(key).get("max_concurrency", 8))))
+                self._semaphores[key] = semaphore
+            return semaphore
+
+    def _backoff(self, attempt):
+        return self.backoff_seconds * (2 ** attempt) + random.uniform(0, self.backoff_seconds / 2)
+
+    def request(self, method, url, provider=None, timeout=None, retries=None, retry_budget=None,
+                breaker=None, idempotent=None, **kwargs):
+        """
+        Envoie une requête avec nouvelles tentatives sur erreur réseau, 429 et 5xx
+
+        Une requête non idempotente (POST par défaut) n'est rejouée que si elle n'a pas
+        pu être envoyée (connexion impossible) ou sur 429: un délai de lecture dépassé ou
+        une erreur 5xx peuvent survenir après son traitement (double facturation).
+
+        Args:
+            provider: nom du fournisseur (délai et concurrence par défaut)
+            timeout: délai de la requête (sinon celui du fournisseur)
+            retries: nombre de nouvelles tentatives (sinon max_retries)
+            idempotent: requête rejouable sans risque (par défaut selon la méthode HTTP)
+            retry_budget: objet partagé avec consume() -> bool, limitant les tentatives
+                entre plusieurs requêtes (ex. tuiles d'une même matrice)
+            breaker: CircuitBreaker du fournisseur (appel refusé s'il est ouvert)
+
+        Returns:
+            requests.Response: dernière réponse reçue (éventuellement en erreur)
+
+        Raises:
+            ProviderUnavailableError si le disjoncteur est ouvert,
+            requests.exceptions.RequestException si aucune réponse n'a été obtenue
+        """
+        if breaker is not None and not breaker.allow():
+            raise ProviderUnavailableError(f"{breaker.name}: fournisseur temporairement désactivé")
+        timeout = timeout if timeout is not None else self._settings(provider).get("timeout", 20)
+        retries = self.max_retries if retries is None else int(retries)
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        session = self._session(url)
+        semaphore = self._semaphore(provider)
+
+        attempt = 0
+        while True:
+            response, error = None, None
+            with semaphore:
+                try:
+                    response = session.request(method, url, timeout=timeout, **kwargs)
+                except requests.exceptions.RequestException as e:
+                    error = e
+            if error is not None:
+                retryable = idempotent or _request_not_sent(error)
+                failed = True
+            else:
+                failed = response.status_code in RETRY_STATUSES
+                retryable = failed and (idempotent or response.status_code == 429)
+            if not failed:
+                if breaker is not None:
+                    breaker.record_success()
+                return response
+            delay = _retry_after_seconds(response)
+            can_retry = (
+                retryable
+                and attempt < retries
+                and (delay is None or delay <= self.max_retry_after)
+                and (retry_budget is None or retry_budget.consume())
+            )
+            if not can_retry:
+                if breaker is not None:
+                    breaker.record_failure()
+                if error is not None:
+                    raise error
+                return response
+            time.sleep(delay if delay is not None else self._backoff(attempt))
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """Client HTTP partagé (par processus), utilisable depuis n'importe quel thread."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
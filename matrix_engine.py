@@ -0,0 +1,352 @@
+"""
+Module d'assemblage des matrices de distances/durées
+Fonctions pures: planification des requêtes à partir des paires manquantes
+et reconstruction de la matrice complète à partir des segments connus.
+"""
+
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from segment_store import quantize_point
+
+EARTH_RADIUS_KM = 6371.0
+# Facteur de correction pour tenir compte des routes réelles
+ROAD_FACTOR = 1.2
+# Au-delà de cette part de paires manquantes, la table complète (découpée en tuiles) est demandée
+FULL_TABLE_MISSING_RATIO = 0.5
+
+
+class RetryBudget:
+    """Nombre de nouvelles tentatives partagé par toutes les tuiles d'une même matrice."""
+
+    def __init__(self, retries):
+        self._remaining = max(0, int(retries))
+        self._lock = threading.Lock()
+
+    def consume(self):
+        """True si une nouvelle tentative est encore autorisée (et la décompte)."""
+        with self._lock:
+            if self._remaining <= 0:
+                return False
+            self._remaining -= 1
+            return True
+
+
+def _as_float_array(values):
+    """Tableau 2D float64; les valeurs manquantes (None) deviennent 0."""
+    try:
+        arr = np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        arr = np.array([[0.0 if v is None else float(v) for v in row] for row in values], dtype=np.float64)
+    return np.nan_to_num(arr, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+class TravelMatrix:
+    """
+    Matrice de trajets compacte, commune à tous les fournisseurs
+
+    - durations: secondes, np.int32 contigu (n×n)
+    - distances: mètres, np.float32 contigu (n×n)
+    - provider: méthode de calcul (OSRM, Maps, Automatique, Géométrique...)
+    - coords / labels: point (lon, lat) et nom du site pour chaque index
+
+    Les accès unitaires (segment, path_duration...) renvoient des types Python
+    natifs, directement utilisables par la planification et les exports.
+    L'objet reste sérialisable (pickle) pour le session_state.
+    """
+
+    def __init__(self, durations, distances=None, provider="", coords=None, labels=None):
+        d = _as_float_array(durations)
+        self.durations = np.ascontiguousarray(np.rint(d), dtype=np.int32)
+        if distances is None:
+            self.distances = np.zeros(self.durations.shape, dtype=np.float32)
+        else:
+            self.distances = np.ascontiguousarray(_as_float_array(distances), dtype=np.float32)
+        self.provider = provider
+        self.coords = [tuple(c) for c in coords] if coords is not None else None
+        self.labels = list(labels) if labels is not None else None
+
+    def __len__(self):
+        return int(self.durations.shape[0])
+
+    @property
+    def n(self):
+        return len(self)
+
+    @property
+    def nbytes(self):
+        return int(self.durations.nbytes + self.distances.nbytes)
+
+    def duration(self, i, j):
+        return int(self.durations[i, j])
+
+    def distance(self, i, j):
+        return float(self.distances[i, j])
+
+    def segment(self, i, j):
+        """(durée en secondes, distance en mètres) du trajet i → j."""
+        return int(self.durations[i, j]), float(self.distances[i, j])
+
+    def path_duration(self, path):
+        """Durée totale (secondes) d'un chemin d'indices."""
+        if len(path) < 2:
+            return 0
+        p = np.asarray(path, dtype=np.intp)
+        return int(self.durations[p[:-1], p[1:]].astype(np.int64).sum())
+
+    def path_distance(self, path):
+        """Distance totale (mètres) d'un chemin d'indices."""
+        if len(path) < 2:
+            return 0.0
+        p = np.asarray(path, dtype=np.intp)
+        return float(self.distances[p[:-1], p[1:]].astype(np.float64).sum())
+
+    def subset(self, indices):
+        """Sous-matrice restreinte aux indices donnés (dans cet ordre)."""
+        idx = np.asarray(indices, dtype=np.intp)
+        sub = TravelMatrix.__new__(TravelMatrix)
+        sub.durations = np.ascontiguousarray(self.durations[np.ix_(idx, idx)])
+        sub.distances = np.ascontiguousarray(self.distances[np.ix_(idx, idx)])
+        sub.provider = self.provider
+        sub.coords = [self.coords[i] for i in indices] if self.coords is not None else None
+        sub.labels = [self.labels[i] for i in indices] if self.labels is not None else None
+        return sub
+
+    def to_lists(self):
+        """(durées, distances) en listes imbriquées (APIs et exports externes)."""
+        return self.durations.tolist(), self.distances.tolist()
+
+
+def haversine_km_matrix(origins, destinations=None, dtype=np.float64):
+    """
+    Distances géodésiques (km) entre deux listes de points (lon, lat), en une opération vectorisée
+
+    Returns:
+        np.ndarray: matrice len(origins) × len(destinations)
+    """
+    o = np.radians(np.asarray(origins, dtype=np.float64).reshape(-1, 2))
+    d = o if destinations is None else np.radians(np.asarray(destinations, dtype=np.float64).reshape(-1, 2))
+    dlon = d[None, :, 0] - o[:, None, 0]
+    dlat = d[None, :, 1] - o[:, None, 1]
+    a = np.sin(dlat / 2) ** 2 + np.cos(o[:, None, 1]) * np.cos(d[None, :, 1]) * np.sin(dlon / 2) ** 2
+    km = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+    return km.astype(dtype, copy=False)
+
+
+def geometric_matrices(coords, kmh=95.0, road_factor=ROAD_FACTOR, dtype=np.float64):
+    """
+    Estimation géométrique (durées en secondes, distances en mètres)
+
+    Distance à vol d'oiseau corrigée par road_factor, durée à vitesse constante kmh.
+
+    Returns:
+        tuple: (durations_sec, distances_m) en np.ndarray n×n (dtype float32 possible)
+    """
+    km = haversine_km_matrix(coords, dtype=np.float64) * road_factor
+    distances = km * 1000.0
+    durations = km / float(kmh) * 3600.0
+    return durations.astype(dtype, copy=False), distances.astype(dtype, copy=False)
+
+
+def missing_pairs(n, known):
+    """Paires (i, j), i != j, absentes du dictionnaire des segments connus."""
+    return {(i, j) for i in range(n) for j in range(n) if i != j and (i, j) not in known}
+
+
+def plan_missing_blocks(n, missing):
+    """
+    Choisit les lignes/colonnes à demander pour couvrir toutes les paires manquantes
+
+    Matrice froide ou majoritairement manquante: table complète, sans calcul de
+    couverture. Sinon, couverture gloutonne (sommet couvrant le plus de paires
+    restantes en premier, compteurs mis à jour à chaque choix): l'ajout d'un seul
+    site donne sources=[nouveau] et destinations=[nouveau] au lieu d'une table N×N complète.
+
+    Returns:
+        list: blocs (sources, destinations) d'indices à demander au fournisseur
+    """
+    if not missing:
+        return []
+    everything = list(range(n))
+    if len(missing) >= FULL_TABLE_MISSING_RATIO * n * (n - 1):
+        return [(everything, everything)]
+
+    by_row, by_col = defaultdict(set), defaultdict(set)
+    for i, j in missing:
+        by_row[i].add(j)
+        by_col[j].add(i)
+    rows, cols = set(), set()
+    while by_row:
+        best_row = max(by_row, key=lambda i: len(by_row[i]))
+        best_col = max(by_col, key=lambda j: len(by_col[j]))
+        if len(by_row[best_row]) >= len(by_col[best_col]):
+            rows.add(best_row)
+            for j in by_row.pop(best_row):
+                by_col[j].discard(best_row)
+                if not by_col[j]:
+                    del by_col[j]
+        else:
+            cols.add(best_col)
+            for i in by_col.pop(best_col):
+                by_row[i].discard(best_col)
+                if not by_row[i]:
+                    del by_row[i]
+        if len(rows) + len(cols) >= n:
+            # Couverture aussi coûteuse qu'une table complète
+            return [(everything, everything)]
+    blocks = []
+    if rows:
+        destinations = sorted({j for i, j in missing if i in rows})
+        blocks.append((sorted(rows), destinations))
+    if cols:
+        sources = sorted({i for i, j in missing if j in cols and i not in rows})
+        if sources:
+            blocks.append((sources, sorted(cols)))
+    return blocks
+
+
+def _chunks(items, size):
+    return [items[k:k + size] for k in range(0, len(items), size)]
+
+
+def tile_block(sources, destinations, max_points):
+    """
+    Découpe un bloc sources × destinations en tuiles respectant une limite de points par requête
+
+    Chaque tuile contient au plus max_points // 2 sources et autant de destinations,
+    soit au plus max_points points distincts.
+    """
+    if not max_points or len(set(sources) | set(destinations)) <= max_points:
+        return [(sources, destinations)]
+    size = max(1, max_points // 2)
+    return [(src, dst) for src in _chunks(list(sources), size) for dst in _chunks(list(destinations), size)]
+
+
+def assemble_matrix(n, known):
+    """Matrices (durées, distances) n×n à partir de {(i, j): (durée, distance)}; diagonale à 0."""
+    durations = [[0.0] * n for _ in range(n)]
+    distances = [[0.0] * n for _ in range(n)]
+    for (i, j), (duration, distance) in known.items():
+        durations[i][j] = duration
+        distances[i][j] = distance
+    return durations, distances
+
+
+def splice_known_segments(old_coords, old_durations, old_distances, new_coords):
+    """
+    Reprend les segments d'une matrice déjà calculée pour une nouvelle liste de points
+
+    Les points sont appariés par coordonnées quantifiées: l'ajout ou le retrait
+    d'un site conserve toutes les paires existantes.
+
+    Returns:
+        dict: {(i, j): (durée, distance)} indexé sur new_coords
+    """
+    if not old_coords or old_durations is None or old_distances is None or len(old_durations) == 0:
+        return {}
+    old_index = {}
+    for idx, coord in enumerate(old_coords):
+        old_index.setdefault(quantize_point(coord), idx)
+    mapped = [old_index.get(quantize_point(c)) for c in new_coords]
+    known = {}
+    for i, oi in enumerate(mapped):
+        if oi is None:
+            continue
+        for j, oj in enumerate(mapped):
+            if i == j or oj is None or oi == oj:
+                continue
+            try:
+                duration, distance = old_durations[oi][oj], old_distances[oi][oj]
+            except (IndexError, TypeError):
+                continue
+            if duration is not None and distance is not None:
+                known[(i, j)] = (duration, distance)
+    return known
+
+
+def build_matrix_from_segments(coords, store, provider_id, fetch_block, previous=None,
+                               max_block_points=None, max_workers=1):
+    """
+    Matrice complète en ne demandant au fournisseur que les segments inconnus
+
+    Args:
+        coords: liste de (lon, lat)
+        store: SegmentStore (ou None pour tout demander)
+        provider_id: identifiant du fournisseur dans le store
+        fetch_block: fonction (points, sources, destinations) -> (durations, distances, message)
+            où durations/distances sont des matrices len(sources) × len(destinations)
+        previous: (anciens coords, durées, distances) d'une matrice du même fournisseur,
+            dont les segments sont réutilisés (mise à jour incrémentale)
+        max_block_points: nombre maximal de points par requête (blocs découpés en tuiles)
+        max_workers: nombre de tuiles demandées en parallèle
+
+    Chaque tuile réussie est enregistrée aussitôt dans le store: après un échec
+    partiel, une nouvelle tentative ne redemande que les tuiles manquantes.
+
+    Returns:
+        tuple: (durations_sec, distances_m, message), (None, None, message) en cas d'échec
+    """
+    # Points identiques (base au départ et au retour) regroupés: segment nul
+    keys = [quantize_point(c) for c in coords]
+    unique_keys = list(dict.fromkeys(keys))
+    points = [coords[keys.index(k)] for k in unique_keys]
+    position = {k: idx for idx, k in enumerate(unique_keys)}
+    m = len(points)
+
+    known = store.get_many(provider_id, points) if store is not None else {}
+    if previous:
+        for pair, segment in splice_known_segments(*previous, points).items():
+            known.setdefault(pair, segment)
+    missing = missing_pairs(m, known)
+    tiles = [
+        tile
+        for sources, destinations in plan_missing_blocks(m, missing)
+        for tile in tile_block(sources, destinations, max_block_points)
+    ]
+
+    def _run_tile(tile):
+        sources, destinations = tile
+        durations, distances, message = fetch_block(points, sources, destinations)
+        if durations is None or distances is None:
+            return None, message
+        fetched = {}
+        for a, i in enumerate(sources):
+            for b, j in enumerate(destinations):
+                if i == j:
+                    continue
+                duration, distance = durations[a][b], distances[a][b]
+                if duration is None or distance is None:
+                    return None, f"Segment non routable entre les points {i + 1} et {j + 1}"
+                fetched[(i, j)] = (duration, distance)
+        if store is not None:
+            store.put_many(provider_id, [(points[i], points[j], d, dist) for (i, j), (d, dist) in fetched.items()])
+        return fetched, message
+
+    if len(tiles) > 1 and max_workers > 1:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(tiles))) as executor:
+            results = list(executor.map(_run_tile, tiles))
+    else:
+        results = []
+        for tile in tiles:
+            results.append(_run_tile(tile))
+            if results[-1][0] is None:
+                break
+
+    requested = 0
+    for fetched, message in results:
+        if fetched is None:
+            failed = sum(1 for f, _ in results if f is None)
+            return None, None, f"{message} ({failed}/{len(tiles)} bloc(s) en échec)" if len(tiles) > 1 else message
+        known.update(fetched)
+        requested += len(fetched)
+
+    unique_durations, unique_distances = assemble_matrix(m, known)
+    idx = [position[k] for k in keys]
+    durations = [[unique_durations[a][b] for b in idx] for a in idx]
+    distances = [[unique_distances[a][b] for b in idx] for a in idx]
+    cached = m * (m - 1) - requested
+    return durations, distances, f"Succès ({requested} segments demandés, {cached} en cache)"
+
@@ -2,14 +2,24 @@ import os
 import json
 from datetime import datetime, timedelta, time
 import time as time_module
-from itertools import permutations
 import requests
 import toml
 import re
-import unicodedata
+import queue
+import threading
+from math import radians, sin, cos, sqrt, atan2
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeoutError
 
 import streamlit as st
 import pandas as pd
+import numpy as np
+
+# Contexte Streamlit pour les threads de travail (appels st.* hors du thread principal)
+try:
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+except Exception:
+    add_script_run_ctx = None
+    get_script_run_ctx = None
 
 # --------------------------
 # CONFIG APP (DOIT ÊTRE EN PREMIER)
@@ -56,6 +66,34 @@ except ImportError as e:
 from geopy.geocoders import Nominatim
 from geopy.extra.rate_limiter import RateLimiter
 
+from geocode_store import GeocodeStore, PROVIDER_NOMINATIM, PROVIDER_GRAPHHOPPER, PROVIDER_OFFLINE, PROVIDER_FUZZY
+from provider_health import get_breaker
+from segment_store import SegmentStore, quantize_point as segment_store_key
+from route_geometry import (
+    RouteGeometryStore,
+    decode_polyline,
+    encode_polyline,
+    simplify_for_zoom,
+    simplify_polyline,
+)
+from provider_race import race_providers
+from http_client import get_http_client
+from planning_deadline import PlanningDeadline
+from schedule_sim import ScheduleParams, build_itinerary, optimize_days_then_distance
+from tsp_solver import (
+    HELD_KARP_MAX_NODES,
+    held_karp_fixed_start_end,
+    local_search,
+    multi_start_ils,
+    path_cost,
+    split_tour_balanced,
+)
+from matrix_engine import (
+    ROAD_FACTOR, RetryBudget, TravelMatrix, build_matrix_from_segments, geometric_matrices,
+    haversine_km_matrix
+)
+from gazetteer import normalize_city_key, lookup_city as gazetteer_lookup_city, autocorrect_city, suggest_cities
+
 import folium
 from streamlit_folium import st_folium
 
@@ -137,6 +175,8 @@ with st.sidebar.expander("Options avancées"):
     config_cache = secrets_settings.get("use_cache")
     config_debug = secrets_settings.get("debug_mode")
     config_osrm = secrets_settings.get("osrm_base_url")
+    config_deadline = secrets_settings.get("planning_deadline_seconds")
+    config_tsp_budget = secrets_settings.get("tsp_time_budget_seconds")
 
     if config_speed is None:
         config_speed = local_config.get('settings', {}).get('default_speed_kmh', 95)
@@ -146,6 +186,10 @@ with st.sidebar.expander("Options avancées"):
         config_debug = local_config.get('settings', {}).get('debug_mode', False)
     if config_osrm is None:
         config_osrm = local_config.get('settings', {}).get('osrm_base_url', "https://router.project-osrm.org")
+    if config_deadline is None:
+        config_deadline = local_config.get('settings', {}).get('planning_deadline_seconds', 0)
+    if config_tsp_budget is None:
+        config_tsp_budget = local_config.get('settings', {}).get('tsp_time_budget_seconds', 5)
     
     default_speed_kmh = st.number_input(
         "Vitesse moyenne (km/h) pour estimations", 
@@ -153,10 +197,10 @@ with st.sidebar.expander("Options avancées"):
     )
     use_cache = st.checkbox("Utiliser le cache pour géocodage", value=config_cache)
     prefer_offline_geocoding = st.checkbox(
-        "Prioriser coordonnées locales pour grandes villes",
+        "Prioriser coordonnées locales (gazetteer hors-ligne)",
         value=True,
         key="prefer_offline_geocoding",
-        help="Utiliser des coordonnées vérifiées pour grandes villes du Sénégal (ex. Dakar, Louga, Touba)."
+        help="Utiliser les coordonnées vérifiées et le gazetteer des localités du Sénégal avant tout appel réseau (ex. Dakar, Louga, Touba)."
     )
     debug_mode = st.checkbox("Mode debug (afficher détails calculs)", value=config_debug)
     osrm_base_url = st.text_input(
@@ -164,6 +208,16 @@ with st.sidebar.expander("Options avancées"):
         value=config_osrm,
         help="Exemple: http://localhost:5000 ou https://router.project-osrm.org"
     )
+    planning_deadline_s = st.number_input(
+        "Délai max de planification (s)",
+        min_value=0, max_value=600, value=int(config_deadline),
+        help="Budget global réparti entre les étapes; une étape hors délai bascule sur son calcul local (coordonnées hors-ligne pour les villes connues, matrice géométrique, TSP local). Le géocodage des autres villes se poursuit. 0 = sans limite."
+    )
+    tsp_time_budget_s = st.number_input(
+        "Budget optimisation multi-départs (s)",
+        min_value=1, max_value=120, value=int(config_tsp_budget),
+        help=f"Au-delà de {HELD_KARP_MAX_NODES} sites: recherches locales itérées indépendantes, réparties sur les cœurs du serveur; la meilleure tournée trouvée dans ce délai est retenue."
+    )
 
 # --------------------------
 # ÉTAT DE SESSION
@@ -936,8 +990,10 @@ def generate_enhanced_ai_report(mission_data, questions_data, api_key):
             "max_tokens": max_tokens
         }
         
-        response = requests.post(
+        response = get_http_client().post(
             "https://api.deepseek.com/chat/completions",
+            provider="deepseek",
+            retries=0,
             headers=headers,
             json=data,
             timeout=90
@@ -1238,8 +1294,10 @@ Le procès-verbal doit être conforme aux standards administratifs et prêt pour
             'max_tokens': 2000
         }
         
-        response = requests.post(
+        response = get_http_client().post(
             'https://api.deepseek.com/chat/completions',
+            provider="deepseek",
+            retries=0,
             headers=headers,
             json=data,
             timeout=30
@@ -1284,7 +1342,7 @@ def test_graphhopper_connection(api_key):
         headers = {"Content-Type": "application/json"}
         params = {"key": api_key}
         
-        response = requests.post(url, json=data, params=params, headers=headers, timeout=10)
+        response = get_http_client().post(url, provider="graphhopper", retries=0, json=data, params=params, headers=headers, timeout=10)
         
         if response.status_code == 200:
             result = response.json()
@@ -1314,16 +1372,98 @@ def _get_matrix_ttl_seconds():
     except Exception:
         return 24 * 3600
 
-@st.cache_data(ttl=_get_matrix_ttl_seconds(), show_spinner=False)
+def _get_segment_ttl_seconds():
+    """TTL des segments persistants (par défaut celui des matrices)."""
+    try:
+        return int(st.secrets.get("SEGMENT_TTL_SECONDS", _get_matrix_ttl_seconds()))
+    except Exception:
+        return _get_matrix_ttl_seconds()
+
+@st.cache_resource(show_spinner=False)
+def _get_segment_store():
+    """Store des segments origine → destination, partagé avec le cache de géocodage."""
+    return SegmentStore(_get_cache_db_path(), ttl_seconds=_get_segment_ttl_seconds())
+
+def _safe_segment_store():
+    try:
+        return _get_segment_store()
+    except Exception:
+        return None
+
+def _get_graphhopper_matrix_limits():
+    """Points max par requête GraphHopper Matrix et nombre de tuiles en parallèle."""
+    try:
+        max_points = int(st.secrets.get("GRAPHHOPPER_MATRIX_MAX_POINTS", 25))
+        workers = int(st.secrets.get("GRAPHHOPPER_MATRIX_WORKERS", 4))
+    except Exception:
+        max_points, workers = 25, 4
+    return max(2, max_points), max(1, workers)
+
+def _graphhopper_matrix_block(api_key, points, sources, destinations, retry_budget=None):
+    """Requête GraphHopper Matrix pour un bloc sources × destinations (indices dans points).
+    `retry_budget` (RetryBudget) limite le total des nouvelles tentatives entre tuiles.
+    """
+    url = "https://graphhopper.com/api/1/matrix"
+    if len(sources) == len(points) and len(destinations) == len(points):
+        data = {"points": [[p[0], p[1]] for p in points]}
+    else:
+        data = {
+            "from_points": [[points[i][0], points[i][1]] for i in sources],
+            "to_points": [[points[j][0], points[j][1]] for j in destinations],
+        }
+    data.update({"profile": "car", "out_arrays": ["times", "distances"]})
+    headers = {"Content-Type": "application/json"}
+    params = {"key": api_key}
+
+    # Nouvelles tentatives (429/5xx, Retry-After) gérées par le client HTTP partagé
+    try:
+        response = get_http_client().post(
+            url, provider="graphhopper", retry_budget=retry_budget, idempotent=True,
+            breaker=_get_provider_breaker("graphhopper_matrix"),
+            json=data, params=params, headers=headers, timeout=30
+        )
+    except Exception as e:
+        return None, None, f"Échec après retries: {str(e)}"
+    
+    if response.status_code == 200:
+        result = response.json()
+        times = result.get("times")
+        distances = result.get("distances")
+        if not times or not distances:
+            return None, None, "Données manquantes dans la réponse"
+        try:
+            flat_times = [t for row in times for t in row if t is not None]
+            max_time = max(flat_times) if flat_times else 0
+        except Exception:
+            max_time = 0
+        durations = [[(t / 1000.0 if t is not None else None) for t in row] for row in times] if max_time > 100000 else times
+        return durations, distances, "Succès"
+    elif response.status_code == 401:
+        return None, None, "Clé API invalide"
+    elif response.status_code == 400:
+        try:
+            error_detail = response.json()
+            error_msg = error_detail.get('message', 'Requête invalide')
+            return None, None, f"Erreur HTTP 400: {error_msg}. Vérifiez que toutes les villes sont valides et géolocalisables."
+        except:
+            return None, None, "Erreur HTTP 400: Requête invalide. Vérifiez que toutes les villes sont valides et géolocalisables."
+    elif response.status_code == 429:
+        return None, None, "Échec après retries: Limite de requêtes atteinte"
+    elif 500 <= response.status_code < 600:
+        return None, None, f"Échec après retries: Erreur HTTP {response.status_code}"
+    else:
+        return None, None, f"Erreur HTTP {response.status_code}"
+
 def improved_graphhopper_duration_matrix(api_key, coords):
-    """Calcul de matrice via GraphHopper avec gestion d'erreurs"""
+    """Calcul de matrice via GraphHopper avec gestion d'erreurs.
+    Seuls les segments absents du store persistant sont demandés à l'API; au-delà
+    de la limite de points par requête, la matrice est découpée en tuiles demandées
+    en parallèle puis assemblée.
+    """
     if not api_key:
         return None, None, "Clé API manquante"
     
     try:
-        if len(coords) > 25:
-            return None, None, f"Trop de points ({len(coords)}), limite: 25"
-        
         # Vérifier que toutes les coordonnées sont valides
         for i, coord in enumerate(coords):
             if not coord or len(coord) != 2:
@@ -1332,127 +1472,308 @@ def improved_graphhopper_duration_matrix(api_key, coords):
             if not (-180 <= lon <= 180) or not (-90 <= lat <= 90):
                 return None, None, f"Coordonnées hors limites pour le point {i+1}: ({lon}, {lat})"
         
-        points = [[coord[0], coord[1]] for coord in coords]
-        url = "https://graphhopper.com/api/1/matrix"
-        data = {
-            "points": points,
-            "profile": "car",
-            "out_arrays": ["times", "distances"]
-        }
-        headers = {"Content-Type": "application/json"}
-        params = {"key": api_key}
-
-        last_error = None
-        for attempt in range(3):
-            try:
-                response = requests.post(url, json=data, params=params, headers=headers, timeout=30)
-            except Exception as e:
-                last_error = str(e)
-                time_module.sleep(1 + attempt)
-                continue
-            
-            if response.status_code == 200:
-                result = response.json()
-                times = result.get("times")
-                distances = result.get("distances")
-                if not times or not distances:
-                    return None, None, "Données manquantes dans la réponse"
-                try:
-                    flat_times = [t for row in times for t in row]
-                    max_time = max(flat_times) if flat_times else 0
-                except Exception:
-                    max_time = 0
-                durations = [[t / 1000.0 for t in row] for row in times] if max_time > 100000 else times
-                return durations, distances, "Succès"
-            else:
-                if response.status_code == 401:
-                    return None, None, "Clé API invalide"
-                elif response.status_code == 400:
-                    try:
-                        error_detail = response.json()
-                        error_msg = error_detail.get('message', 'Requête invalide')
-                        return None, None, f"Erreur HTTP 400: {error_msg}. Vérifiez que toutes les villes sont valides et géolocalisables."
-                    except:
-                        return None, None, "Erreur HTTP 400: Requête invalide. Vérifiez que toutes les villes sont valides et géolocalisables."
-                elif response.status_code == 429:
-                    last_error = "Limite de requêtes atteinte"
-                    time_module.sleep(2 + attempt)
-                    continue
-                elif 500 <= response.status_code < 600:
-                    last_error = f"Erreur HTTP {response.status_code}"
-                    time_module.sleep(1 + attempt)
-                    continue
-                else:
-                    return None, None, f"Erreur HTTP {response.status_code}"
-        return None, None, f"Échec après retries: {last_error or 'Erreur inconnue'}"
+        max_points, workers = _get_graphhopper_matrix_limits()
+        retry_budget = RetryBudget(6)
+        return build_matrix_from_segments(
+            coords,
+            _safe_segment_store(),
+            "graphhopper:car",
+            lambda points, sources, destinations: _graphhopper_matrix_block(
+                api_key, points, sources, destinations, retry_budget=retry_budget
+            ),
+            max_block_points=max_points,
+            max_workers=workers
+        )
     except Exception as e:
         return None, None, f"Erreur: {str(e)}"
 
-@st.cache_data(ttl=_get_matrix_ttl_seconds(), show_spinner=False)
-def improved_osrm_duration_matrix(base_url, coords):
+def _get_osrm_table_limits():
+    """Points max par requête OSRM Table (longueur d'URL) et nombre de blocs en parallèle."""
+    try:
+        max_points = int(st.secrets.get("OSRM_TABLE_MAX_POINTS", 60))
+        workers = int(st.secrets.get("OSRM_TABLE_WORKERS", 4))
+    except Exception:
+        max_points, workers = 60, 4
+    return max(2, max_points), max(1, workers)
+
+def _osrm_table_block(base_url, points, sources, destinations):
+    """Requête OSRM Table pour un bloc sources × destinations (indices dans points).
+    Seules les coordonnées du bloc sont envoyées (URL courte), avec sources/destinations relatifs.
+    Retourne (durations_sec, distances_m, message) de taille len(sources) × len(destinations).
+    """
+    block_points = list(dict.fromkeys(list(sources) + list(destinations)))
+    local = {idx: k for k, idx in enumerate(block_points)}
+    try:
+        coord_str = ';'.join([f"{points[idx][0]},{points[idx][1]}" for idx in block_points])
+    except Exception:
+        return None, None, "Coordonnées invalides"
+    url = f"{base_url.rstrip('/')}/table/v1/driving/{coord_str}"
+    params = {"annotations": "duration,distance"}
+    if len(sources) < len(block_points):
+        params["sources"] = ';'.join(str(local[i]) for i in sources)
+    if len(destinations) < len(block_points):
+        params["destinations"] = ';'.join(str(local[j]) for j in destinations)
+    headers = {"Accept": "application/json"}
+
+    # Nouvelles tentatives (429/5xx, Retry-After) gérées par le client HTTP partagé
+    try:
+        response = get_http_client().get(
+            url, provider="osrm", breaker=_get_provider_breaker(f"osrm:{base_url.rstrip('/')}"),
+            params=params, headers=headers, timeout=30
+        )
+    except Exception as e:
+        return None, None, f"Échec après retries: {str(e)}"
+    if response.status_code == 200:
+        result = response.json()
+        durations = result.get("durations")
+        distances = result.get("distances")
+        if durations is None:
+            return None, None, "Données manquantes: durations"
+        # OSRM fournit les durées en secondes; distances en mètres si activées
+        if distances is None:
+            # Fallback distances via Haversine (corrigé 1.2) si non fournies
+            km = haversine_km_matrix([points[i] for i in sources], [points[j] for j in destinations])
+            distances = (km * ROAD_FACTOR * 1000.0).tolist()
+        return durations, distances, "Succès"
+    elif response.status_code == 429:
+        return None, None, "Échec après retries: Limite de requêtes atteinte (OSRM)"
+    elif 500 <= response.status_code < 600:
+        return None, None, f"Échec après retries: Erreur HTTP {response.status_code} (OSRM)"
+    elif response.status_code == 400:
+        try:
+            err = response.json()
+            msg = err.get('message') or err.get('error') or 'Requête invalide (OSRM)'
+            return None, None, f"Erreur HTTP 400: {msg}"
+        except Exception:
+            return None, None, "Erreur HTTP 400: Requête invalide (OSRM)"
+    else:
+        return None, None, f"Erreur HTTP {response.status_code} (OSRM)"
+
+def improved_osrm_duration_matrix(base_url, coords, previous=None):
     """Calcul de matrice via OSRM Table avec gestion d'erreurs et fallback distances.
+    Seuls les segments absents du store persistant (et de la matrice précédente
+    `previous` = (coords, durées, distances), si fournie) sont demandés via sources/destinations.
     Retourne (durations_sec, distances_m, message).
     """
     if not base_url:
         return None, None, "URL de base OSRM manquante"
     try:
-        if len(coords) > 100:
-            return None, None, f"Trop de points ({len(coords)}), limite recommandée: 100"
-        # Préparer la chaîne de coordonnées pour l'API OSRM
-        try:
-            coord_str = ';'.join([f"{c[0]},{c[1]}" for c in coords])
-        except Exception:
-            return None, None, "Coordonnées invalides"
-        url = f"{base_url.rstrip('/')}/table/v1/driving/{coord_str}"
-        params = {"annotations": "duration,distance"}
-        headers = {"Accept": "application/json"}
+        # Grandes matrices: blocs sources × destinations demandés en parallèle
+        max_points, workers = _get_osrm_table_limits()
+        return build_matrix_from_segments(
+            coords,
+            _safe_segment_store(),
+            f"osrm:{base_url.rstrip('/')}",
+            lambda points, sources, destinations: _osrm_table_block(base_url, points, sources, destinations),
+            previous=previous,
+            max_block_points=max_points,
+            max_workers=workers
+        )
+    except Exception as e:
+        return None, None, f"Erreur: {str(e)}"
 
-        last_error = None
-        for attempt in range(3):
-            try:
-                response = requests.get(url, params=params, headers=headers, timeout=30)
-            except Exception as e:
-                last_error = str(e)
-                time_module.sleep(1 + attempt)
-                continue
-            if response.status_code == 200:
-                result = response.json()
-                durations = result.get("durations")
-                distances = result.get("distances")
-                if durations is None:
-                    return None, None, "Données manquantes: durations"
-                # OSRM fournit les durées en secondes; distances en mètres si activées
-                if distances is None:
-                    # Fallback distances via Haversine (corrigé 1.2) si non fournies
-                    n = len(coords)
-                    distances = [[0.0]*n for _ in range(n)]
-                    for i in range(n):
-                        for j in range(n):
-                            if i != j:
-                                km = haversine(coords[i][0], coords[i][1], coords[j][0], coords[j][1]) * 1.2
-                                distances[i][j] = km * 1000.0
-                return durations, distances, "Succès"
-            else:
-                if response.status_code == 429:
-                    last_error = "Limite de requêtes atteinte (OSRM)"
-                    time_module.sleep(2 + attempt)
-                    continue
-                elif 500 <= response.status_code < 600:
-                    last_error = f"Erreur HTTP {response.status_code} (OSRM)"
-                    time_module.sleep(1 + attempt)
+def repair_zero_segments(pairs, coords, osrm_base_url=None, graphhopper_api_key=None,
+                         speed_kmh=95.0, timeout=None):
+    """Recalcule en lot les segments nuls de la matrice.
+    Les couples déjà connus du store persistant sont servis directement; les autres sont
+    demandés en une seule requête OSRM Table (sources/destinations restreintes) et une seule
+    requête GraphHopper Matrix, lancées en parallèle. Fallback géométrique en dernier recours.
+
+    Args:
+        pairs: liste de (from_idx, to_idx) dans coords
+        timeout: délai maximal (s) pour les requêtes réseau (None = sans limite)
+
+    Returns:
+        dict: {(from_idx, to_idx): (duration_s, distance_m, méthode)} avec méthode OSRM, Maps ou Geo
+    """
+    store = _safe_segment_store()
+    osrm_id = f"osrm:{osrm_base_url.rstrip('/')}" if osrm_base_url else None
+    gh_id = "graphhopper:car"
+    repaired = {}
+    to_fetch = []
+    for i, j in dict.fromkeys(pairs):
+        if segment_store_key(coords[i]) == segment_store_key(coords[j]):
+            repaired[(i, j)] = (0, 0, "Geo")
+            continue
+        found = None
+        if store is not None:
+            for provider_id, method in ((osrm_id, "OSRM"), (gh_id, "Maps")):
+                if provider_id is None:
                     continue
-                elif response.status_code == 400:
+                pair = (tuple(coords[i]), tuple(coords[j]))
+                hit = store.get_pairs(provider_id, [pair]).get(pair)
+                if hit and hit[0] > 0 and hit[1] > 0:
+                    found = (int(hit[0]), int(hit[1]), method)
+                    break
+        if found:
+            repaired[(i, j)] = found
+        else:
+            to_fetch.append((i, j))
+
+    if to_fetch:
+        sources = sorted({i for i, _ in to_fetch})
+        destinations = sorted({j for _, j in to_fetch})
+        tasks = {}
+        if osrm_base_url:
+            tasks["OSRM"] = lambda: _osrm_table_block(osrm_base_url, coords, sources, destinations)
+        gh_max_points, _ = _get_graphhopper_matrix_limits()
+        if graphhopper_api_key and len(set(sources) | set(destinations)) <= gh_max_points:
+            tasks["Maps"] = lambda: _graphhopper_matrix_block(graphhopper_api_key, coords, sources, destinations)
+
+        blocks = {}
+        if tasks:
+            executor = ThreadPoolExecutor(max_workers=len(tasks))
+            futures = {executor.submit(fn): method for method, fn in tasks.items()}
+            try:
+                for future in as_completed(futures, timeout=timeout):
                     try:
-                        err = response.json()
-                        msg = err.get('message') or err.get('error') or 'Requête invalide (OSRM)'
-                        return None, None, f"Erreur HTTP 400: {msg}"
+                        durations, distances, _ = future.result()
                     except Exception:
-                        return None, None, "Erreur HTTP 400: Requête invalide (OSRM)"
-                else:
-                    return None, None, f"Erreur HTTP {response.status_code} (OSRM)"
-        return None, None, f"Échec après retries: {last_error or 'Erreur inconnue'}"
-    except Exception as e:
-        return None, None, f"Erreur: {str(e)}"
+                        continue
+                    if durations is not None and distances is not None:
+                        blocks[futures[future]] = (durations, distances)
+            except FutureTimeoutError:
+                pass
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+        row = {i: a for a, i in enumerate(sources)}
+        col = {j: b for b, j in enumerate(destinations)}
+        persist = {"OSRM": [], "Maps": []}
+        for i, j in to_fetch:
+            result = None
+            for method in ("OSRM", "Maps"):
+                if method not in blocks:
+                    continue
+                durations, distances = blocks[method]
+                duration, distance = durations[row[i]][col[j]], distances[row[i]][col[j]]
+                if duration and distance and duration > 0 and distance > 0:
+                    result = (int(duration), int(distance), method)
+                    persist[method].append((coords[i], coords[j], duration, distance))
+                    break
+            if result is None:
+                geometric_km = haversine(coords[i][0], coords[i][1], coords[j][0], coords[j][1]) * ROAD_FACTOR
+                result = (int(geometric_km / speed_kmh * 3600), int(geometric_km * 1000), "Geo")
+            repaired[(i, j)] = result
+        if store is not None:
+            if osrm_id and persist["OSRM"]:
+                store.put_many(osrm_id, persist["OSRM"])
+            if persist["Maps"]:
+                store.put_many(gh_id, persist["Maps"])
+    return repaired
+
+# Zoom de référence pour la simplification des tracés affichés (carte et export HTML)
+ROUTE_DISPLAY_ZOOM = 11
+# Tolérance (m) de simplification des tracés exportés en KML/KMZ
+ROUTE_KML_TOLERANCE_M = 5
+
+def _get_route_geometry_ttl_seconds():
+    """TTL des tracés d'itinéraire persistants (par défaut 7 jours)."""
+    try:
+        return int(st.secrets.get("ROUTE_GEOMETRY_TTL_SECONDS", 7 * 24 * 3600))
+    except Exception:
+        return 7 * 24 * 3600
+
+@st.cache_resource(show_spinner=False)
+def _get_route_geometry_store():
+    """Store des tracés (encoded polyline) indexé par la suite ordonnée des étapes."""
+    return RouteGeometryStore(_get_cache_db_path(), ttl_seconds=_get_route_geometry_ttl_seconds())
+
+def _safe_route_geometry_store():
+    try:
+        return _get_route_geometry_store()
+    except Exception:
+        return None
+
+def _get_osrm_route_max_waypoints():
+    """Nombre maximal d'étapes par requête OSRM Route (longueur d'URL)."""
+    try:
+        return max(2, int(st.secrets.get("OSRM_ROUTE_MAX_WAYPOINTS", 100)))
+    except Exception:
+        return 100
+
+def fetch_osrm_route(base_url, waypoints, timeout=10):
+    """Itinéraire complet en une requête OSRM Route multi-étapes (découpée au-delà de la limite d'étapes).
+    Sans nouvelle tentative et ignoré si le disjoncteur OSRM est ouvert (le tracé est facultatif).
+    Retourne {"legs": [(durée_s, distance_m), ...], "points": [[lat, lon], ...]} ou None en cas d'échec.
+    """
+    if not base_url or not waypoints or len(waypoints) < 2:
+        return None
+    provider_id = "osrm:" + base_url.rstrip('/')
+    store = _safe_route_geometry_store()
+    if store is not None:
+        try:
+            cached = store.get(provider_id, waypoints)
+            if cached and cached.get("legs") and len(cached["legs"]) == len(waypoints) - 1:
+                return cached
+        except Exception:
+            pass
+    breaker = _get_provider_breaker(provider_id)
+    if not breaker.allow():
+        return None
+    max_waypoints = _get_osrm_route_max_waypoints()
+    legs, points = [], []
+    start = 0
+    try:
+        while start < len(waypoints) - 1:
+            # Morceaux consécutifs partageant leur point de jonction
+            chunk = waypoints[start:start + max_waypoints]
+            coord_str = ";".join(f"{c[0]},{c[1]}" for c in chunk)
+            url = f"{base_url.rstrip('/')}/route/v1/driving/{coord_str}"
+            params = {"overview": "full", "geometries": "geojson", "steps": "false"}
+            resp = get_http_client().get(
+                url, provider="osrm", retries=0, breaker=breaker, params=params, timeout=timeout
+            )
+            if resp.status_code != 200:
+                return None
+            data = resp.json()
+            routes = data.get("routes") or []
+            if not routes:
+                return None
+            route = routes[0]
+            chunk_legs = route.get("legs") or []
+            if len(chunk_legs) != len(chunk) - 1:
+                return None
+            legs.extend((float(leg.get("duration", 0) or 0), float(leg.get("distance", 0) or 0)) for leg in chunk_legs)
+            geom = route.get("geometry")
+            if isinstance(geom, dict) and geom.get("coordinates"):
+                chunk_points = [[lat, lon] for lon, lat in geom["coordinates"]]
+                if points and chunk_points and points[-1] == chunk_points[0]:
+                    chunk_points = chunk_points[1:]
+                points.extend(chunk_points)
+            start += len(chunk) - 1
+    except Exception:
+        return None
+    if store is not None and points:
+        try:
+            store.put(provider_id, waypoints, points, legs)
+        except Exception:
+            pass
+    return {"legs": legs, "points": points}
+
+def route_points_for(results, coords_ordered, zoom=None):
+    """Tracé [[lat, lon], ...] de l'itinéraire courant, issu de planning_results.
+    Le tracé est conservé sous forme d'encoded polyline; si l'ordre a changé depuis la
+    planification, il est relu du cache de tracés ou demandé une seule fois à OSRM.
+    Ligne droite en dernier recours, non conservée (nouvel essai au prochain affichage).
+    zoom: simplification Douglas–Peucker pour ce zoom.
+    """
+    waypoints = [tuple(c) for c in (coords_ordered or [])]
+    if results is not None and results.get('route_waypoints') == waypoints and results.get('route_polyline'):
+        points = decode_polyline(results['route_polyline'])
+    else:
+        route = fetch_osrm_route(osrm_base_url, waypoints)
+        if route and route.get("points"):
+            points = route["points"]
+            if results is not None:
+                results['route_waypoints'] = waypoints
+                results['route_polyline'] = encode_polyline(points)
+                results['route_legs'] = route["legs"]
+        else:
+            points = [[c[1], c[0]] for c in waypoints]
+    if zoom is not None:
+        points = simplify_for_zoom(points, zoom)
+    return points
 
 def _get_deepseek_matrix_ttl_seconds():
     """TTL pour le cache de matrices DeepSeek (par défaut 6h)."""
@@ -1461,12 +1782,58 @@ def _get_deepseek_matrix_ttl_seconds():
     except Exception:
         return 6 * 3600
 
-@st.cache_data(ttl=_get_deepseek_matrix_ttl_seconds(), show_spinner=False)
+def _canonical_city_order(cities):
+    """Ordre canonique d'une liste de villes pour les clés de cache.
+    Retourne (villes uniques triées, index de chaque ville d'origine dans cette liste);
+    les doublons et les variantes de casse/espaces partagent le même index.
+    """
+    def _norm(name):
+        return " ".join(str(name).split()).casefold()
+    canonical = []
+    position = {}
+    for name in sorted((" ".join(str(c).split()) for c in cities), key=lambda n: (n.casefold(), n)):
+        key = name.casefold()
+        if key not in position:
+            position[key] = len(canonical)
+            canonical.append(name)
+    return tuple(canonical), [position[_norm(c)] for c in cities]
+
 def improved_deepseek_estimate_matrix(cities, api_key, debug=False):
-    """Estimation via DeepSeek avec distances exactes"""
+    """Estimation via DeepSeek avec distances exactes
+    Le cache est indexé sur l'ensemble trié des villes: un autre ordre de saisie
+    (ou la base ajoutée/retirée en tête) réutilise la même estimation, permutée.
+    """
     if not api_key:
         return None, "DeepSeek non disponible"
-    
+    canonical, index = _canonical_city_order(cities)
+    try:
+        result, message = _deepseek_estimate_matrix_canonical(canonical, api_key)
+    except RuntimeError as e:
+        return None, str(e)
+    seconds_matrix, distances_matrix = result
+    try:
+        idx = np.asarray(index, dtype=np.intp)
+        seconds = np.asarray(seconds_matrix, dtype=np.int64)[np.ix_(idx, idx)]
+        distances = np.asarray(distances_matrix, dtype=np.int64)[np.ix_(idx, idx)]
+    except Exception as e:
+        return None, f"Format invalide: {e}"
+    if debug:
+        message = f"{message} (cache: {len(canonical)} villes uniques)"
+    return (seconds.tolist(), distances.tolist()), message
+
+@st.cache_data(ttl=_get_deepseek_matrix_ttl_seconds(), show_spinner=False)
+def _deepseek_estimate_matrix_canonical(cities, api_key):
+    """Estimation DeepSeek mise en cache pour une liste canonique de villes.
+    Seuls les succès sont mis en cache: un échec lève RuntimeError (message d'erreur),
+    pour qu'une panne passagère ne reste pas mémorisée pendant toute la durée du TTL.
+    """
+    result, message = _request_deepseek_matrix(cities, api_key)
+    if result is None:
+        raise RuntimeError(message)
+    return result, message
+
+def _request_deepseek_matrix(cities, api_key):
+    """Appel DeepSeek pour une liste canonique de villes (tuple trié, sans doublon)"""
     try:
         headers = {
             "Authorization": f"Bearer {api_key}",
@@ -1500,27 +1867,24 @@ Réponds uniquement en JSON:
 
         last_error = None
         for attempt in range(3):
+            # Appel facturé: jamais rejoué automatiquement par le client HTTP
             try:
-                response = requests.post(
+                response = get_http_client().post(
                     "https://api.deepseek.com/chat/completions",
+                    provider="deepseek",
+                    retries=0,
                     headers=headers,
                     json=data,
                     timeout=30
                 )
             except Exception as e:
-                last_error = str(e)
-                time_module.sleep(1 + attempt)
-                continue
+                return None, f"Échec après retries: {str(e)}"
             
             if response.status_code != 200:
                 if response.status_code == 429:
-                    last_error = "Limite de requêtes atteinte"
-                    time_module.sleep(2 + attempt)
-                    continue
+                    return None, "Échec après retries: Limite de requêtes atteinte"
                 elif 500 <= response.status_code < 600:
-                    last_error = f"Erreur HTTP {response.status_code}"
-                    time_module.sleep(1 + attempt)
-                    continue
+                    return None, f"Échec après retries: Erreur HTTP {response.status_code}"
                 else:
                     return None, f"Erreur API: {response.status_code}"
 
@@ -1536,18 +1900,41 @@ Réponds uniquement en JSON:
                     km_matrix = parsed.get("distances_km", [])
                     seconds_matrix = [[int(m) * 60 for m in row] for row in minutes_matrix]
                     distances_matrix = [[int(km * 1000) for km in row] for row in km_matrix]
+                    n = len(cities)
+                    if len(seconds_matrix) != n or any(len(row) != n for row in seconds_matrix) \
+                            or len(distances_matrix) != n or any(len(row) != n for row in distances_matrix):
+                        return None, f"Format invalide: matrice attendue {n}x{n}"
                     return (seconds_matrix, distances_matrix), "Succès DeepSeek"
                 except Exception as parse_err:
                     return None, f"Format invalide: {parse_err}"
             else:
+                # Réponse sans JSON exploitable: nouvelle demande au modèle
                 last_error = "Réponse non JSON"
-                time_module.sleep(1 + attempt)
                 continue
         return None, f"Échec après retries: {last_error or 'Erreur inconnue'}"
     
     except Exception as e:
         return None, f"Erreur: {str(e)}"
 
+def build_excel_from_itinerary(itinerary, start_date, sites_ordered):
+    """Construit le classeur Excel (feuilles Planning et Sites) à partir du planning."""
+    from io import BytesIO
+    excel_data = []
+    for day, sdt, edt, desc in itinerary:
+        excel_data.append({
+            "Jour": day,
+            "Date": (start_date + timedelta(days=day-1)).strftime("%d/%m/%Y"),
+            "Début": sdt.strftime("%H:%M"),
+            "Fin": edt.strftime("%H:%M"),
+            "Durée (min)": int((edt - sdt).total_seconds() / 60),
+            "Activité": desc
+        })
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        pd.DataFrame(excel_data).to_excel(writer, sheet_name='Planning', index=False)
+        pd.DataFrame(sites_ordered).to_excel(writer, sheet_name='Sites', index=False)
+    return output.getvalue()
+
 def build_ics_from_itinerary(itinerary, start_date, mission_title="Mission Terrain"):
     """Construit un fichier ICS à partir du planning."""
     lines = [
@@ -1599,17 +1986,7 @@ def _get_rate_limited_geocode():
 
 def _normalize_city_key(name: str) -> str:
     """Normalise un nom de ville pour les correspondances hors-ligne (sans accents/espaces/ponctuations)."""
-    if not isinstance(name, str):
-        return ""
-    s = name.strip().lower()
-    s = unicodedata.normalize("NFKD", s)
-    s = s.encode("ascii", "ignore").decode("ascii")
-    # Unifier les variantes de 'saint', 'ste', 'st'
-    s = re.sub(r"\bste\b", "saint", s)
-    s = re.sub(r"\bst\b", "saint", s)
-    # Supprimer tout sauf alphanumérique
-    s = re.sub(r"[^a-z0-9]", "", s)
-    return s
+    return normalize_city_key(name)
 
 # Coordonnées approximatives de grandes villes du Sénégal (lon, lat)
 SENEGAL_CITY_COORDS = {
@@ -1640,18 +2017,148 @@ SENEGAL_CITY_COORDS = {
     _normalize_city_key("Richard Toll"): (-15.6994, 16.4611),
 }
 
+# Emprise approximative du Sénégal (lon_min, lon_max, lat_min, lat_max)
+SENEGAL_BBOX = (-17.8, -11.0, 12.0, 16.9)
+
+def _in_senegal_bbox(lon, lat):
+    """Vérifie que des coordonnées sont plausibles pour le Sénégal."""
+    try:
+        lon, lat = float(lon), float(lat)
+    except (TypeError, ValueError):
+        return False
+    return SENEGAL_BBOX[0] <= lon <= SENEGAL_BBOX[1] and SENEGAL_BBOX[2] <= lat <= SENEGAL_BBOX[3]
+
+_LAT_LON_PATTERN = re.compile(r"^\s*(-?\d{1,2}(?:\.\d+)?)\s*[,;]\s*(-?\d{1,3}(?:\.\d+)?)\s*$")
+
+def _parse_lat_lon_text(text):
+    """Analyse une saisie GPS collée au format "lat,lon". Retourne (lon, lat) ou None."""
+    if not isinstance(text, str):
+        return None
+    match = _LAT_LON_PATTERN.match(text)
+    if not match:
+        return None
+    return (float(match.group(2)), float(match.group(1)))
+
+def _cell_text(value):
+    """Texte d'une cellule de l'éditeur: None/NaN → chaîne vide."""
+    if value is None or (isinstance(value, float) and value != value) or value is pd.NA:
+        return ""
+    return str(value).strip()
+
+def _site_direct_coords(site):
+    """Coordonnées saisies directement pour un site (colonnes Latitude/Longitude ou "lat,lon" dans Ville).
+
+    Returns:
+        tuple: ((lon, lat) ou None, message d'erreur ou None)
+    """
+    def _num(value):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return None
+        return None if value != value else value  # NaN → None
+
+    lat = _num(site.get("Latitude"))
+    lon = _num(site.get("Longitude"))
+    if lat is None and lon is None:
+        pasted = _parse_lat_lon_text(site.get("Ville"))
+        if not pasted:
+            return None, None
+        lon, lat = pasted
+    elif lat is None or lon is None:
+        return None, "Latitude et Longitude doivent être renseignées ensemble"
+    if not _in_senegal_bbox(lon, lat):
+        return None, f"Coordonnées ({lat}, {lon}) hors du Sénégal"
+    return (lon, lat), None
+
+_HHMM_PATTERN = re.compile(r"^\s*(\d{1,2})\s*[:hH]\s*(\d{2})?\s*$")
+
+def _parse_hhmm(value):
+    """Heure saisie ("08:30", "8h", "14h30") → datetime.time, None si vide.
+    Lève ValueError si la saisie n'est pas une heure valide.
+    """
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, time):
+        return value
+    text = str(value).strip()
+    if not text:
+        return None
+    match = _HHMM_PATTERN.match(text)
+    if not match:
+        raise ValueError(f"heure invalide '{text}' (format HH:MM)")
+    hours, minutes = int(match.group(1)), int(match.group(2) or 0)
+    if hours > 23 or minutes > 59:
+        raise ValueError(f"heure invalide '{text}' (format HH:MM)")
+    return time(hours, minutes)
+
+def _site_opening_window(site):
+    """Fenêtre d'ouverture (Ouverture, Fermeture) d'un site.
+
+    Returns:
+        tuple: ((time ou None, time ou None), message d'erreur ou None)
+    """
+    try:
+        opening = _parse_hhmm(site.get("Ouverture"))
+        closing = _parse_hhmm(site.get("Fermeture"))
+    except ValueError as e:
+        return (None, None), str(e)
+    if opening and closing and closing <= opening:
+        return (None, None), "Fermeture doit être après Ouverture"
+    return (opening, closing), None
+
 def _offline_lookup_city_coords(city: str):
+    """Coordonnées hors-ligne: dictionnaire vérifié, puis gazetteer des localités du Sénégal."""
     key = _normalize_city_key(city)
-    return SENEGAL_CITY_COORDS.get(key)
+    coords = SENEGAL_CITY_COORDS.get(key)
+    if coords:
+        return coords
+    try:
+        return gazetteer_lookup_city(city)
+    except Exception:
+        return None
+
+def _fuzzy_correct_city(city: str):
+    """Corrige une faute de frappe évidente via l'index flou du gazetteer: (nom corrigé, (lon, lat)) ou None.
+    Dernier recours uniquement (tous les fournisseurs ont échoué): l'index ne couvre pas toutes les
+    localités et un nom réel peut être rapproché d'une autre ville.
+    """
+    try:
+        match = autocorrect_city(city)
+    except Exception:
+        return None
+    if not match:
+        return None
+    st.warning(
+        f"« {city} » introuvable auprès des services de géocodage: corrigé en {match['name']} "
+        f"({match['region']}). Vérifiez la ville ou saisissez ses coordonnées GPS."
+    )
+    return match["name"], (match["lon"], match["lat"])
+
+def _get_provider_breaker(name):
+    """Disjoncteur d'un fournisseur (seuil et refroidissement configurables via secrets)."""
+    try:
+        threshold = int(st.secrets.get("PROVIDER_FAILURE_THRESHOLD", 3))
+        cooldown = int(st.secrets.get("PROVIDER_COOLDOWN_SECONDS", 300))
+    except Exception:
+        threshold, cooldown = 3, 300
+    return get_breaker(name, failure_threshold=threshold, cooldown_seconds=cooldown)
 
 def _graphhopper_geocode(city: str):
     """Fallback via GraphHopper Geocoding API si disponible.
     Sélectionne en priorité les lieux de type city/town/village au Sénégal.
+    Retourne ((lon, lat) ou None, répondu): répondu est vrai si le service a traité
+    la requête (un échec de transport ou un appel ignoré ne prouve pas l'absence de la ville).
     """
+    breaker = _get_provider_breaker("graphhopper_geocode")
+    answered = False
     try:
         gh_key = globals().get("graphhopper_api_key")
         if not gh_key:
-            return None
+            return None, False
+        # Fournisseur en panne récente: pas d'appel pendant le refroidissement
+        if not breaker.allow():
+            return None, False
         url = "https://graphhopper.com/api/1/geocode"
         params = {
             "q": f"{city}, Senegal",
@@ -1659,12 +2166,22 @@ def _graphhopper_geocode(city: str):
             "limit": 8,
             "key": gh_key,
         }
-        resp = requests.get(url, params=params, timeout=10)
+        try:
+            resp = get_http_client().get(url, provider="graphhopper", retries=1, params=params, timeout=10)
+        except Exception:
+            breaker.record_failure()
+            return None, False
         if resp.status_code != 200:
-            return None
+            if resp.status_code in (401, 429) or resp.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            return None, False
+        breaker.record_success()
         hits = (resp.json().get("hits") or [])
+        answered = True
         if not hits:
-            return None
+            return None, answered
         def is_sn(h):
             country = (h.get("country") or h.get("countrycode") or "").lower()
             return country in ("senegal", "sénégal", "sn")
@@ -1685,33 +2202,29 @@ def _graphhopper_geocode(city: str):
         lat = pt.get("lat")
         lng = pt.get("lng")
         if lat is None or lng is None:
-            return None
+            return None, answered
         # Valide que le point est dans un bbox raisonnable pour le Sénégal
-        if not (-17.8 <= float(lng) <= -11.0 and 12.0 <= float(lat) <= 16.9):
-            return None
-        return (float(lng), float(lat))
-    except Exception:
-        return None
-
-def _geocode_city_senegal_raw(city: str):
-    """Implémentation brute sans cache (avec ressource + retries). Privilégie coordonnées locales si activé."""
-    if not city or not isinstance(city, str) or not city.strip():
-        return None
-
-    # Option: préférer coordonnées locales pour grandes villes (fiabilité)
-    try:
-        prefer_offline = st.session_state.get("prefer_offline_geocoding", True)
+        if not _in_senegal_bbox(lng, lat):
+            return None, answered
+        return (float(lng), float(lat)), answered
     except Exception:
-        prefer_offline = True
-    if prefer_offline:
-        offline = _offline_lookup_city_coords(city)
-        if offline:
-            return offline
+        return None, answered
 
+def _nominatim_geocode(city: str, rate_limited=None):
+    """Géocodage Nominatim rate-limité avec 3 tentatives, sans appel Streamlit (utilisable en thread).
+    Retourne ((lon, lat) ou None, dernière erreur, répondu): répondu est vrai si au moins
+    une tentative a obtenu une réponse du service.
+    """
+    if rate_limited is None:
+        rate_limited = _get_rate_limited_geocode()
+    breaker = _get_provider_breaker("nominatim")
     last_error = None
+    answered = False
     for attempt in range(3):  # 3 tentatives
+        # Circuit ouvert: Nominatim est ignoré jusqu'à la fin du refroidissement
+        if not breaker.allow():
+            return None, last_error or f"Nominatim suspendu après des échecs répétés (reprise dans {breaker.remaining_cooldown():.0f}s)", answered
         try:
-            rate_limited = _get_rate_limited_geocode()
             query = f"{city}, Sénégal" if "sénégal" not in city.lower() else city
             
             # Essai principal: ciblé Sénégal
@@ -1720,6 +2233,8 @@ def _geocode_city_senegal_raw(city: str):
             # Fallback: requête générale
             if not loc:
                 loc = rate_limited(city, language="fr")
+            breaker.record_success()
+            answered = True
             
             if loc:
                 lon, lat = (loc.longitude, loc.latitude)
@@ -1732,32 +2247,73 @@ def _geocode_city_senegal_raw(city: str):
                 except Exception:
                     pass
                 # Valide que les coordonnées sont plausibles pour le Sénégal
-                if not (-17.8 <= float(lon) <= -11.0 and 12.0 <= float(lat) <= 16.9):
+                if not _in_senegal_bbox(lon, lat):
                     raise ValueError("Coordonnées hors Sénégal")
-                return (lon, lat)
+                return (lon, lat), None, answered
         
+        except ValueError as e:
+            # Réponse exploitable mais hors Sénégal: le fournisseur fonctionne
+            last_error = e
+            time_module.sleep(1 + attempt) # Attente progressive
+            continue
         except ConnectionRefusedError as e:
+            breaker.record_failure()
             last_error = f"Connexion refusée au service de géocodage. Vérifiez votre connexion ou l'état du service. ({e})"
             time_module.sleep(1 + attempt) # Attente progressive
             continue
         except Exception as e:
+            breaker.record_failure()
             last_error = e
             time_module.sleep(1 + attempt) # Attente progressive
             continue
+    return None, last_error, answered
+
+def _geocode_city_senegal_resolve(city: str):
+    """Implémentation brute sans cache (avec ressource + retries). Privilégie coordonnées locales si activé.
+    Retourne ((lon, lat), provenance, répondu) ou (None, None, répondu); répondu indique
+    qu'au moins un service a traité la requête (absence avérée plutôt que panne).
+    """
+    if not city or not isinstance(city, str) or not city.strip():
+        return None, None, False
+
+    # Option: préférer coordonnées locales pour grandes villes (fiabilité)
+    try:
+        prefer_offline = st.session_state.get("prefer_offline_geocoding", True)
+    except Exception:
+        prefer_offline = True
+    if prefer_offline:
+        offline = _offline_lookup_city_coords(city)
+        if offline:
+            return offline, PROVIDER_OFFLINE, False
+
+    coords, last_error, nominatim_answered = _nominatim_geocode(city)
+    if coords:
+        return coords, PROVIDER_NOMINATIM, True
+
     # Fallback 1: GraphHopper (si clé dispo)
-    gh_coords = _graphhopper_geocode(city)
+    gh_coords, gh_answered = _graphhopper_geocode(city)
+    answered = nominatim_answered or gh_answered
     if gh_coords:
         st.warning(f"Géocodage Nominatim indisponible/inexact. Fallback GraphHopper utilisé pour {city}.")
-        return gh_coords
+        return gh_coords, PROVIDER_GRAPHHOPPER, True
 
     # Fallback 2: Dictionnaire hors-ligne
     offline = _offline_lookup_city_coords(city)
     if offline:
         st.info(f"Mode hors-ligne: coordonnées vérifiées utilisées pour {city}.")
-        return offline
+        return offline, PROVIDER_OFFLINE, answered
+    # Dernier recours: correction floue (signalée, non mise en cache)
+    corrected = _fuzzy_correct_city(city)
+    if corrected:
+        return corrected[1], PROVIDER_FUZZY, answered
 
     st.error(f"Erreur de géocodage persistante pour {city} après plusieurs tentatives: {last_error}")
-    return None
+    return None, None, answered
+
+def _geocode_city_senegal_raw(city: str):
+    """Géocodage sans cache. Retourne (lon, lat) ou None."""
+    coords, _, _ = _geocode_city_senegal_resolve(city)
+    return coords
 
 def _get_geocode_ttl_seconds():
     # TTL configurable via secrets, défaut 7 jours
@@ -1766,53 +2322,264 @@ def _get_geocode_ttl_seconds():
     except Exception:
         return 7 * 24 * 3600
 
-@st.cache_data(ttl=_get_geocode_ttl_seconds(), show_spinner=False)
-def _geocode_city_senegal_cached(city: str):
-    return _geocode_city_senegal_raw(city)
+def _get_geocode_negative_ttl_seconds():
+    # TTL court pour les échecs de géocodage, défaut 30 minutes
+    try:
+        return int(st.secrets.get("GEOCODE_NEGATIVE_TTL_SECONDS", 30 * 60))
+    except Exception:
+        return 30 * 60
+
+def _get_cache_db_path():
+    """Chemin de la base SQLite partagée (secrets → ENV → défaut local)."""
+    try:
+        path = st.secrets.get("CACHE_DB_PATH")
+    except Exception:
+        path = None
+    return path or os.getenv("MISSION_CACHE_DB") or os.path.join(".cache", "mission_cache.sqlite")
+
+@st.cache_resource(show_spinner=False)
+def _get_geocode_store():
+    """Store de géocodage persistant, partagé par les sessions et préchargé au démarrage."""
+    store = GeocodeStore(_get_cache_db_path(), ttl_seconds=_get_geocode_ttl_seconds())
+    store.warm_load()
+    return store
 
 def geocode_city_senegal(city: str, use_cache: bool = True):
-    """Géocode une ville au Sénégal, avec cache TTL et ressource partagée.
+    """Géocode une ville au Sénégal, avec cache persistant (SQLite) et ressource partagée.
 
     Args:
         city: Nom de la ville
         use_cache: Active ou non le cache des résultats
     """
-    return _geocode_city_senegal_cached(city) if use_cache else _geocode_city_senegal_raw(city)
+    if not use_cache:
+        return _geocode_city_senegal_raw(city)
+    key = _normalize_city_key(city)
+    try:
+        store = _get_geocode_store()
+    except Exception:
+        # Base indisponible (disque en lecture seule...): géocodage direct
+        return _geocode_city_senegal_raw(city)
+    cached = store.get(key)
+    if cached:
+        return cached
+    if store.is_negative(key):
+        # Échec récent mémorisé: ne pas repayer les retries réseau à chaque relance
+        return None
+    coords, provider, answered = _geocode_city_senegal_resolve(city)
+    if provider == PROVIDER_FUZZY:
+        # Correction floue: valable pour cette planification seulement
+        return coords
+    if coords:
+        store.put(key, coords, provider, query=city)
+    elif answered:
+        # Échec mémorisé seulement si un service a répondu sans trouver la ville
+        # (jamais après une panne, un délai dépassé ou un disjoncteur ouvert)
+        store.put_negative(key, query=city, ttl_seconds=_get_geocode_negative_ttl_seconds())
+    return coords
+
+def geocode_cities_batch(cities, use_cache: bool = True, on_result=None, max_workers: int = 8, timeout=None):
+    """Géocode un lot de villes en une seule passe.
+
+    Les villes sont dédoublonnées par clé normalisée; les entrées du cache persistant et
+    les coordonnées locales sont servies immédiatement. Les villes restantes sont résolues
+    en concurrence par GraphHopper (requêtes parallèles) et Nominatim (séquentiel, via son
+    rate limiter partagé): le premier résultat valide l'emporte.
+
+    Args:
+        cities: Liste de noms de villes (doublons autorisés)
+        use_cache: Lire et alimenter le cache persistant
+        on_result: Callback on_result(ville, coords, provenance), appelé dans le thread
+            principal au fur et à mesure des résolutions
+        max_workers: Nombre maximal de requêtes GraphHopper simultanées
+        timeout: Délai (secondes) au-delà duquel les villes restantes connues hors-ligne
+            prennent leurs coordonnées locales; les autres continuent d'attendre les services
+
+    Returns:
+        dict: {ville: (lon, lat) ou None} pour chaque ville fournie
+    """
+    by_key = {}
+    for city in cities:
+        key = _normalize_city_key(city)
+        if key and key not in by_key:
+            by_key[key] = city
+
+    store = None
+    if use_cache:
+        try:
+            store = _get_geocode_store()
+        except Exception:
+            store = None
+    try:
+        prefer_offline = st.session_state.get("prefer_offline_geocoding", True)
+    except Exception:
+        prefer_offline = True
+
+    resolved = {}
+    # Villes pour lesquelles au moins un service a répondu (absence avérée, pas une panne)
+    answered = set()
+
+    def _accept(key, coords, provider, persist=True):
+        resolved[key] = coords
+        if persist and store is not None:
+            if coords:
+                store.put(key, coords, provider, query=by_key[key])
+            else:
+                store.put_negative(key, query=by_key[key], ttl_seconds=_get_geocode_negative_ttl_seconds())
+        if on_result:
+            on_result(by_key[key], coords, provider)
+
+    # 1) Cache persistant et coordonnées locales: réponse immédiate
+    misses = []
+    for key, city in by_key.items():
+        cached = store.get(key) if store is not None else None
+        if cached:
+            _accept(key, cached, store.get_provider(key), persist=False)
+            continue
+        if store is not None and store.is_negative(key):
+            _accept(key, None, None, persist=False)
+            continue
+        if prefer_offline:
+            offline = _offline_lookup_city_coords(city)
+            if offline:
+                _accept(key, offline, PROVIDER_OFFLINE)
+                continue
+        misses.append(key)
+
+    # 2) Villes restantes: GraphHopper en parallèle + Nominatim rate-limité, en concurrence
+    if misses:
+        results = queue.Queue()
+        use_graphhopper = bool(graphhopper_api_key)
+        rate_limited = _get_rate_limited_geocode()
 
-def solve_tsp_fixed_start_end(matrix):
-    """Résout le TSP avec départ et arrivée fixes"""
+        def _graphhopper_task(key):
+            coords, gh_answered = _graphhopper_geocode(by_key[key])
+            results.put((key, PROVIDER_GRAPHHOPPER, coords, gh_answered))
+
+        stop = threading.Event()
+        deadline = None if timeout is None else time_module.monotonic() + max(0.0, float(timeout))
+
+        def _nominatim_task():
+            for key in misses:
+                if stop.is_set():
+                    break
+                if key in resolved:
+                    # Déjà résolue par GraphHopper: inutile de consommer le quota Nominatim
+                    results.put((key, PROVIDER_NOMINATIM, None, False))
+                    continue
+                try:
+                    coords, _, nominatim_answered = _nominatim_geocode(by_key[key], rate_limited)
+                except Exception:
+                    coords, nominatim_answered = None, False
+                results.put((key, PROVIDER_NOMINATIM, coords, nominatim_answered))
+
+        outstanding = {key: (2 if use_graphhopper else 1) for key in misses}
+        workers = (min(max_workers, len(misses)) if use_graphhopper else 0) + 1
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            executor.submit(_nominatim_task)
+            if use_graphhopper:
+                for key in misses:
+                    executor.submit(_graphhopper_task, key)
+            while outstanding:
+                try:
+                    wait = None if deadline is None else max(0.0, deadline - time_module.monotonic())
+                    key, provider, coords, provider_answered = results.get(timeout=wait)
+                except queue.Empty:
+                    # Délai écoulé: coordonnées locales pour les villes connues hors-ligne;
+                    # les autres attendent la réponse des services (le délai ne crée pas d'échec)
+                    deadline = None
+                    for key in list(outstanding):
+                        offline = _offline_lookup_city_coords(by_key[key])
+                        if offline:
+                            outstanding.pop(key)
+                            _accept(key, offline, PROVIDER_OFFLINE)
+                    continue
+                if key not in outstanding:
+                    continue
+                outstanding[key] -= 1
+                if provider_answered:
+                    answered.add(key)
+                if coords and key not in resolved:
+                    _accept(key, coords, provider)
+                if key in resolved:
+                    outstanding.pop(key)
+                elif outstanding[key] <= 0:
+                    outstanding.pop(key)
+                    # Dernier recours: dictionnaire hors-ligne puis correction floue (non mise en cache)
+                    offline = _offline_lookup_city_coords(by_key[key])
+                    if offline:
+                        _accept(key, offline, PROVIDER_OFFLINE)
+                        continue
+                    corrected = _fuzzy_correct_city(by_key[key])
+                    if corrected:
+                        _accept(key, corrected[1], PROVIDER_FUZZY, persist=False)
+                    else:
+                        # Échec mémorisé seulement si un service a répondu sans trouver la ville
+                        _accept(key, None, None, persist=key in answered)
+        finally:
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    return {city: resolved.get(_normalize_city_key(city)) for city in cities}
+
+# Préchargement du store au démarrage (une fois par processus grâce au cache ressource)
+try:
+    _get_geocode_store()
+except Exception:
+    pass
+
+def solve_tsp_fixed_start_end(matrix, time_budget_s=None, quick=False):
+    """Résout le TSP avec départ et arrivée fixes
+    time_budget_s: budget de la recherche multi-départs au-delà de HELD_KARP_MAX_NODES
+    (par défaut celui des options avancées)
+    quick: au-delà de HELD_KARP_MAX_NODES, plus proche voisin + recherche locale
+    (quelques millisecondes: éditions interactives, sous-tournées des équipes)
+    """
     n = len(matrix)
     if n <= 2:
         return list(range(n))
     
-    if n > 10:
-        st.warning("Plus de 10 sites: heuristique voisin + 2-opt")
-        nn_path = solve_tsp_nearest_neighbor(matrix)
-        improved_path = two_opt_fixed_start_end(nn_path, matrix)
-        return improved_path
-    
-    nodes = list(range(1, n-1))
-    best_order = None
-    best_time = float("inf")
-    
-    for perm in permutations(nodes):
-        total_time = matrix[0][perm[0]]
-        for i in range(len(perm)-1):
-            total_time += matrix[perm[i]][perm[i+1]]
-        total_time += matrix[perm[-1]][n-1]
-        
-        if total_time < best_time:
-            best_time = total_time
-            best_order = perm
+    if n > HELD_KARP_MAX_NODES and quick:
+        return two_opt_fixed_start_end(solve_tsp_nearest_neighbor(matrix), matrix)
+    if n > HELD_KARP_MAX_NODES:
+        budget = tsp_time_budget_s if time_budget_s is None else time_budget_s
+        try:
+            report = multi_start_ils(matrix, time_budget_s=budget)
+        except Exception as e:
+            st.warning(f"Plus de {HELD_KARP_MAX_NODES} sites: multi-départs indisponible ({str(e)[:60]}), heuristique voisin + 2-opt")
+            nn_path = solve_tsp_nearest_neighbor(matrix)
+            return two_opt_fixed_start_end(nn_path, matrix)
+        spread = report["spread"]
+        st.info(
+            f"Plus de {HELD_KARP_MAX_NODES} sites: {report['starts']} recherches multi-départs "
+            f"({report['workers']} cœur(s), {report['iterations']} perturbations) — "
+            f"meilleure {spread['min']/3600:.2f} h, médiane {spread['median']/3600:.2f} h, "
+            f"pire {spread['max']/3600:.2f} h (écart {spread['gap_pct']:.1f} %)"
+        )
+        return report["path"]
     
-    best_path = [0] + list(best_order) + [n-1]
-    # Lissage via 2-opt si des incohérences existent
-    try:
-        best_path = two_opt_fixed_start_end(best_path, matrix)
-    except Exception:
-        pass
+    # Solution exacte (programmation dynamique de Held–Karp)
+    best_path, _ = held_karp_fixed_start_end(matrix)
     return best_path
 
+def assign_sites_to_teams(travel_matrix, order, service_times, team_count, day_capacity_s=None, refine=None):
+    """Répartit l'itinéraire optimisé entre plusieurs équipes (même départ et même arrivée).
+    La tournée complète est découpée en groupes consécutifs à charge équilibrée, puis
+    l'ordre de chaque équipe est amélioré localement sur sa sous-matrice, ou par
+    refine (ordre -> ordre, indices de la matrice complète) en partant de l'ordre de la tournée.
+    Retourne une liste d'ordres (indices dans la matrice complète), un par équipe.
+    """
+    groups = split_tour_balanced(order, travel_matrix.durations, service_times, team_count, day_capacity_s)
+    team_orders = []
+    for group in groups:
+        indices = [order[0]] + list(group) + [order[-1]]
+        if refine is not None:
+            team_orders.append(list(refine(indices)))
+            continue
+        sub_order = solve_tsp_fixed_start_end(travel_matrix.subset(indices).durations, quick=True)
+        team_orders.append([indices[i] for i in sub_order])
+    return team_orders
+
 def solve_tsp_nearest_neighbor(matrix):
     """Heuristique du plus proche voisin"""
     n = len(matrix)
@@ -1829,29 +2596,12 @@ def solve_tsp_nearest_neighbor(matrix):
     path.append(n-1)
     return path
 
-def path_cost(path, matrix):
-    total = 0
-    for i in range(len(path)-1):
-        total += matrix[path[i]][path[i+1]]
-    return total
-
 def two_opt_fixed_start_end(path, matrix):
-    """Amélioration locale 2-opt en conservant départ (0) et arrivée (n-1)"""
+    """Amélioration locale (2-opt, Or-opt, relocate) en conservant départ (0) et arrivée (n-1)"""
     if not path or len(path) < 4:
         return path
-    improved = True
-    while improved:
-        improved = False
-        for i in range(1, len(path)-2):
-            for k in range(i+1, len(path)-1):
-                new_path = path[:i] + path[i:k+1][::-1] + path[k+1:]
-                if path_cost(new_path, matrix) < path_cost(path, matrix):
-                    path = new_path
-                    improved = True
-                    break
-            if improved:
-                break
-    return path
+    improved_path, _ = local_search(path, matrix)
+    return improved_path
 
 # OR-Tools integration for advanced optimization (TSP with fixed start/end)
 try:
@@ -1871,12 +2621,13 @@ def solve_tsp_ortools_fixed_start_end(matrix, service_times=None, time_limit_s=5
     if n <= 2:
         return list(range(n))
 
-    # Si OR-Tools indisponible, fallback sur l'implémentation TSP existante
+    # Si OR-Tools indisponible, fallback rapide sur l'implémentation TSP existante
+    # (appelé lors des éditions manuelles: pas de recherche multi-départs)
     if not ORTOOLS_AVAILABLE:
-        return solve_tsp_fixed_start_end(matrix)
+        return solve_tsp_fixed_start_end(matrix, quick=True)
 
     try:
-        manager = pywrapcp.RoutingIndexManager(n, 1, 0, n-1)
+        manager = pywrapcp.RoutingIndexManager(n, 1, [0], [n-1])
         routing = pywrapcp.RoutingModel(manager)
 
         def time_callback(from_index, to_index):
@@ -1924,11 +2675,224 @@ def solve_tsp_ortools_fixed_start_end(matrix, service_times=None, time_limit_s=5
         pass
 
     # Fallback en cas d'échec
-    return solve_tsp_fixed_start_end(matrix)
+    return solve_tsp_fixed_start_end(matrix, quick=True)
+
+def solve_tsp_ortools_time_windows(matrix, service_times, opening_windows=None,
+                                   activity_window=(time(8, 0), time(16, 30)),
+                                   travel_window=(time(7, 30), time(19, 0)),
+                                   day_breaks=None, max_days=0, time_limit_s=10):
+    """Optimise l'ordre via OR-Tools en intégrant les contraintes horaires à la recherche.
+    - dimension "Time" en minutes sur plusieurs jours (jour d = [d*1440, (d+1)*1440[)
+    - durées de visite (service_times, secondes) et fenêtres d'ouverture par site
+      (opening_windows: liste de (ouverture, fermeture), time ou None), bornées par les heures d'activité
+    - nuit (hors heures de voyage) et pauses quotidiennes (day_breaks: liste de
+      (début fenêtre, fin fenêtre, durée en min)) modélisées comme pauses du véhicule, hors visites
+    - objectif: fin de mission au plus tôt (nombre de jours), puis temps de trajet
+    Retourne (chemin [0, ..., n-1], nombre de jours estimé), ou (None, 0) si pas de solution.
+    """
+    n = len(matrix)
+    if not ORTOOLS_AVAILABLE or n <= 2:
+        return None, 0
+
+    day = 24 * 60
+
+    def _minutes(t):
+        return t.hour * 60 + t.minute
+
+    travel = [[-(-int(matrix[i][j] or 0) // 60) for j in range(n)] for i in range(n)]
+    service = []
+    for i in range(n):
+        try:
+            service.append(int(round(float(service_times[i] or 0) / 60)) if service_times else 0)
+        except Exception:
+            service.append(0)
+    act_start, act_end = _minutes(activity_window[0]), _minutes(activity_window[1])
+    trav_start, trav_end = _minutes(travel_window[0]), _minutes(travel_window[1])
+    days = int(max_days) if max_days and int(max_days) > 0 else n
+    horizon = days * day
+
+    try:
+        manager = pywrapcp.RoutingIndexManager(n, 1, [0], [n - 1])
+        routing = pywrapcp.RoutingModel(manager)
+        solver = routing.solver()
+
+        def time_callback(from_index, to_index):
+            from_node = manager.IndexToNode(from_index)
+            to_node = manager.IndexToNode(to_index)
+            return travel[from_node][to_node] + (service[from_node] if from_node != n - 1 else 0)
+
+        def travel_callback(from_index, to_index):
+            return travel[manager.IndexToNode(from_index)][manager.IndexToNode(to_index)]
+
+        time_cb = routing.RegisterTransitCallback(time_callback)
+        travel_cb = routing.RegisterTransitCallback(travel_callback)
+        routing.SetArcCostEvaluatorOfAllVehicles(travel_cb)
+        routing.AddDimension(time_cb, horizon, horizon, False, "Time")
+        time_dimension = routing.GetDimensionOrDie("Time")
+        # Chaque jour supplémentaire ajoute au moins une nuit à la durée totale: il domine le temps de trajet
+        time_dimension.SetSpanCostCoefficientForAllVehicles(10)
+
+        def _restrict_daily(cumul, earliest, latest):
+            # Début autorisé uniquement dans [earliest, latest] de chaque jour
+            cumul.SetRange(earliest, (days - 1) * day + latest)
+            for d in range(days - 1):
+                cumul.RemoveInterval(d * day + latest + 1, (d + 1) * day + earliest - 1)
+
+        for node in range(n - 1):
+            if node == 0 and service[0] == 0:
+                continue
+            opening, closing = (opening_windows[node] if opening_windows and node < len(opening_windows) else (None, None)) or (None, None)
+            earliest = max(act_start, _minutes(opening) if opening else 0)
+            latest_end = min(act_end, _minutes(closing) if closing else day)
+            # Visite plus longue que la fenêtre: début à l'ouverture (activité prolongée/reportée)
+            latest = max(earliest, latest_end - service[node])
+            _restrict_daily(time_dimension.CumulVar(manager.NodeToIndex(node)), earliest, latest)
+
+        start_cumul = time_dimension.CumulVar(routing.Start(0))
+        if service[0] == 0:
+            start_cumul.SetRange(trav_start, trav_start)
+        else:
+            # Premier site visité dès le premier jour
+            start_cumul.SetMax(day - 1)
+        _restrict_daily(time_dimension.CumulVar(routing.End(0)), trav_start, trav_end)
+
+        # Pauses: nuits (hors heures de voyage) et pauses quotidiennes, jamais pendant une visite
+        breaks = []
+        night = day - trav_end + trav_start
+        for d in range(days - 1):
+            breaks.append(solver.FixedDurationIntervalVar(d * day + trav_end, d * day + trav_end, night, False, f"Nuit {d + 1}"))
+        for window_start, window_end, duration_min in (day_breaks or []):
+            if not window_start or not window_end or not duration_min:
+                continue
+            ws, we, dur = _minutes(window_start), _minutes(window_end), int(duration_min)
+            if we - ws < dur:
+                continue
+            for d in range(days):
+                breaks.append(solver.FixedDurationIntervalVar(d * day + ws, d * day + we - dur, dur, False, f"Pause {d + 1} {ws}"))
+        node_visit_transit = [
+            service[manager.IndexToNode(index)] if manager.IndexToNode(index) != n - 1 else 0
+            for index in range(routing.Size())
+        ]
+        time_dimension.SetBreakIntervalsOfVehicle(breaks, 0, node_visit_transit)
+
+        search_params = pywrapcp.DefaultRoutingSearchParameters()
+        search_params.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+        search_params.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+        search_params.time_limit.seconds = max(1, int(time_limit_s))
+
+        solution = routing.SolveWithParameters(search_params)
+        if not solution:
+            return None, 0
+        index = routing.Start(0)
+        path = []
+        while not routing.IsEnd(index):
+            path.append(manager.IndexToNode(index))
+            index = solution.Value(routing.NextVar(index))
+        path.append(manager.IndexToNode(index))
+        end_minutes = solution.Value(time_dimension.CumulVar(index))
+        return path, int(end_minutes // day) + 1
+    except Exception:
+        return None, 0
+
+def _run_with_timeout(fn, timeout_seconds):
+    """Exécute fn dans un thread de travail, dans la limite de timeout_seconds.
+    Retourne (résultat, False), ou (None, True) si le délai est dépassé (le thread est abandonné).
+    """
+    if timeout_seconds is None:
+        return fn(), False
+    executor = ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(_with_script_run_ctx(fn))
+    try:
+        return future.result(timeout=max(0.0, timeout_seconds)), False
+    except FutureTimeoutError:
+        return None, True
+    finally:
+        executor.shutdown(wait=False)
+
+def _get_auto_race_settings():
+    """Réglages de la course des fournisseurs (mode Auto): décalage entre lancements, durée maximale,
+    attente des fournisseurs préférés après un premier résultat, délai avant le repli payant (DeepSeek).
+    """
+    try:
+        stagger = float(st.secrets.get("AUTO_RACE_STAGGER_SECONDS", 1.0))
+        timeout = float(st.secrets.get("AUTO_RACE_TIMEOUT_SECONDS", 45))
+        grace = float(st.secrets.get("AUTO_RACE_GRACE_SECONDS", 3.0))
+        fallback_after = float(st.secrets.get("AUTO_RACE_FALLBACK_AFTER_SECONDS", 20))
+    except Exception:
+        stagger, timeout, grace, fallback_after = 1.0, 45.0, 3.0, 20.0
+    return max(0.0, stagger), max(1.0, timeout), max(0.0, grace), max(0.0, fallback_after)
+
+def _with_script_run_ctx(fn):
+    """Attache le contexte d'exécution Streamlit au thread qui exécutera fn."""
+    ctx = get_script_run_ctx() if get_script_run_ctx else None
+
+    def _run():
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        return fn()
+    return _run
+
+def race_distance_providers(coords, city_list, osrm_base_url=None, deepseek_api_key=None,
+                            graphhopper_api_key=None, previous_osrm_matrix=None, debug=False,
+                            stagger_seconds=None, timeout_seconds=None):
+    """Mode Auto: lance OSRM et Maps (GraphHopper) de façon décalée, préférence OSRM → Maps.
+    Un résultat Maps attend encore OSRM quelques secondes (délai de grâce). L'estimation
+    Automatique (DeepSeek, payante) n'est lancée que si les routeurs ont échoué ou tardent.
+    Retourne (durations_sec, distances_m, méthode, erreurs) ou (None, None, "", erreurs).
+    """
+    default_stagger, default_timeout, grace_seconds, fallback_after = _get_auto_race_settings()
+    stagger_seconds = default_stagger if stagger_seconds is None else stagger_seconds
+    timeout_seconds = default_timeout if timeout_seconds is None else timeout_seconds
+    n = len(coords)
+
+    def _valid(result):
+        durations, distances = result
+        return (
+            durations is not None and distances is not None
+            and len(durations) == n and all(len(row) == n for row in durations)
+        )
+
+    def _osrm():
+        durations, distances, message = improved_osrm_duration_matrix(osrm_base_url, coords, previous=previous_osrm_matrix)
+        if durations is None:
+            raise RuntimeError(message)
+        return durations, distances
+
+    def _deepseek():
+        result, message = improved_deepseek_estimate_matrix(city_list, deepseek_api_key, debug)
+        if not result:
+            raise RuntimeError(message)
+        return result
+
+    def _graphhopper():
+        durations, distances, message = improved_graphhopper_duration_matrix(graphhopper_api_key, coords)
+        if durations is None:
+            raise RuntimeError(message)
+        return durations, distances
+
+    providers = []
+    if osrm_base_url:
+        providers.append(("OSRM", _osrm))
+    if graphhopper_api_key:
+        providers.append(("Maps", _graphhopper))
+    paid_providers = [("Automatique", _deepseek)] if deepseek_api_key else []
+
+    name, result, errors = race_providers(
+        providers,
+        validate=_valid,
+        stagger_seconds=stagger_seconds,
+        timeout_seconds=timeout_seconds,
+        wrap=_with_script_run_ctx,
+        grace_seconds=grace_seconds,
+        fallback_providers=paid_providers,
+        fallback_after_seconds=fallback_after
+    )
+    if result is None:
+        return None, None, "", errors
+    return result[0], result[1], name, errors
 
 def haversine(lon1, lat1, lon2, lat2):
     """Calcule la distance géodésique entre deux points en kilomètres"""
-    from math import radians, sin, cos, sqrt, atan2
     R = 6371.0
     dlon = radians(lon2 - lon1)
     dlat = radians(lat2 - lat1)
@@ -1937,27 +2901,15 @@ def haversine(lon1, lat1, lon2, lat2):
     return R * c
 
 def haversine_fallback_matrix(coords, kmh=95.0):
-    """Calcule une matrice basée sur distances géodésiques"""
-    
-    n = len(coords)
-    durations = [[0.0]*n for _ in range(n)]
-    distances = [[0.0]*n for _ in range(n)]
-    
-    for i in range(n):
-        for j in range(n):
-            if i != j:
-                km = haversine(coords[i][0], coords[i][1], coords[j][0], coords[j][1])
-                # Facteur de correction pour tenir compte des routes réelles
-                km *= 1.2
-                hours = km / kmh
-                # Retourner les durées en secondes (cohérent avec GraphHopper)
-                durations[i][j] = hours * 3600
-                # Retourner les distances en mètres (cohérent avec GraphHopper)
-                distances[i][j] = km * 1000
-    
-    return durations, distances
-
-def optimize_route_with_ai(sites, coords, base_location=None, api_key=None):
+    """Calcule une matrice basée sur distances géodésiques (calcul vectorisé NumPy).
+    Durées en secondes et distances en mètres, cohérentes avec GraphHopper/OSRM.
+    """
+    if not coords:
+        return [], []
+    durations, distances = geometric_matrices(coords, kmh)
+    return durations.tolist(), distances.tolist()
+
+def optimize_route_with_ai(sites, coords, base_location=None, api_key=None, timeout=30):
     """
     Optimise l'ordre des sites en utilisant l'IA Adja DeepSeek
     
@@ -2030,11 +2982,13 @@ Ne fournis AUCUNE explication, juste la séquence d'indices."""
             "max_tokens": 100
         }
         
-        response = requests.post(
+        response = get_http_client().post(
             "https://api.deepseek.com/chat/completions",
+            provider="deepseek",
+            retries=0,
             headers=headers,
             json=data,
-            timeout=30
+            timeout=timeout
         )
         
         if response.status_code == 200:
@@ -2076,443 +3030,40 @@ def schedule_itinerary(coords, sites, order, segments_summary,
                        stretch_days=False, end_day_early_threshold=1.5,
                        allow_weekend_travel=True, allow_weekend_activities=True,
                        lunch_duration_min=60):
-    """Génère le planning détaillé avec horaires différenciés pour activités et voyages"""
-    sites_ordered = [sites[i] for i in order]
-    coords_ordered = [coords[i] for i in order]
-    
-    current_datetime = datetime.combine(start_date, start_travel_time)  # Start with travel time
-    day_end_time = datetime.combine(start_date, end_travel_time)  # End with travel time
-    day_count = 1
-    itinerary = []
-    
-    # Suivi des pauses par jour pour éviter les doublons
-    daily_lunch_added = {}  # {day_count: bool}
-    daily_prayer_added = {}  # {day_count: bool}
-    
-    total_km = 0
-    total_visit_hours = 0
-    
-    for idx, site in enumerate(sites_ordered):
-        # Handle travel to this site (except for first site)
-        if idx > 0:
-            # Weekend skip for travel if disabled
-            if not allow_weekend_travel:
-                while current_datetime.weekday() >= 5:
-                    itinerary.append((day_count, current_datetime, datetime.combine(current_datetime.date(), end_travel_time), "⛱️ Week-end (pas de voyage)"))
-                    day_count += 1
-                    current_datetime = datetime.combine(start_date + timedelta(days=day_count-1), start_travel_time)
-                    day_end_time = datetime.combine(start_date + timedelta(days=day_count-1), end_travel_time)
-            seg_idx = idx - 1
-            seg_idx = idx - 1
-            if seg_idx < len(segments_summary):
-                seg = segments_summary[seg_idx]
-                travel_sec = seg.get("duration", 0)
-                travel_km = seg.get("distance", 0) / 1000.0
-                
-                # Debug: Afficher les valeurs reçues
-                if debug_mode:
-                    st.info(f"🔍 Debug Segment {seg_idx}: travel_sec={travel_sec}, travel_km={travel_km:.2f}")
-                
-                # Si les données sont nulles, utiliser des valeurs par défaut simples
-                if travel_sec <= 0:
-                    travel_sec = 3600  # 1 heure par défaut
-                    if debug_mode:
-                        st.warning(f"🔍 travel_sec était ≤ 0, fixé à 3600s (1h)")
-                if travel_km <= 0:
-                    travel_km = 50  # 50 km par défaut
-                    if debug_mode:
-                        st.warning(f"🔍 travel_km était ≤ 0, fixé à 50km")
-                
-                total_km += travel_km
-                
-                travel_duration = timedelta(seconds=int(travel_sec))
-                travel_end = current_datetime + travel_duration
-                
-                from_city = sites_ordered[idx-1]['Ville']
-                to_city = site['Ville']
-                
-                # Format travel time for display
-                travel_hours = travel_sec / 3600
-                if travel_hours >= 1:
-                    travel_time_str = f"{travel_hours:.1f}h"
-                else:
-                    travel_minutes = travel_sec / 60
-                    travel_time_str = f"{travel_minutes:.0f}min"
-                
-                travel_desc = f"🚗 {from_city} → {to_city} ({travel_km:.1f} km, {travel_time_str})"
-                
-                # Check if travel extends beyond travel hours
-                travel_end_time = datetime.combine(current_datetime.date(), end_travel_time)
-                
-                if travel_end > travel_end_time:
-                    # Travel extends beyond allowed hours - split across days
-                    itinerary.append((day_count, current_datetime, travel_end_time, "🏁 Fin de journée"))
-                    prev_site = sites_ordered[idx-1]
-                    prev_city = prev_site['Ville']
-                    prev_overnight_allowed = prev_site.get('Possibilité de nuitée', True)
-                    if prev_overnight_allowed:
-                        itinerary.append((day_count, travel_end_time, travel_end_time, f"🏨 Nuitée à {prev_city}"))
-                    else:
-                        # Pas d'hébergement autorisé à la ville précédente -> avertissement + nuitée de repli
-                        itinerary.append((day_count, travel_end_time, travel_end_time, f"⚠️ Déplacement nécessaire - pas d'hébergement à {prev_city}"))
-                        fallback_city = None
-                        for j in range(idx, len(sites_ordered)):
-                            if sites_ordered[j].get('Possibilité de nuitée', True):
-                                fallback_city = sites_ordered[j]['Ville']
-                                break
-                        if not fallback_city and base_location:
-                            fallback_city = base_location
-                        if fallback_city:
-                            itinerary.append((day_count, travel_end_time, travel_end_time, f"🏨 Nuitée à {fallback_city}"))
-                    
-                    day_count += 1
-                    current_datetime = datetime.combine(start_date + timedelta(days=day_count-1), start_travel_time)
-                    day_end_time = datetime.combine(start_date + timedelta(days=day_count-1), end_travel_time)
-                    travel_end = current_datetime + travel_duration
-                
-                # Handle lunch break during travel
-                lunch_window_start = datetime.combine(current_datetime.date(), lunch_start_time) if use_lunch else None
-                lunch_window_end = datetime.combine(current_datetime.date(), lunch_end_time) if use_lunch else None
-                
-                travel_added = False
-                
-                if use_lunch and lunch_window_start and lunch_window_end and not daily_lunch_added.get(day_count, False):
-                    if current_datetime < lunch_window_end and travel_end > lunch_window_start:
-                        # Si l'arrivée se situe dans la fenêtre de déjeuner, placer la pause à l'arrivée
-                        if lunch_window_start <= travel_end <= lunch_window_end:
-                            # Ajouter le trajet en une seule fois jusqu'à l'arrivée
-                            itinerary.append((day_count, current_datetime, travel_end, travel_desc))
-                            travel_added = True
-                            
-                            # Placer le déjeuner immédiatement à l'arrivée
-                            lunch_time = max(travel_end, lunch_window_start)
-                            lunch_end_time_actual = min(lunch_time + timedelta(minutes=lunch_duration_min), lunch_window_end)
-                            desc_text = f"🍽️ Déjeuner (≤{lunch_duration_min} min)"
-                            if use_prayer and prayer_start_time and not daily_prayer_added.get(day_count, False):
-                                prayer_window_start = datetime.combine(lunch_time.date(), prayer_start_time)
-                                prayer_window_end = prayer_window_start + timedelta(hours=2)
-                                if lunch_time < prayer_window_end and lunch_end_time_actual > prayer_window_start:
-                                    desc_text = f"🍽️ Déjeuner (≤{lunch_duration_min} min) + 🙏 Prière (≤{prayer_duration_min} min)"
-                                    daily_prayer_added[day_count] = True
-                            itinerary.append((day_count, lunch_time, lunch_end_time_actual, desc_text))
-                            daily_lunch_added[day_count] = True
-                            
-                            # Mettre à jour l'heure courante à la fin du déjeuner
-                            current_datetime = lunch_end_time_actual
-                            # Le trajet est terminé, éviter tout ajout résiduel
-                            travel_end = current_datetime
-                        else:
-                            # Sinon, conserver l’ancienne logique (pause pendant le trajet)
-                            lunch_time = max(current_datetime, lunch_window_start)
-                            lunch_end_time_actual = min(lunch_time + timedelta(minutes=lunch_duration_min), lunch_window_end)
-                            
-                            # Ajouter la partie de trajet avant la pause si nécessaire
-                            if lunch_time > current_datetime:
-                                itinerary.append((day_count, current_datetime, lunch_time, travel_desc))
-                                travel_added = True
-                            
-                            # Ajouter la pause déjeuner
-                            itinerary.append((day_count, lunch_time, lunch_end_time_actual, f"🍽️ Déjeuner (≤{lunch_duration_min} min)"))
-                            daily_lunch_added[day_count] = True
-                            
-                            # Reprendre le trajet après la pause
-                            current_datetime = lunch_end_time_actual
-                            remaining_travel = travel_end - lunch_time
-                            if remaining_travel.total_seconds() < 0:
-                                remaining_travel = timedelta(seconds=0)
-                            travel_end = current_datetime + remaining_travel
-                
-                # Handle prayer break during travel (only if no lunch break)
-                elif use_prayer and prayer_start_time and not daily_prayer_added.get(day_count, False):
-                    prayer_window_start = datetime.combine(current_datetime.date(), prayer_start_time)
-                    prayer_window_end = prayer_window_start + timedelta(hours=2)
-                    
-                    if current_datetime < prayer_window_end and travel_end > prayer_window_start:
-                        prayer_time = max(current_datetime, prayer_window_start)
-                        prayer_end_time = prayer_time + timedelta(minutes=prayer_duration_min)
-                        
-                        if prayer_end_time > prayer_window_end:
-                            prayer_end_time = prayer_window_end
-                        
-                        # Add travel before prayer if needed
-                        if prayer_time > current_datetime:
-                            itinerary.append((day_count, current_datetime, prayer_time, travel_desc))
-                            travel_added = True
-                        
-                        # Add prayer break
-                        itinerary.append((day_count, prayer_time, prayer_end_time, "🙏 Prière (≤20 min)"))
-                        daily_prayer_added[day_count] = True  # Marquer la prière comme ajoutée pour ce jour
-                        current_datetime = prayer_end_time
-                        
-                        # Recalculate remaining travel time
-                        remaining_travel = travel_end - prayer_time
-                        travel_end = current_datetime + remaining_travel
-                
-                # Add remaining travel time (include post-break remaining travel if any)
-                if current_datetime < travel_end:
-                    itinerary.append((day_count, current_datetime, travel_end, travel_desc))
-                
-                current_datetime = travel_end
-        
-        visit_hours = float(site.get("Durée (h)", 0)) if site.get("Durée (h)") else 0
-        
-        if visit_hours > 0:
-            # Weekend skip for activities if disabled
-            if not allow_weekend_activities:
-                while current_datetime.weekday() >= 5:
-                    itinerary.append((day_count, current_datetime, datetime.combine(current_datetime.date(), end_activity_time), "⛱️ Week-end (pas d'activités)"))
-                    day_count += 1
-                    current_datetime = datetime.combine(start_date + timedelta(days=day_count-1), start_activity_time)
-                    day_end_time = datetime.combine(start_date + timedelta(days=day_count-1), end_travel_time)
-            total_visit_hours += visit_hours
-            visit_duration = timedelta(hours=visit_hours)
-            visit_end = current_datetime + visit_duration
-            
-            type_site = site.get('Type', 'Site')
-            activite = site.get('Activité', 'Visite')
-            city = site['Ville'].upper()
-            
-            visit_desc = f"{city} – {activite}"
-            if type_site not in ["Base"]:
-                visit_desc = f"{city} – Visite {type_site}"
-            
-            # Check if visit extends beyond activity hours
-            activity_end_time = datetime.combine(current_datetime.date(), end_activity_time)
-            tolerance_end_time = activity_end_time + timedelta(hours=tolerance_hours)
-            
-            # Vérifier si l'activité peut continuer (nouvelle option)
-            can_continue = site.get('Peut continuer', False)  # Par défaut False
-            
-            # Vérifier si la nuitée est possible dans cette zone
-            overnight_allowed = site.get('Possibilité de nuitée', True)  # Par défaut True
-            
-            # Handle visit that extends beyond activity hours
-            if visit_end > activity_end_time:
-                # Si l'activité se termine dans le seuil de tolérance, elle peut continuer le même jour
-                if visit_end <= tolerance_end_time and can_continue:
-                    # L'activité continue sur le même jour malgré le dépassement
-                    pass  # Pas de division, traitement normal
-                elif can_continue and overnight_allowed:
-                    # L'activité dépasse le seuil de tolérance et peut être divisée, ET la nuitée est autorisée
-                    if current_datetime < activity_end_time:
-                        # Add partial visit for current day
-                        itinerary.append((day_count, current_datetime, activity_end_time, f"{visit_desc} (à continuer)"))
-                    
-                    # End current day
-                    itinerary.append((day_count, activity_end_time, activity_end_time, "🏁 Fin de journée"))
-                    if overnight_allowed:
-                        itinerary.append((day_count, activity_end_time, activity_end_time, f"🏨 Nuitée à {city}"))
-                    else:
-                        itinerary.append((day_count, activity_end_time, activity_end_time, f"⚠️ Déplacement nécessaire - pas d'hébergement à {city}"))
-                        # Nuitée de repli vers un site prochain autorisé ou la base
-                        fallback_city = None
-                        for j in range(idx+1, len(sites_ordered)):
-                            if sites_ordered[j].get('Possibilité de nuitée', True):
-                                fallback_city = sites_ordered[j]['Ville']
-                                break
-                        if not fallback_city and base_location:
-                            fallback_city = base_location
-                        if fallback_city:
-                            itinerary.append((day_count, activity_end_time, activity_end_time, f"🏨 Nuitée à {fallback_city}"))
-                    
-                    # Start next day
-                    remaining = visit_end - activity_end_time
-                    day_count += 1
-                    current_datetime = datetime.combine(start_date + timedelta(days=day_count-1), start_activity_time)
-                    day_end_time = datetime.combine(start_date + timedelta(days=day_count-1), end_travel_time)
-                    visit_end = current_datetime + remaining
-                    visit_desc = f"Suite {visit_desc}"
-                elif can_continue and not overnight_allowed:
-                    # L'activité peut continuer mais la nuitée n'est pas autorisée - chercher un site proche avec nuitée
-                    # Pour l'instant, on force la fin de l'activité et on ajoute un avertissement
-                    visit_end = activity_end_time
-                    if current_datetime < activity_end_time:
-                        itinerary.append((day_count, current_datetime, activity_end_time, f"{visit_desc} (interrompu - pas de nuitée possible)"))
-                    
-                    # End current day et chercher un hébergement ailleurs
-                    itinerary.append((day_count, activity_end_time, activity_end_time, "🏁 Fin de journée"))
-                    itinerary.append((day_count, activity_end_time, activity_end_time, f"⚠️ Déplacement nécessaire - pas d'hébergement à {city}"))
-                    
-                    # Start next day
-                    day_count += 1
-                    current_datetime = datetime.combine(start_date + timedelta(days=day_count-1), start_activity_time)
-                    day_end_time = datetime.combine(start_date + timedelta(days=day_count-1), end_travel_time)
-                    # Reprendre l'activité restante le jour suivant
-                    remaining_hours = (visit_duration - (activity_end_time - current_datetime)).total_seconds() / 3600
-                    if remaining_hours > 0:
-                        visit_end = current_datetime + timedelta(hours=remaining_hours)
-                        visit_desc = f"Suite {visit_desc}"
-                    else:
-                        # L'activité était déjà terminée
-                        visit_end = current_datetime
-                else:
-                    # L'activité ne peut pas continuer - la forcer à se terminer à l'heure limite
-                    visit_end = activity_end_time
-                    if current_datetime >= activity_end_time:
-                        # Si on est déjà en dehors des heures, terminer la journée et ajouter la nuitée (avec fallback si nécessaire)
-                        itinerary.append((day_count, current_datetime, current_datetime, "🏁 Fin de journée"))
-                        if overnight_allowed:
-                            itinerary.append((day_count, current_datetime, current_datetime, f"🏨 Nuitée à {city}"))
-                        else:
-                            itinerary.append((day_count, current_datetime, current_datetime, f"⚠️ Déplacement nécessaire - pas d'hébergement à {city}"))
-                            # Chercher une nuitée autorisée dans les sites suivants ou la base
-                            fallback_city = None
-                            for j in range(idx+1, len(sites_ordered)):
-                                if sites_ordered[j].get('Possibilité de nuitée', True):
-                                    fallback_city = sites_ordered[j]['Ville']
-                                    break
-                            if not fallback_city and base_location:
-                                fallback_city = base_location
-                            if fallback_city:
-                                itinerary.append((day_count, current_datetime, current_datetime, f"🏨 Nuitée à {fallback_city}"))
-                        
-                        # Reporter au jour suivant
-                        day_count += 1
-                        current_datetime = datetime.combine(start_date + timedelta(days=day_count-1), start_activity_time)
-                        day_end_time = datetime.combine(start_date + timedelta(days=day_count-1), end_travel_time)
-                        visit_end = current_datetime + visit_duration
-            
-            # Handle breaks during visit (only if visit fits in current day)
-            if visit_end <= activity_end_time:
-                lunch_window_start = datetime.combine(current_datetime.date(), lunch_start_time) if use_lunch else None
-                lunch_window_end = datetime.combine(current_datetime.date(), lunch_end_time) if use_lunch else None
-                
-                prayer_window_start = datetime.combine(current_datetime.date(), prayer_start_time) if use_prayer else None
-                prayer_window_end = prayer_window_start + timedelta(hours=2) if use_prayer else None
-                
-                # Check for lunch break during visit — do not split, schedule lunch after visit
-                place_lunch_after_visit = False
-                if use_lunch and lunch_window_start and lunch_window_end and not daily_lunch_added.get(day_count, False):
-                    if current_datetime < lunch_window_end and visit_end > lunch_window_start:
-                        place_lunch_after_visit = True
-                # If lunch will be placed after the visit, and prayer window overlaps that lunch window,
-                # combine prayer with lunch instead of splitting the visit
-                combine_prayer_with_lunch = False
-                if place_lunch_after_visit and use_prayer and prayer_window_start and prayer_window_end and not daily_prayer_added.get(day_count, False):
-                    planned_lunch_start = max(visit_end, lunch_window_start)
-                    planned_lunch_end = min(planned_lunch_start + timedelta(minutes=lunch_duration_min), lunch_window_end)
-                    if planned_lunch_start < prayer_window_end and planned_lunch_end > prayer_window_start:
-                        combine_prayer_with_lunch = True
-                
-                # Check for prayer break during visit (skip if it will be combined with lunch after visit)
-                if use_prayer and prayer_window_start and prayer_window_end and not daily_prayer_added.get(day_count, False) and not combine_prayer_with_lunch:
-                    if current_datetime < prayer_window_end and visit_end > prayer_window_start:
-                        prayer_time = max(current_datetime, prayer_window_start)
-                        prayer_end_time = min(prayer_time + timedelta(minutes=prayer_duration_min), prayer_window_end)
-                        
-                        # Add visit part before prayer
-                        if prayer_time > current_datetime:
-                            itinerary.append((day_count, current_datetime, prayer_time, visit_desc))
-                        
-                        # Add prayer break
-                        itinerary.append((day_count, prayer_time, prayer_end_time, "🙏 Prière (≤20 min)"))
-                        daily_prayer_added[day_count] = True  # Marquer la prière comme ajoutée pour ce jour
-                        
-                        # Update timing for remaining visit
-                        current_datetime = prayer_end_time
-                        remaining_visit = visit_end - prayer_time
-                        visit_end = current_datetime + remaining_visit
-                        visit_desc = f"Suite {visit_desc}" if prayer_time > current_datetime else visit_desc
-            
-            # Add final visit segment
-            if current_datetime < visit_end:
-                itinerary.append((day_count, current_datetime, visit_end, visit_desc))
-                current_datetime = visit_end
-            
-            # Place lunch right after the visit if the window overlapped
-            if 'place_lunch_after_visit' in locals() and place_lunch_after_visit and not daily_lunch_added.get(day_count, False):
-                lunch_time = max(current_datetime, lunch_window_start)
-                if lunch_time < lunch_window_end:
-                    lunch_end_time_actual = min(lunch_time + timedelta(minutes=lunch_duration_min), lunch_window_end)
-                    desc_text = f"🍽️ Déjeuner (≤{lunch_duration_min} min)"
-                    if 'combine_prayer_with_lunch' in locals() and combine_prayer_with_lunch and use_prayer and not daily_prayer_added.get(day_count, False):
-                        desc_text = f"🍽️ Déjeuner (≤{lunch_duration_min} min) + 🙏 Prière (≤{prayer_duration_min} min)"
-                        daily_prayer_added[day_count] = True
-                    itinerary.append((day_count, lunch_time, lunch_end_time_actual, desc_text))
-                    daily_lunch_added[day_count] = True
-                    current_datetime = lunch_end_time_actual
-            
-            # Check if we need to end the day early
-            time_until_end = (day_end_time - current_datetime).total_seconds() / 3600
-            
-            # Si on doit étaler, on termine la journée plus tôt pour répartir sur plus de jours
-            if stretch_days and day_count < max_days and idx < len(sites_ordered) - 1:
-                itinerary.append((day_count, current_datetime, current_datetime, f"🏁 Fin de journée"))
-                # Nuitée conditionnelle selon la possibilité
-                if overnight_allowed:
-                    itinerary.append((day_count, current_datetime, current_datetime, f"🏨 Nuitée à {city}"))
-                else:
-                    itinerary.append((day_count, current_datetime, current_datetime, f"⚠️ Déplacement nécessaire - pas d'hébergement à {city}"))
-                    # Chercher une nuitée autorisée dans les sites suivants ou la base
-                    fallback_city = None
-                    for j in range(idx+1, len(sites_ordered)):
-                        if sites_ordered[j].get('Possibilité de nuitée', True):
-                            fallback_city = sites_ordered[j]['Ville']
-                            break
-                    if not fallback_city and base_location:
-                        fallback_city = base_location
-                    if fallback_city:
-                        itinerary.append((day_count, current_datetime, current_datetime, f"🏨 Nuitée à {fallback_city}"))
-
-                # Démarrer le jour suivant
-                day_count += 1
-                current_datetime = datetime.combine(start_date + timedelta(days=day_count-1), start_activity_time)
-                day_end_time = datetime.combine(start_date + timedelta(days=day_count-1), end_travel_time)
-
-            elif time_until_end <= end_day_early_threshold and idx < len(sites_ordered) - 1:
-                # End current day and prepare for next day
-                itinerary.append((day_count, current_datetime, current_datetime, f"🏁 Fin de journée"))
-                # Nuitée conditionnelle selon la possibilité
-                if overnight_allowed:
-                    itinerary.append((day_count, current_datetime, current_datetime, f"🏨 Nuitée à {city}"))
-                else:
-                    itinerary.append((day_count, current_datetime, current_datetime, f"⚠️ Déplacement nécessaire - pas d'hébergement à {city}"))
-                    # Chercher une nuitée autorisée dans les sites suivants ou la base
-                    fallback_city = None
-                    for j in range(idx+1, len(sites_ordered)):
-                        if sites_ordered[j].get('Possibilité de nuitée', True):
-                            fallback_city = sites_ordered[j]['Ville']
-                            break
-                    if not fallback_city and base_location:
-                        fallback_city = base_location
-                    if fallback_city:
-                        itinerary.append((day_count, current_datetime, current_datetime, f"🏨 Nuitée à {fallback_city}"))
-                
-                # Start next day
-                day_count += 1
-                current_datetime = datetime.combine(start_date + timedelta(days=day_count-1), start_activity_time)
-                day_end_time = datetime.combine(start_date + timedelta(days=day_count-1), end_travel_time)
-    
-    # Add final overnight stay for the last day
-    if day_count > 0 and sites_ordered:
-        last_site = sites_ordered[-1]
-        last_city = last_site['Ville']
-        if last_site.get('Possibilité de nuitée', True):
-            itinerary.append((day_count, current_datetime, current_datetime, f"🏨 Nuitée à {last_city}"))
-        else:
-            # Fallback to base_location if overnight is not possible at the last site
-            if base_location:
-                itinerary.append((day_count, current_datetime, current_datetime, f"🏨 Nuitée à {base_location}"))
+    """Génère le planning détaillé avec horaires différenciés pour activités et voyages
+    Règles de planification dans schedule_sim.build_itinerary (partagées avec la simulation
+    de l'objectif jours); ici, seulement les messages de debug et d'avertissement.
+    """
+    if debug_mode:
+        for seg_idx, seg in enumerate(segments_summary[:max(0, len(order) - 1)]):
+            travel_sec = seg.get("duration", 0)
+            travel_km = seg.get("distance", 0) / 1000.0
+            st.info(f"🔍 Debug Segment {seg_idx}: travel_sec={travel_sec}, travel_km={travel_km:.2f}")
+            if travel_sec <= 0:
+                st.warning(f"🔍 travel_sec était ≤ 0, fixé à 3600s (1h)")
+            if travel_km <= 0:
+                st.warning(f"🔍 travel_km était ≤ 0, fixé à 50km")
+
+    itinerary, sites_ordered, coords_ordered, stats = build_itinerary(
+        coords, sites, order, segments_summary,
+        start_date, start_activity_time, end_activity_time,
+        start_travel_time, end_travel_time,
+        use_lunch, lunch_start_time, lunch_end_time,
+        use_prayer, prayer_start_time, prayer_duration_min,
+        max_days=max_days, tolerance_hours=tolerance_hours, base_location=base_location,
+        stretch_days=stretch_days, end_day_early_threshold=end_day_early_threshold,
+        allow_weekend_travel=allow_weekend_travel, allow_weekend_activities=allow_weekend_activities,
+        lunch_duration_min=lunch_duration_min
+    )
 
-    # Add final arrival marker
-    if day_count > 0 and sites_ordered:
-        last_city = sites_ordered[-1]['Ville'].upper()
-        
-        itinerary.append((day_count, current_datetime, current_datetime, f"📍 Arrivée {last_city} – Fin de mission"))
-    
     # Message d'avertissement si le nombre de jours est dépassé (ne devrait plus arriver avec la nouvelle logique)
+    day_count = stats["total_days"]
     if max_days > 0 and day_count > max_days and not stretch_days:
         st.warning(f"⚠️ L'itinéraire nécessite {day_count} jours, mais le maximum était fixé à {max_days}. Le planning est compressé.")
-    
-    stats = {
-        "total_days": day_count,
-        "total_km": total_km,
-        "total_visit_hours": total_visit_hours
-    }
-    
+
     return itinerary, sites_ordered, coords_ordered, stats
 
-def build_professional_html(itinerary, start_date, stats, sites_ordered, segments_summary=None, speed_kmh=110, mission_title="Mission Terrain", coords_ordered=None, include_map=False, lunch_start_time=None, lunch_end_time=None, lunch_duration_min=60, prayer_start_time=None, prayer_duration_min=20, include_details=True):
+def build_professional_html(itinerary, start_date, stats, sites_ordered, segments_summary=None, speed_kmh=110, mission_title="Mission Terrain", coords_ordered=None, include_map=False, lunch_start_time=None, lunch_end_time=None, lunch_duration_min=60, prayer_start_time=None, prayer_duration_min=20, include_details=True, route_points=None):
     """Génère un HTML professionnel"""
     def fmt_time(dt):
         return dt.strftime("%Hh%M")
@@ -2762,22 +3313,8 @@ def build_professional_html(itinerary, start_date, stats, sites_ordered, segment
 
             m = folium.Map(location=[center_lat, center_lon], zoom_start=7)
 
-            # Route via OSRM, fallback sur ligne droite
-            try:
-                coord_str = ";".join([f"{c[0]},{c[1]}" for c in coords_ordered])
-                url = f"{osrm_base_url.rstrip('/')}/route/v1/driving/{coord_str}?overview=full&geometries=geojson"
-                resp = requests.get(url, timeout=10)
-                route_pts = None
-                if resp.status_code == 200:
-                    data = resp.json()
-                    if data.get('routes'):
-                        geom = data['routes'][0].get('geometry')
-                        if isinstance(geom, dict) and geom.get('coordinates'):
-                            route_pts = [[lat, lon] for lon, lat in geom['coordinates']]
-                if not route_pts:
-                    route_pts = [[c[1], c[0]] for c in coords_ordered]
-            except Exception:
-                route_pts = [[c[1], c[0]] for c in coords_ordered]
+            # Tracé de la route calculée lors de la planification, sinon ligne droite
+            route_pts = route_points or [[c[1], c[0]] for c in coords_ordered]
             folium.PolyLine(locations=route_pts, color="blue", weight=3, opacity=0.7).add_to(m)
 
             # Affichage spécial si départ et arrivée identiques
@@ -3120,6 +3657,18 @@ with tab1:
             editable_df = pd.DataFrame(editable_df)
             editable_df['Supprimer'] = False
 
+    # Colonnes GPS optionnelles: coordonnées utilisées telles quelles, sans géocodage
+    for gps_col in ("Latitude", "Longitude"):
+        if gps_col not in editable_df.columns:
+            editable_df[gps_col] = None
+        editable_df[gps_col] = pd.to_numeric(editable_df[gps_col], errors="coerce")
+
+    # Horaires d'ouverture optionnels ("HH:MM"), pris en compte par l'optimisation horaires et pauses
+    for hours_col in ("Ouverture", "Fermeture"):
+        if hours_col not in editable_df.columns:
+            editable_df[hours_col] = None
+        editable_df[hours_col] = editable_df[hours_col].astype("object")
+
     sites_df = st.data_editor(
         editable_df, 
         num_rows="dynamic", 
@@ -3173,9 +3722,35 @@ with tab1:
                 default=True,
                 help="Décochez si cette zone ne dispose pas d'hébergement correct et qu'il faut éviter d'y passer la nuit",
                 width="small"
+            ),
+            "Latitude": st.column_config.NumberColumn(
+                "📡 Latitude",
+                min_value=-90.0,
+                max_value=90.0,
+                format="%.5f",
+                help="Optionnel: latitude GPS du site (ex. 14.79100). Renseignée avec la longitude, elle évite le géocodage. Vous pouvez aussi coller \"lat,lon\" dans la colonne Ville.",
+                width="small"
+            ),
+            "Longitude": st.column_config.NumberColumn(
+                "📡 Longitude",
+                min_value=-180.0,
+                max_value=180.0,
+                format="%.5f",
+                help="Optionnel: longitude GPS du site (ex. -16.93590)",
+                width="small"
+            ),
+            "Ouverture": st.column_config.TextColumn(
+                "🕗 Ouverture",
+                help="Optionnel: heure d'ouverture du site (HH:MM), utilisée par l'ordonnancement \"horaires et pauses\"",
+                width="small"
+            ),
+            "Fermeture": st.column_config.TextColumn(
+                "🕔 Fermeture",
+                help="Optionnel: heure de fermeture du site (HH:MM); la visite doit se terminer avant",
+                width="small"
             )
         },
-        column_order=["Supprimer", "Ville", "Type", "Activité", "Durée (h)", "Peut continuer", "Possibilité de nuitée"]
+        column_order=["Supprimer", "Ville", "Type", "Activité", "Durée (h)", "Peut continuer", "Possibilité de nuitée", "Ouverture", "Fermeture", "Latitude", "Longitude"]
     )
     
     # Interface pour saisir un nouveau type si "Autre (saisir)" est sélectionné
@@ -3208,6 +3783,18 @@ with tab1:
                             st.session_state.sites_df = sites_df
                             # Pas de rerun automatique pour éviter de ralentir la saisie
     
+    # Suggestions de correction pour les villes absentes du gazetteer hors-ligne
+    if sites_df is not None and not sites_df.empty and 'Ville' in sites_df.columns:
+        city_hints = []
+        for city_name in sites_df['Ville'].dropna().astype(str).str.strip().unique():
+            if not city_name or _parse_lat_lon_text(city_name) or _offline_lookup_city_coords(city_name):
+                continue
+            suggestions = suggest_cities(city_name, limit=3)
+            if suggestions:
+                city_hints.append(f"**{city_name}** → " + ", ".join(f"{s['name']} ({s['region']})" for s in suggestions))
+        if city_hints:
+            st.info("💡 Villes non reconnues hors-ligne — vouliez-vous dire :\n\n" + "\n\n".join(city_hints))
+    
     # Boutons d'action
     # Vérifier s'il y a des lignes cochées pour suppression
     has_checked_rows = 'Supprimer' in sites_df.columns and sites_df['Supprimer'].any()
@@ -3248,13 +3835,22 @@ with tab1:
     
     # Option d'ordre des sites
     order_mode = "🤖 Automatique (optimisé)"  # Valeur par défaut pour 0 ou 1 site
+    team_count = 1
+    team_balance = "Heures"
+    order_objective = "⏱️ Temps de trajet"
     if len(sites_df) > 1:  # Afficher seulement s'il y a plus d'un site
         st.subheader("🔄 Ordre des visites")
+        order_modes = ["🤖 Automatique (optimisé)", "🕒 Automatique (horaires et pauses)", "✋ Manuel (personnalisé)"]
+        if not ORTOOLS_AVAILABLE:
+            # Mode horaires et pauses: nécessite OR-Tools (sinon sans effet)
+            order_modes.remove("🕒 Automatique (horaires et pauses)")
         order_mode = st.radio(
             "Mode d'ordonnancement",
-            ["🤖 Automatique (optimisé)", "✋ Manuel (personnalisé)"],
+            order_modes,
             horizontal=True,
-            help="Automatique: optimise l'ordre pour minimiser les distances. Manuel: vous choisissez l'ordre."
+            help="Automatique: optimise l'ordre pour minimiser les distances. Horaires et pauses: tient compte des durées de visite, "
+                 "des horaires d'ouverture, des heures d'activité/voyage et des pauses pour minimiser le nombre de jours puis le temps de trajet "
+                 "(nécessite OR-Tools). Manuel: vous choisissez l'ordre."
         )
         
         if order_mode == "✋ Manuel (personnalisé)":
@@ -3318,6 +3914,35 @@ with tab1:
                         st.rerun()
         else:
             st.success("🤖 **Mode automatique activé** - L'ordre des sites sera optimisé automatiquement pour minimiser les temps de trajet")
+            order_objective = st.radio(
+                "🎯 Objectif de l'optimisation",
+                ["⏱️ Temps de trajet", "📆 Moins de jours, puis km"],
+                index=0 if st.session_state.get("order_objective", "⏱️ Temps de trajet") == "⏱️ Temps de trajet" else 1,
+                horizontal=True,
+                help="Moins de jours: l'ordre est affiné en simulant le planning (horaires, pauses, reports au lendemain) pour chaque ordre candidat."
+            )
+            st.session_state.order_objective = order_objective
+            # Plusieurs équipes: les sites sont répartis entre véhicules partant de la même base
+            col_teams, col_balance = st.columns(2)
+            with col_teams:
+                team_count = st.number_input(
+                    "👥 Nombre d'équipes",
+                    min_value=1, max_value=5,
+                    value=int(st.session_state.get("team_count", 1)),
+                    step=1,
+                    help="Au-delà de 1, les sites sont répartis entre les équipes (même départ et même retour), chacune avec son propre itinéraire et planning."
+                )
+            with col_balance:
+                team_balance = st.radio(
+                    "Équilibrer les équipes par",
+                    ["Heures", "Jours"],
+                    index=0 if st.session_state.get("team_balance", "Heures") == "Heures" else 1,
+                    horizontal=True,
+                    disabled=team_count <= 1,
+                    help="Heures: charge (trajets + visites) la plus homogène. Jours: d'abord le moins de jours pour l'équipe la plus chargée."
+                )
+            st.session_state.team_count = team_count
+            st.session_state.team_balance = team_balance
     else:
         st.info("ℹ️ Ajoutez au moins 1 site pour continuer. L'ordre n'est requis que s'il y a plusieurs sites.")
 
@@ -3525,6 +4150,9 @@ with col2:
     plan_button = st.button("🚀 Planifier la mission", type="primary", use_container_width=True)
 
 if plan_button:
+    # Budget global de planification, réparti entre les étapes
+    planning_deadline = PlanningDeadline(planning_deadline_s)
+    
     # Sauvegarde automatique des données avant planification
     st.session_state.sites_df = sites_df
     # Persistance des paramètres saisis
@@ -3552,18 +4180,26 @@ if plan_button:
         st.stop()
     issues = []
     for i, row in sites_df.iterrows():
-        city = str(row.get("Ville", "")).strip()
+        city = _cell_text(row.get("Ville"))
         dur = row.get("Durée (h)", None)
-        if not city:
-            issues.append(f"Ligne {i + 1}: Ville manquante ou vide")
+        direct, gps_error = _site_direct_coords(row)
+        if not city and not direct:
+            issues.append(f"Ligne {i + 1}: Ville ou coordonnées GPS manquantes")
         try:
             val = float(dur) if dur is not None else 0
         except Exception:
             val = 0
         if val <= 0:
             issues.append(f"Ligne {i + 1}: Durée (h) doit être > 0")
+        if gps_error:
+            issues.append(f"Ligne {i + 1}: {gps_error}")
+        _, hours_error = _site_opening_window(row)
+        if hours_error:
+            issues.append(f"Ligne {i + 1}: {hours_error}")
     if use_base_location and not str(base_location).strip():
         issues.append("Point de départ/arrivée activé mais ville non renseignée")
+    elif use_base_location and _parse_lat_lon_text(base_location) and not _site_direct_coords({"Ville": base_location})[0]:
+        issues.append("Point de départ/arrivée: coordonnées hors du Sénégal")
     if issues:
         st.error("⚠️ Veuillez corriger ces points avant la planification:")
         for msg in issues[:10]:
@@ -3707,7 +4343,13 @@ if plan_button:
         """, unsafe_allow_html=True)
     
     rows = sites_df.replace({pd.NA: None}).to_dict(orient="records")
-    sites = [r for r in rows if r.get("Ville") and str(r["Ville"]).strip()]
+    for r in rows:
+        # Site saisi uniquement par GPS: libellé "lat,lon" à la place du nom de ville
+        r["Ville"] = _cell_text(r.get("Ville"))
+        direct, _ = _site_direct_coords(r)
+        if direct and not r["Ville"]:
+            r["Ville"] = f"{direct[1]:.5f},{direct[0]:.5f}"
+    sites = [r for r in rows if r["Ville"]]
     
     if use_base_location and base_location and base_location.strip():
         base_site = {"Ville": base_location.strip(), "Type": "Base", "Activité": "Départ", "Durée (h)": 0}
@@ -3772,16 +4414,43 @@ if plan_button:
     coords = []
     failed = []
     
-    for i, s in enumerate(all_sites):
-        progress.progress((i+1) / (len(all_sites) * 4))
-        # Message dynamique pendant le géocodage
-        if i < len(geocoding_messages) - 1:
-            update_animation_step(1, "📍", geocoding_messages[min(i, len(geocoding_messages)-2)], [])
+    def _is_fixed_dakar_base(site):
+        return site.get("Type") == "Base" and str(site.get("Ville", "")).strip().lower() == "dakar"
+    
+    # Coordonnées GPS saisies: utilisées telles quelles, sans géocodage
+    direct_coords = [_site_direct_coords(s)[0] for s in all_sites]
+    
+    # Géocodage groupé: dédoublonnage, cache/hors-ligne immédiats, puis requêtes concurrentes
+    cities_to_geocode = [
+        str(s.get("Ville", "")).strip()
+        for s, direct in zip(all_sites, direct_coords)
+        if direct is None and not _is_fixed_dakar_base(s)
+    ]
+    geocoded_count = [0]
+    
+    def _on_geocoded(city, coord, provider):
+        geocoded_count[0] += 1
+        progress.progress(min(geocoded_count[0] / (max(len(cities_to_geocode), 1) * 4), 0.25))
+        step_idx = min(geocoded_count[0] - 1, len(geocoding_messages) - 2)
+        update_animation_step(1, "📍", geocoding_messages[step_idx], [])
+        if debug_mode:
+            st.info(f"🔍 Debug Géocodage: {city} → {coord} ({provider or 'échec'})")
+    
+    geocoding_budget = planning_deadline.start_stage("geocoding")
+    geocoded = geocode_cities_batch(
+        cities_to_geocode, use_cache, on_result=_on_geocoded, timeout=geocoding_budget
+    ) if cities_to_geocode else {}
+    if cities_to_geocode and planning_deadline.stage_expired():
+        planning_deadline.degrade("geocoding", "Délai dépassé: villes connues hors-ligne résolues localement")
+    
+    for s, direct in zip(all_sites, direct_coords):
         city_val = str(s.get("Ville", "")).strip()
-        if s.get("Type") == "Base" and city_val.lower() == "dakar":
+        if direct is not None:
+            coord = direct
+        elif _is_fixed_dakar_base(s):
             coord = (-17.470602, 14.711404)
         else:
-            coord = geocode_city_senegal(city_val, use_cache)
+            coord = geocoded.get(city_val)
         if not coord:
             failed.append(s["Ville"])
         else:
@@ -3810,10 +4479,29 @@ if plan_button:
     calculation_method = ""
     city_list = [s["Ville"] for s in all_sites]
     
+    # Matrice OSRM de la planification précédente: seuls les sites ajoutés sont demandés
+    previous_results = st.session_state.get("planning_results") or {}
+    previous_matrix = previous_results.get('travel_matrix')
+    previous_osrm_matrix = None
+    if previous_matrix is not None and previous_matrix.provider == "OSRM" and previous_matrix.coords:
+        previous_osrm_matrix = (previous_matrix.coords, previous_matrix.durations, previous_matrix.distances)
+    
+    matrix_budget = planning_deadline.start_stage("matrix")
+    
+    def _matrix_within_budget(fetch, label):
+        """Appel fournisseur borné par la tranche de l'étape; repli géométrique si elle est épuisée."""
+        result, timed_out = _run_with_timeout(fetch, planning_deadline.stage_remaining())
+        if not timed_out:
+            return result + (label,)
+        planning_deadline.degrade("matrix", f"{label}: délai dépassé, estimation géométrique")
+        geo_durations, geo_distances = haversine_fallback_matrix(coords, default_speed_kmh)
+        return geo_durations, geo_distances, "", f"Géométrique ({default_speed_kmh} km/h)"
+    
     if distance_method.startswith("Maps uniquement"):
         update_animation_step(2, "🗺️", distance_messages[1], [1])
-        durations_sec, distances_m, error_msg = improved_graphhopper_duration_matrix(graphhopper_api_key, coords)
-        calculation_method = "Maps"
+        durations_sec, distances_m, error_msg, calculation_method = _matrix_within_budget(
+            lambda: improved_graphhopper_duration_matrix(graphhopper_api_key, coords), "Maps"
+        )
         if durations_sec is None:
             st.error(f"❌ {error_msg}")
             st.stop()
@@ -3826,8 +4514,9 @@ if plan_button:
 
     elif distance_method == "OSRM uniquement (rapide)":
         update_animation_step(2, "🗺️", distance_messages[1], [1])
-        durations_sec, distances_m, error_msg = improved_osrm_duration_matrix(osrm_base_url, coords)
-        calculation_method = "OSRM"
+        durations_sec, distances_m, error_msg, calculation_method = _matrix_within_budget(
+            lambda: improved_osrm_duration_matrix(osrm_base_url, coords, previous=previous_osrm_matrix), "OSRM"
+        )
         if durations_sec is None:
             st.error(f"❌ {error_msg}")
             st.stop()
@@ -3839,10 +4528,19 @@ if plan_button:
                     st.info(f"🔍 Debug OSRM: Exemple durée [0][1] = {sample} secondes ({sample/3600:.2f}h)")
 
     elif distance_method == "Automatique uniquement":
-        result, error_msg = improved_deepseek_estimate_matrix(city_list, deepseek_api_key, debug_mode)
+        deepseek_output, timed_out = _run_with_timeout(
+            lambda: improved_deepseek_estimate_matrix(city_list, deepseek_api_key, debug_mode),
+            planning_deadline.stage_remaining()
+        )
+        if timed_out:
+            planning_deadline.degrade("matrix", "Automatique: délai dépassé, estimation géométrique")
+            result = haversine_fallback_matrix(coords, default_speed_kmh)
+            calculation_method = f"Géométrique ({default_speed_kmh} km/h)"
+        else:
+            result, error_msg = deepseek_output
+            calculation_method = "Automatique"
         if result:
             durations_sec, distances_m = result
-            calculation_method = "Automatique"
             st.info(f"📊 Méthode: {calculation_method}")
         else:
             st.error(f"❌ {error_msg}")
@@ -3854,79 +4552,45 @@ if plan_button:
         st.warning(f"📊 Méthode: {calculation_method}")
 
     else:
-        # Mode Auto: dynamique
-        # - Site unique → OSRM → Automatique → Maps → Géométrique
-        # - Plusieurs sites → OSRM → Automatique → Maps → Géométrique
-        single_site = len(sites) == 1
-
-        if single_site:
-            update_animation_step(2, "🗺️", distance_messages[1], [1])
-            # 1) OSRM en premier
-            durations_sec, distances_m, error_msg = improved_osrm_duration_matrix(osrm_base_url, coords)
-            if durations_sec is not None:
-                calculation_method = "OSRM"
-            else:
-                # 2) Automatique (DeepSeek)
-                if deepseek_api_key:
-                    result, _ = improved_deepseek_estimate_matrix(city_list, deepseek_api_key, debug_mode)
-                    if result:
-                        durations_sec, distances_m = result
-                        calculation_method = "Automatique"
-                    else:
-                        # 3) Maps (GraphHopper), si option activée
-                        if use_deepseek_fallback and graphhopper_api_key:
-                            durations_sec, distances_m, error_msg = improved_graphhopper_duration_matrix(graphhopper_api_key, coords)
-                            if durations_sec is not None:
-                                calculation_method = "Maps"
-                            else:
-                                durations_sec, distances_m = haversine_fallback_matrix(coords, default_speed_kmh)
-                                calculation_method = f"Géométrique ({default_speed_kmh} km/h)"
-                        else:
-                            durations_sec, distances_m = haversine_fallback_matrix(coords, default_speed_kmh)
-                            calculation_method = f"Géométrique ({default_speed_kmh} km/h)"
-                else:
-                    # Pas de clé DeepSeek, tenter Maps si autorisé puis géométrique
-                    if use_deepseek_fallback and graphhopper_api_key:
-                        durations_sec, distances_m, error_msg = improved_graphhopper_duration_matrix(graphhopper_api_key, coords)
-                        if durations_sec is not None:
-                            calculation_method = "Maps"
-                        else:
-                            durations_sec, distances_m = haversine_fallback_matrix(coords, default_speed_kmh)
-                            calculation_method = f"Géométrique ({default_speed_kmh} km/h)"
-                    else:
-                        durations_sec, distances_m = haversine_fallback_matrix(coords, default_speed_kmh)
-                        calculation_method = f"Géométrique ({default_speed_kmh} km/h)"
-        else:
-            # OSRM → Automatique → Maps (si activé) → Géométrique
-            durations_sec, distances_m, error_msg = improved_osrm_duration_matrix(osrm_base_url, coords)
-            if durations_sec is not None:
-                calculation_method = "OSRM"
-            else:
-                result, error_msg = improved_deepseek_estimate_matrix(city_list, deepseek_api_key, debug_mode)
-                if result:
-                    durations_sec, distances_m = result
-                    calculation_method = "Automatique"
-                else:
-                    if use_deepseek_fallback and graphhopper_api_key:
-                        durations_sec, distances_m, error_msg = improved_graphhopper_duration_matrix(graphhopper_api_key, coords)
-                        if durations_sec is not None:
-                            calculation_method = "Maps"
-                        else:
-                            durations_sec, distances_m = haversine_fallback_matrix(coords, default_speed_kmh)
-                            calculation_method = f"Géométrique ({default_speed_kmh} km/h)"
-                    else:
-                        durations_sec, distances_m = haversine_fallback_matrix(coords, default_speed_kmh)
-                        calculation_method = f"Géométrique ({default_speed_kmh} km/h)"
+        # Mode Auto: OSRM et Maps lancés en parallèle (décalage configurable, préférence OSRM),
+        # Automatique (DeepSeek) seulement en repli, puis Géométrique si aucun ne répond
+        update_animation_step(2, "🗺️", distance_messages[1], [1])
+        durations_sec, distances_m, calculation_method, race_errors = race_distance_providers(
+            coords, city_list,
+            osrm_base_url=osrm_base_url,
+            deepseek_api_key=deepseek_api_key,
+            graphhopper_api_key=graphhopper_api_key if use_deepseek_fallback else None,
+            previous_osrm_matrix=previous_osrm_matrix,
+            debug=debug_mode,
+            timeout_seconds=matrix_budget
+        )
+        if durations_sec is None:
+            durations_sec, distances_m = haversine_fallback_matrix(coords, default_speed_kmh)
+            calculation_method = f"Géométrique ({default_speed_kmh} km/h)"
+            if planning_deadline.stage_expired():
+                planning_deadline.degrade("matrix", "Délai dépassé: estimation géométrique")
+        if debug_mode and race_errors:
+            st.info("🔍 Debug Auto: " + " | ".join(f"{name}: {err}" for name, err in race_errors.items()))
 
         method_color = "success" if ("Maps" in calculation_method or "OSRM" in calculation_method) else "info" if "Automatique" in calculation_method else "warning"
         getattr(st, method_color)(f"📊 Méthode: {calculation_method}")
     
+    # Matrice compacte (int32/float32) partagée par l'optimisation, les segments et les exports
+    travel_matrix = TravelMatrix(
+        durations_sec, distances_m,
+        provider=calculation_method, coords=coords, labels=city_list
+    )
+    durations_sec = distances_m = None
+    
     # Étape 3: Optimisation (commune à tous les modes)
+    optimization_budget = planning_deadline.start_stage("optimization")
     update_animation_step(3, "🔄", "Optimisation de l'itinéraire...", [1, 2])
     status.text("🔄 Optimisation de l'ordre des sites...")
     progress.progress(0.6)
     
     # Déterminer l'ordre des sites selon le mode choisi
+    tw_order = None
+    schedule_refine = None
     if order_mode == "✋ Manuel (personnalisé)":
         # Utiliser l'ordre manuel défini par l'utilisateur
         if use_base_location and base_location and base_location.strip():
@@ -3950,124 +4614,179 @@ if plan_button:
     else:
         # Utiliser l'optimisation IA Adja au lieu du TSP traditionnel
         if len(coords) >= 3:
-            # Essayer d'abord l'optimisation IA Adja
-            ai_order, ai_success, ai_message = optimize_route_with_ai(
-                all_sites, coords, 
-                base_location if use_base_location else None, 
-                deepseek_api_key
-            )
+            if order_mode == "🕒 Automatique (horaires et pauses)":
+                # Contraintes horaires intégrées à la recherche (OR-Tools)
+                if ORTOOLS_AVAILABLE:
+                    service_times_sec = []
+                    for site in all_sites:
+                        try:
+                            service_times_sec.append(int(float(site.get("Durée (h)") or 0) * 3600))
+                        except Exception:
+                            service_times_sec.append(0)
+                    day_breaks = []
+                    if use_lunch and lunch_start_time and lunch_end_time:
+                        day_breaks.append((lunch_start_time, lunch_end_time, int(lunch_duration_min or 60)))
+                    if use_prayer and prayer_start_time:
+                        # Même fenêtre que le planning détaillé: 2h à partir du début de la prière
+                        prayer_end = (datetime.combine(start_date, prayer_start_time) + timedelta(hours=2)).time()
+                        day_breaks.append((prayer_start_time, prayer_end, int(prayer_duration_min or 20)))
+                    tw_limit = 10 if optimization_budget is None else max(1, int(optimization_budget * 0.8))
+                    tw_order, tw_days = solve_tsp_ortools_time_windows(
+                        travel_matrix.durations,
+                        service_times_sec,
+                        opening_windows=[_site_opening_window(site)[0] for site in all_sites],
+                        activity_window=(start_activity_time, end_activity_time),
+                        travel_window=(start_travel_time, end_travel_time),
+                        day_breaks=day_breaks,
+                        max_days=max_days,
+                        time_limit_s=tw_limit
+                    )
+                    if tw_order:
+                        order = tw_order
+                        st.success(f"✅ Ordre optimisé avec horaires et pauses: {tw_days} jour(s) estimé(s)")
+                    else:
+                        st.warning("⚠️ Aucun ordre ne respecte toutes les contraintes horaires: optimisation classique")
+                else:
+                    st.warning("⚠️ OR-Tools indisponible: optimisation classique sans contraintes horaires")
             
-            if ai_success:
-                order = ai_order
-                st.success(f"✅ Ordre optimisé par IA Adja: {ai_message}")
-            else:
-                # Fallback vers TSP si l'IA Adja échoue
-                order = solve_tsp_fixed_start_end(durations_sec)
-                st.warning(f"⚠️ IA Adja échouée ({ai_message}), utilisation TSP classique")
+            if tw_order is None:
+                # Essayer d'abord l'optimisation IA Adja (si la tranche de l'étape le permet)
+                if optimization_budget is not None and optimization_budget < 3:
+                    ai_order, ai_success, ai_message = None, False, "délai de planification insuffisant"
+                    planning_deadline.degrade("optimization", "IA Adja ignorée faute de temps: TSP local")
+                else:
+                    ai_timeout = 30 if optimization_budget is None else max(2, min(30, int(optimization_budget * 0.8)))
+                    ai_order, ai_success, ai_message = optimize_route_with_ai(
+                        all_sites, coords, 
+                        base_location if use_base_location else None, 
+                        deepseek_api_key,
+                        timeout=ai_timeout
+                    )
+                    if not ai_success and planning_deadline.stage_expired(margin_seconds=optimization_budget * 0.2 if optimization_budget else 0):
+                        planning_deadline.degrade("optimization", f"IA Adja hors délai ({ai_message}): TSP local")
+            
+                if ai_success:
+                    order = ai_order
+                    st.success(f"✅ Ordre optimisé par IA Adja: {ai_message}")
+                else:
+                    # Fallback vers TSP si l'IA Adja échoue
+                    tsp_budget = tsp_time_budget_s
+                    if planning_deadline.stage_remaining() is not None:
+                        tsp_budget = max(1.0, min(tsp_budget, planning_deadline.stage_remaining()))
+                    order = solve_tsp_fixed_start_end(travel_matrix.durations, time_budget_s=tsp_budget)
+                    st.warning(f"⚠️ IA Adja échouée ({ai_message}), utilisation TSP classique")
         else:
             order = list(range(len(coords)))
             st.success("✅ Ordre séquentiel (moins de 3 sites)")
+        
+        if order_objective == "📆 Moins de jours, puis km" and tw_order is not None:
+            # La simulation ne modélise pas les horaires d'ouverture: l'ordre OR-Tools est conservé
+            st.info("📆 Objectif jours non appliqué: l'ordre respecte déjà les horaires d'ouverture des sites")
+        elif order_objective == "📆 Moins de jours, puis km" and len(order) > 3:
+            # Affinage sur le nombre de jours simulé (puis la distance) de chaque ordre candidat;
+            # la simulation applique les règles du planning détaillé (schedule_sim.build_itinerary)
+            schedule_params = ScheduleParams(
+                start_activity_time, end_activity_time, start_travel_time, end_travel_time,
+                lunch=(lunch_start_time, lunch_end_time, lunch_duration_min) if use_lunch else None,
+                prayer=(prayer_start_time, prayer_duration_min) if use_prayer else None,
+                tolerance_hours=tolerance_hours,
+                start_weekday=start_date.weekday(),
+                allow_weekend_travel=allow_weekend_travel,
+                allow_weekend_activities=allow_weekend_activities
+            )
+            sim_service = []
+            for site in all_sites:
+                try:
+                    sim_service.append(float(site.get("Durée (h)") or 0) * 3600)
+                except Exception:
+                    sim_service.append(0)
+            sim_durations = travel_matrix.durations.tolist()
+            sim_distances = travel_matrix.distances.tolist()
+            sim_can_continue = [bool(site.get('Peut continuer', False)) for site in all_sites]
+            sim_overnight = [bool(site.get('Possibilité de nuitée', True)) for site in all_sites]
+
+            def schedule_refine(sub_order, budget):
+                """Affinage jours puis km d'un ordre (indices de la matrice complète)."""
+                return optimize_days_then_distance(
+                    sub_order, sim_durations, sim_distances, sim_service,
+                    sim_can_continue, schedule_params, time_budget_s=budget,
+                    overnight=sim_overnight
+                )
+
+            sim_budget = tsp_time_budget_s
+            if planning_deadline.stage_remaining() is not None:
+                sim_budget = max(0.5, min(sim_budget, planning_deadline.stage_remaining()))
+            order, sim_initial, sim_best, sim_evaluations = schedule_refine(order, sim_budget)
+            st.info(
+                f"📆 Objectif jours: {sim_initial[0]} → {sim_best[0]} jour(s) estimé(s), "
+                f"{sim_initial[1]/1000:.0f} → {sim_best[1]/1000:.0f} km ({sim_evaluations} ordres simulés)"
+            )
             
-        if debug_mode and durations_sec:
+        if debug_mode and len(travel_matrix):
             # Calculer coût total pour transparence
-            total_cost = sum(durations_sec[order[i]][order[i+1]] for i in range(len(order)-1))
+            total_cost = travel_matrix.path_duration(order)
             st.info(f"🔍 Debug Optimisation: ordre={order} | coût total={total_cost/3600:.2f}h")
         
     status.text("🛣️ Calcul de l'itinéraire détaillé...")
     # Étape 4: Génération de l'itinéraire
+    planning_deadline.start_stage("segments")
     update_animation_step(4, "🛣️", "Génération de l'itinéraire détaillé...", [1, 2, 3])
     progress.progress(0.8)
     
     segments = []
     zero_segments_indices = []
     
+    # Itinéraire final en une requête OSRM Route multi-étapes: durées/distances par tronçon
+    # et géométrie complète (carte, KML/KMZ, export HTML). Seulement si la matrice vient
+    # d'OSRM: sinon OSRM est en panne ou écarté, et le tracé sera demandé à l'affichage.
+    route_waypoints = [tuple(coords[i]) for i in order]
+    route = None
+    if osrm_base_url and calculation_method == "OSRM" and not planning_deadline.stage_expired():
+        route_timeout = planning_deadline.stage_remaining()
+        route = fetch_osrm_route(osrm_base_url, route_waypoints, timeout=min(10, route_timeout) if route_timeout else 10)
+    # Tronçons routiers retenus sauf si une autre méthode a été imposée
+    use_route_legs = route is not None and len(route["legs"]) == len(order) - 1
+    
+    def _base_segment(k, from_idx, to_idx):
+        if use_route_legs:
+            leg_duration, leg_distance = route["legs"][k]
+            return int(round(leg_duration)), int(round(leg_distance)), "OSRM"
+        duration, distance = travel_matrix.segment(from_idx, to_idx)
+        return duration, distance, "Matrix"
+    
+    # Segments nuls: collectés puis recalculés en lot (store persistant,
+    # une requête OSRM Table et une requête GraphHopper en parallèle, puis géométrique)
+    zero_pairs = []
+    for i in range(len(order)-1):
+        from_idx, to_idx = order[i], order[i+1]
+        if from_idx < len(travel_matrix) and to_idx < len(travel_matrix):
+            duration, distance, _ = _base_segment(i, from_idx, to_idx)
+            if duration == 0 or distance == 0:
+                zero_pairs.append((from_idx, to_idx))
+    repaired_segments = {}
+    if zero_pairs:
+        if planning_deadline.stage_expired():
+            planning_deadline.degrade("segments", "Délai dépassé: segments nuls estimés géométriquement")
+            repair_osrm_url, repair_gh_key = None, None
+        else:
+            repair_osrm_url, repair_gh_key = osrm_base_url, graphhopper_api_key
+        repaired_segments = repair_zero_segments(
+            zero_pairs, coords,
+            osrm_base_url=repair_osrm_url,
+            graphhopper_api_key=repair_gh_key,
+            speed_kmh=default_speed_kmh,
+            timeout=planning_deadline.stage_remaining()
+        )
+    
     for i in range(len(order)-1):
         from_idx = order[i]
         to_idx = order[i+1]
         
-        if from_idx < len(durations_sec) and to_idx < len(durations_sec[0]):
-            duration = durations_sec[from_idx][to_idx]
-            distance = distances_m[from_idx][to_idx] if distances_m else 0
-            segment_method = "Matrix"
+        if from_idx < len(travel_matrix) and to_idx < len(travel_matrix):
+            duration, distance, segment_method = _base_segment(i, from_idx, to_idx)
             
-            # Si la distance/durée est nulle, recalculer via OSRM/Maps avec cache, puis fallback géométrique
-            if duration == 0 or distance == 0:
-                # Cache par segment
-                if 'segment_route_cache' not in st.session_state:
-                    st.session_state.segment_route_cache = {}
-                segment_cache = st.session_state.segment_route_cache
-                SEGMENT_CACHE_TTL = int(st.session_state.get('segment_cache_ttl_sec', 43200))
-                
-                coord_from = coords[from_idx]
-                coord_to = coords[to_idx]
-                key = (coord_from[0], coord_from[1], coord_to[0], coord_to[1])
-                now_ts = datetime.now().timestamp()
-                
-                # 1) Cache
-                cached = segment_cache.get(key)
-                if cached and (now_ts - cached.get('ts', 0)) < SEGMENT_CACHE_TTL:
-                    distance = int(cached.get('distance', 0))
-                    duration = int(cached.get('duration', 0))
-                    segment_method = cached.get('method', 'Matrix')
-                else:
-                    # 2) OSRM route
-                    try:
-                        coord_str = f"{coord_from[0]},{coord_from[1]};{coord_to[0]},{coord_to[1]}"
-                        url = f"{osrm_base_url.rstrip('/')}/route/v1/driving/{coord_str}?overview=false"
-                        resp = requests.get(url, timeout=10)
-                        if resp.status_code == 200:
-                            data = resp.json()
-                            if data.get('routes'):
-                                r0 = data['routes'][0]
-                                d_m = int(r0.get('distance', 0))
-                                t_s = int(r0.get('duration', 0))
-                                if d_m > 0 and t_s > 0:
-                                    distance = d_m
-                                    duration = t_s
-                                    segment_method = "OSRM"
-                    except Exception:
-                        pass
-                    
-                    # 3) GraphHopper route
-                    if (duration == 0 or distance == 0) and graphhopper_api_key:
-                        try:
-                            gh_url = "https://graphhopper.com/api/1/route"
-                            qp = f"point={coord_from[1]},{coord_from[0]}&point={coord_to[1]},{coord_to[0]}&vehicle=car&locale=fr&points_encoded=false&calc_points=false&key={graphhopper_api_key}"
-                            gh_resp = requests.get(f"{gh_url}?{qp}", timeout=10)
-                            if gh_resp.status_code == 200:
-                                gh_data = gh_resp.json()
-                                paths = gh_data.get('paths')
-                                if paths:
-                                    p0 = paths[0]
-                                    d_m = int(p0.get('distance', 0))
-                                    t_ms = int(p0.get('time', 0))
-                                    t_s = int(t_ms / 1000)
-                                    if d_m > 0 and t_s > 0:
-                                        distance = d_m
-                                        duration = t_s
-                                        segment_method = "Maps"
-                        except Exception:
-                            pass
-                    
-                    # 4) Fallback géométrique
-                    if duration == 0 or distance == 0:
-                        geometric_km = haversine(coord_from[0], coord_from[1], coord_to[0], coord_to[1]) * 1.2
-                        if distance == 0:
-                            distance = int(geometric_km * 1000)
-                        if duration == 0:
-                            distance_for_time_calc = distance / 1000 if distance > 0 else geometric_km
-                            geometric_hours = distance_for_time_calc / default_speed_kmh
-                            duration = int(geometric_hours * 3600)
-                        segment_method = "Geo"
-                    
-                    # Mettre à jour le cache
-                    segment_cache[key] = {
-                        "distance": int(distance),
-                        "duration": int(duration),
-                        "method": segment_method,
-                        "ts": now_ts
-                    }
-                
+            if (duration == 0 or distance == 0) and (from_idx, to_idx) in repaired_segments:
+                duration, distance, segment_method = repaired_segments[(from_idx, to_idx)]
                 zero_segments_indices.append(i)
                 if debug_mode:
                     st.info(f"🔍 Segment {i} recalculé via {segment_method}: {distance/1000:.1f}km, {duration/3600:.2f}h")
@@ -4109,6 +4828,7 @@ if plan_button:
     
     status.text("📅 Génération du planning détaillé...")
     # Étape 5: Génération du planning
+    planning_deadline.start_stage("schedule")
     update_animation_step(5, "📅", "Finalisation du planning...", [1, 2, 3, 4])
     progress.progress(0.9)
 
@@ -4205,6 +4925,90 @@ if plan_button:
     if stretch_days_flag and stats.get('total_days', 0) > effective_max_days:
         st.error(f"❌ Impossible de tenir en {effective_max_days} jour(s). Besoin de {stats.get('total_days')} jours même en étirant les journées.")
     
+    # Plusieurs équipes: répartition des sites puis itinéraire et planning par équipe
+    team_plans = []
+    if team_count > 1 and order_mode != "✋ Manuel (personnalisé)" and len(order) > 3:
+        status.text("👥 Répartition des sites entre les équipes...")
+        service_times_sec = []
+        for site in all_sites:
+            try:
+                service_times_sec.append(int(float(site.get("Durée (h)") or 0) * 3600))
+            except Exception:
+                service_times_sec.append(0)
+        day_capacity_s = None
+        if team_balance == "Jours":
+            day_capacity_s = max(3600, (
+                datetime.combine(start_date, end_activity_time) - datetime.combine(start_date, start_activity_time)
+            ).total_seconds())
+        team_refine = None
+        if schedule_refine is not None:
+            # Objectif jours: l'ordre affiné de chaque équipe est conservé (pas de re-résolution sur le temps de trajet)
+            team_budget = max(0.5, tsp_time_budget_s / int(team_count))
+            if planning_deadline.stage_remaining() is not None:
+                team_budget = max(0.5, min(team_budget, planning_deadline.stage_remaining() / int(team_count)))
+            team_refine = lambda team_order: schedule_refine(team_order, team_budget)[0]
+        team_orders = assign_sites_to_teams(
+            travel_matrix, order, service_times_sec, int(team_count),
+            day_capacity_s=day_capacity_s, refine=team_refine
+        )
+        # Segments de chaque équipe: matrice, puis recalcul groupé des segments nuls
+        team_pairs = [(o[k], o[k + 1]) for o in team_orders for k in range(len(o) - 1)]
+        missing_pairs = [
+            pair for pair in dict.fromkeys(team_pairs)
+            if pair[0] != pair[1] and (travel_matrix.duration(*pair) == 0 or travel_matrix.distance(*pair) == 0)
+        ]
+        team_repairs = repair_zero_segments(
+            missing_pairs, coords, osrm_base_url, graphhopper_api_key, default_speed_kmh,
+            timeout=planning_deadline.stage_remaining()
+        ) if missing_pairs else {}
+        for team_idx, team_order in enumerate(team_orders):
+            team_segments = []
+            for k in range(len(team_order) - 1):
+                pair = (team_order[k], team_order[k + 1])
+                duration, distance = travel_matrix.segment(*pair)
+                method = "Matrix"
+                if (duration == 0 or distance == 0) and pair in team_repairs:
+                    duration, distance, method = team_repairs[pair]
+                team_segments.append({"distance": distance, "duration": duration, "method": method})
+            team_itinerary, team_sites, team_coords, team_stats = schedule_itinerary(
+                coords=coords,
+                sites=all_sites,
+                order=team_order,
+                segments_summary=team_segments,
+                start_date=start_date,
+                start_activity_time=start_activity_time,
+                end_activity_time=end_activity_time,
+                start_travel_time=start_travel_time,
+                end_travel_time=end_travel_time,
+                use_lunch=use_lunch,
+                lunch_start_time=lunch_start_time if use_lunch else time(12,30),
+                lunch_end_time=lunch_end_time if use_lunch else time(14,0),
+                use_prayer=use_prayer,
+                prayer_start_time=prayer_start_time if use_prayer else time(14,0),
+                prayer_duration_min=prayer_duration_min if use_prayer else 20,
+                lunch_duration_min=st.session_state.get("lunch_duration_min", 60),
+                max_days=0,
+                tolerance_hours=tolerance_hours,
+                base_location=base_location,
+                allow_weekend_travel=allow_weekend_travel,
+                allow_weekend_activities=allow_weekend_activities
+            )
+            team_plans.append({
+                'name': f"Équipe {team_idx + 1}",
+                'order': team_order,
+                'itinerary': team_itinerary,
+                'sites_ordered': team_sites,
+                'coords_ordered': team_coords,
+                'stats': team_stats,
+                'segments_summary': team_segments,
+                'route_polyline': None,
+            })
+        st.success("👥 " + " | ".join(
+            f"{t['name']}: {len([s for s in t['sites_ordered'] if s.get('Type') != 'Base'])} site(s), "
+            f"{t['stats'].get('total_days', 0)} j, {t['stats'].get('total_km', 0):.0f} km"
+            for t in team_plans
+        ))
+    
     progress.progress(1.0)
     status.text("✅ Terminé!")
     
@@ -4212,17 +5016,25 @@ if plan_button:
         'itinerary': itinerary,
         'sites_ordered': sites_ordered,
         'coords_ordered': coords_ordered,
-        'route_polyline': None,
+        'route_polyline': encode_polyline(route["points"]) if route and route.get("points") else None,
+        'route_legs': route["legs"] if route else None,
+        'route_waypoints': route_waypoints,
         'stats': stats,
         'start_date': start_date,
         'calculation_method': calculation_method,
         'segments_summary': segments,
         'original_order': order.copy(),  # Sauvegarder l'ordre original
-        'durations_matrix': durations_sec,
-        'distances_matrix': distances_m,
+        'travel_matrix': travel_matrix,
         'all_coords': coords,
-        'base_location': base_location
+        'base_location': base_location,
+        'degraded_stages': planning_deadline.degraded_stages,
+        'teams': team_plans,
+        'team_balance': team_balance if team_plans else None
     }
+    if planning_deadline.degraded_stages:
+        st.warning("⏱️ Délai de planification: " + " | ".join(
+            f"{d['label']}: {d['reason']}" for d in planning_deadline.degraded_stages
+        ))
     st.session_state.manual_itinerary = None
     st.session_state.edit_mode = False
 
@@ -4267,7 +5079,13 @@ if st.session_state.planning_results:
     with col4:
         st.metric("Temps de visite", f"{stats['total_visit_hours']:.1f} h")
     
-    tab_planning, tab_map, tab_fuel, tab_edit, tab_manual, tab_report, tab_export = st.tabs(["📅 Planning", "🗺️ Carte", "⛽ Carburant", "✏️ Éditer", "🔄 Modifier ordre", "📋 Rapport", "💾 Export"])
+    team_plans = results.get('teams') or []
+    tab_labels = ["📅 Planning", "🗺️ Carte", "⛽ Carburant", "✏️ Éditer", "🔄 Modifier ordre", "📋 Rapport", "💾 Export"]
+    if team_plans:
+        tab_labels.append("👥 Équipes")
+    result_tabs = st.tabs(tab_labels)
+    tab_planning, tab_map, tab_fuel, tab_edit, tab_manual, tab_report, tab_export = result_tabs[:7]
+    tab_teams = result_tabs[7] if team_plans else None
     
     with tab_planning:
         st.subheader("Planning détaillé")
@@ -4299,6 +5117,7 @@ if st.session_state.planning_results:
                 mission_title,
                 coords_ordered,
                 include_map=include_map_prof,
+                route_points=route_points_for(st.session_state.planning_results, coords_ordered, zoom=ROUTE_DISPLAY_ZOOM) if include_map_prof else None,
                 lunch_start_time=st.session_state.get("lunch_start_time"),
                 lunch_end_time=st.session_state.get("lunch_end_time"),
                 lunch_duration_min=st.session_state.get("lunch_duration_min", 60),
@@ -5159,13 +5978,13 @@ if st.session_state.planning_results:
         st.info("💡 Réorganisez l'ordre des sites en les faisant glisser. L'itinéraire sera automatiquement recalculé.")
         
         # Vérifier que nous avons les données nécessaires
-        if 'original_order' not in results or 'durations_matrix' not in results:
+        if 'original_order' not in results or results.get('travel_matrix') is None:
             st.warning("⚠️ Données insuffisantes pour la modification manuelle. Veuillez relancer le calcul.")
         else:
             # Récupérer les données
             original_order = results['original_order']
-            durations_matrix = results['durations_matrix']
-            distances_matrix = results['distances_matrix']
+            travel_matrix = results['travel_matrix']
+            durations_matrix = travel_matrix.durations
             all_coords = results['all_coords']
             
             # Éditeur de table (optionnel)
@@ -5278,9 +6097,8 @@ if st.session_state.planning_results:
                         from_idx = new_order[i]
                         to_idx = new_order[i+1]
                         
-                        if from_idx < len(durations_matrix) and to_idx < len(durations_matrix[0]):
-                            duration = durations_matrix[from_idx][to_idx]
-                            distance = distances_matrix[from_idx][to_idx] if distances_matrix else 0
+                        if from_idx < len(travel_matrix) and to_idx < len(travel_matrix):
+                            duration, distance = travel_matrix.segment(from_idx, to_idx)
                             
                             new_segments.append({
                                 "distance": distance,
@@ -5385,7 +6203,9 @@ if st.session_state.planning_results:
                         'sites_ordered': new_sites_ordered,
                         'coords_ordered': new_coords_ordered,
                         'stats': new_stats,
-                        'segments_summary': new_segments
+                        'segments_summary': new_segments,
+                        'route_polyline': None,
+                        'route_legs': None
                     })
                     
                     st.success("✅ Itinéraire recalculé avec le nouvel ordre!")
@@ -5408,12 +6228,12 @@ if st.session_state.planning_results:
                             st.success(f"Ordre optimisé automatiquement par IA Adja! {ai_message}")
                         else:
                             # Fallback vers TSP si l'IA Adja échoue ou réponse invalide
-                            optimized_order = solve_tsp_fixed_start_end(durations_matrix)
+                            optimized_order = solve_tsp_fixed_start_end(durations_matrix, quick=True)
                             st.session_state.manual_order = optimized_order
                             st.warning(f"IA Adja indisponible ou réponse invalide, optimisation TSP utilisée. {ai_message if not ai_success else ''}")
                     except Exception as e:
                         # Fallback vers TSP en cas d'erreur
-                        optimized_order = solve_tsp_fixed_start_end(durations_matrix)
+                        optimized_order = solve_tsp_fixed_start_end(durations_matrix, quick=True)
                         st.session_state.manual_order = optimized_order
                         st.warning(f"Erreur IA Adja ({str(e)[:50]}...), optimisation TSP utilisée.")
                     st.rerun()
@@ -5435,7 +6255,7 @@ if st.session_state.planning_results:
                         st.success("Ordre optimisé par OR-Tools (matrice OSRM/Maps).")
                     except Exception as e:
                         st.warning(f"OR-Tools indisponible ou erreur: {str(e)[:80]}... Fallback TSP.")
-                        st.session_state.manual_order = solve_tsp_fixed_start_end(durations_matrix)
+                        st.session_state.manual_order = solve_tsp_fixed_start_end(durations_matrix, quick=True)
                     st.rerun()
     
     with tab_map:
@@ -5447,23 +6267,9 @@ if st.session_state.planning_results:
             
             m = folium.Map(location=[center_lat, center_lon], zoom_start=7)
             
-            # Tracé de l'itinéraire : tentative de récupération de la route réelle via OSRM, sinon fallback sur la ligne droite
-            try:
-                coord_str = ";".join([f"{c[0]},{c[1]}" for c in coords_ordered])
-                url = f"{osrm_base_url.rstrip('/')}/route/v1/driving/{coord_str}?overview=full&geometries=geojson"
-                resp = requests.get(url, timeout=10)
-                route_pts = None
-                if resp.status_code == 200:
-                    data = resp.json()
-                    if data.get('routes'):
-                        geom = data['routes'][0].get('geometry')
-                        if isinstance(geom, dict) and geom.get('coordinates'):
-                            route_pts = [[lat, lon] for lon, lat in geom['coordinates']]
-                if not route_pts:
-                    route_pts = [[c[1], c[0]] for c in coords_ordered]
-            except Exception:
-                route_pts = [[c[1], c[0]] for c in coords_ordered]
-            folium.PolyLine(locations=route_pts, color="blue", weight=3, opacity=0.7).add_to(m)
+            # Tracé de l'itinéraire : géométrie OSRM obtenue lors de la planification (une seule requête), sinon ligne droite
+            route_pts = route_points_for(st.session_state.planning_results, coords_ordered)
+            folium.PolyLine(locations=simplify_for_zoom(route_pts, ROUTE_DISPLAY_ZOOM), color="blue", weight=3, opacity=0.7).add_to(m)
             
             # Export Google Maps (ouvrir et copier)
             try:
@@ -5560,7 +6366,7 @@ if st.session_state.planning_results:
                     kml_parts.append(placemark)
                 
                 # LineString pour la trace (OSRM si disponible, sinon ligne droite)
-                line_coords = "\n".join([f"{pt[1]},{pt[0]},0" for pt in route_pts])
+                line_coords = "\n".join([f"{pt[1]:.6f},{pt[0]:.6f},0" for pt in simplify_polyline(route_pts, ROUTE_KML_TOLERANCE_M)])
                 linestring = f"""
     <Placemark>
       <name>Route</name>
@@ -5616,31 +6422,14 @@ if st.session_state.planning_results:
         
         current_itinerary = st.session_state.manual_itinerary if st.session_state.manual_itinerary else itinerary
         
-        excel_data = []
-        for day, sdt, edt, desc in current_itinerary:
-            excel_data.append({
-                "Jour": day,
-                "Date": (start_date + timedelta(days=day-1)).strftime("%d/%m/%Y"),
-                "Début": sdt.strftime("%H:%M"),
-                "Fin": edt.strftime("%H:%M"),
-                "Durée (min)": int((edt - sdt).total_seconds() / 60),
-                "Activité": desc
-            })
-        
-        df_export = pd.DataFrame(excel_data)
-        
-        from io import BytesIO
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df_export.to_excel(writer, sheet_name='Planning', index=False)
-            pd.DataFrame(sites_ordered).to_excel(writer, sheet_name='Sites', index=False)
+        excel_bytes = build_excel_from_itinerary(current_itinerary, start_date, sites_ordered)
         
         col_excel, col_html, col_ics = st.columns(3)
         
         with col_excel:
             st.download_button(
                 label="📥 Télécharger Excel",
-                data=output.getvalue(),
+                data=excel_bytes,
                 file_name=f"mission_{datetime.now().strftime('%Y%m%d')}.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 use_container_width=True
@@ -5657,6 +6446,10 @@ if st.session_state.planning_results:
                 mission_title,
                 coords_ordered,
                 include_map=st.session_state.get("include_map_prof_html", False),
+                route_points=(
+                    route_points_for(st.session_state.planning_results, coords_ordered, zoom=ROUTE_DISPLAY_ZOOM)
+                    if st.session_state.get("include_map_prof_html", False) else None
+                ),
                 lunch_start_time=st.session_state.get("lunch_start_time"),
                 lunch_end_time=st.session_state.get("lunch_end_time"),
                 lunch_duration_min=st.session_state.get("lunch_duration_min", 60),
@@ -5681,6 +6474,86 @@ if st.session_state.planning_results:
                 use_container_width=True
             )
 
+    if tab_teams is not None:
+        with tab_teams:
+            st.subheader("👥 Itinéraires par équipe")
+            balance_label = results.get('team_balance') or "Heures"
+            st.caption(f"{len(team_plans)} équipes, même départ et même retour — équilibrage par {balance_label.lower()}")
+            st.dataframe(pd.DataFrame([
+                {
+                    "Équipe": team['name'],
+                    "Sites": len([s for s in team['sites_ordered'] if s.get('Type') != 'Base']),
+                    "Jours": team['stats'].get('total_days', 0),
+                    "Distance (km)": round(team['stats'].get('total_km', 0), 1),
+                    "Visites (h)": round(team['stats'].get('total_visit_hours', 0), 1),
+                }
+                for team in team_plans
+            ]), use_container_width=True, hide_index=True)
+
+            # Carte combinée: une couleur par équipe
+            team_colors = ["#1f77b4", "#d62728", "#2ca02c", "#9467bd", "#ff7f0e"]
+            all_team_coords = [c for team in team_plans for c in team['coords_ordered']]
+            if all_team_coords:
+                center_lat = sum(c[1] for c in all_team_coords) / len(all_team_coords)
+                center_lon = sum(c[0] for c in all_team_coords) / len(all_team_coords)
+                team_map = folium.Map(location=[center_lat, center_lon], zoom_start=7)
+                for team_idx, team in enumerate(team_plans):
+                    color = team_colors[team_idx % len(team_colors)]
+                    team_route = route_points_for(team, team['coords_ordered'], zoom=ROUTE_DISPLAY_ZOOM)
+                    folium.PolyLine(locations=team_route, color=color, weight=4, opacity=0.8, tooltip=team['name']).add_to(team_map)
+                    for step, (site, coord) in enumerate(zip(team['sites_ordered'], team['coords_ordered'])):
+                        if site.get('Type') == 'Base':
+                            continue
+                        folium.CircleMarker(
+                            location=[coord[1], coord[0]],
+                            radius=7,
+                            color="white",
+                            weight=2,
+                            fill=True,
+                            fill_color=color,
+                            fill_opacity=1.0,
+                            tooltip=f"{team['name']} — étape {step + 1}: {site['Ville']}"
+                        ).add_to(team_map)
+                base_coord = team_plans[0]['coords_ordered'][0]
+                folium.Marker(
+                    location=[base_coord[1], base_coord[0]],
+                    tooltip=f"Départ: {team_plans[0]['sites_ordered'][0]['Ville']}",
+                    icon=folium.Icon(color="green", icon="home")
+                ).add_to(team_map)
+                st_folium(team_map, width=None, height=500, use_container_width=True, key="teams_map")
+
+            for team_idx, team in enumerate(team_plans):
+                with st.expander(f"{team['name']} — {team['stats'].get('total_days', 0)} jour(s), {team['stats'].get('total_km', 0):.0f} km"):
+                    st.dataframe(pd.DataFrame([
+                        {
+                            "Jour": day,
+                            "Début": sdt.strftime("%H:%M"),
+                            "Fin": edt.strftime("%H:%M"),
+                            "Activité": desc
+                        }
+                        for day, sdt, edt, desc in team['itinerary']
+                    ]), use_container_width=True, hide_index=True)
+                    col_team_excel, col_team_ics = st.columns(2)
+                    team_slug = f"equipe{team_idx + 1}"
+                    with col_team_excel:
+                        st.download_button(
+                            label=f"📥 Excel {team['name']}",
+                            data=build_excel_from_itinerary(team['itinerary'], start_date, team['sites_ordered']),
+                            file_name=f"mission_{team_slug}_{datetime.now().strftime('%Y%m%d')}.xlsx",
+                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                            use_container_width=True,
+                            key=f"team_excel_{team_idx}"
+                        )
+                    with col_team_ics:
+                        st.download_button(
+                            label=f"📥 ICS {team['name']}",
+                            data=build_ics_from_itinerary(team['itinerary'], start_date, f"{mission_title} - {team['name']}"),
+                            file_name=f"mission_{team_slug}_{datetime.now().strftime('%Y%m%d')}.ics",
+                            mime="text/calendar",
+                            use_container_width=True,
+                            key=f"team_ics_{team_idx}"
+                        )
+
     with tab_report:
         st.subheader("📋 Génération de rapport de mission")
         
@@ -5752,8 +6625,11 @@ if st.session_state.planning_results:
                             
                             status_text.text("🤖 Génération du rapport par l'IA Adja...")
                             progress_bar.progress(60)
-                            response = requests.post(
+                            response = get_http_client().post(
                                 "https://api.deepseek.com/v1/chat/completions",
+                                provider="deepseek",
+                                retries=0,
+                                timeout=120,
                                 headers={
                                     "Authorization": f"Bearer {deepseek_api_key}",
                                     "Content-Type": "application/json"
@@ -0,0 +1,89 @@
+"""
+Module de gestion du délai global de planification
+Le budget total est réparti entre les étapes (géocodage, distances, optimisation,
+segments, planning); une étape dont la tranche est épuisée bascule sur son
+repli local et le basculement est consigné.
+"""
+
+import time
+
+# Part du budget attribuée à chaque étape, dans l'ordre d'exécution
+DEFAULT_STAGE_WEIGHTS = (
+    ("geocoding", 0.25),
+    ("matrix", 0.35),
+    ("optimization", 0.2),
+    ("segments", 0.15),
+    ("schedule", 0.05),
+)
+
+STAGE_LABELS = {
+    "geocoding": "Géocodage",
+    "matrix": "Distances",
+    "optimization": "Optimisation",
+    "segments": "Segments",
+    "schedule": "Planning",
+}
+
+
+class PlanningDeadline:
+    """
+    Délai global découpé en tranches par étape
+
+    Le temps non consommé par une étape est redistribué aux suivantes au
+    prorata de leurs poids: la tranche d'une étape est calculée à son démarrage
+    à partir du temps réellement restant.
+    """
+
+    def __init__(self, total_seconds, stage_weights=DEFAULT_STAGE_WEIGHTS):
+        self.total_seconds = float(total_seconds) if total_seconds else None
+        self.stage_weights = list(stage_weights)
+        self.started_at = time.monotonic()
+        self.degraded_stages = []
+        self._stage = None
+        self._stage_deadline = None
+
+    @property
+    def enabled(self):
+        return self.total_seconds is not None and self.total_seconds > 0
+
+    def remaining(self):
+        """Secondes restantes sur le budget global (None si pas de limite)."""
+        if not self.enabled:
+            return None
+        return max(0.0, self.total_seconds - (time.monotonic() - self.started_at))
+
+    def start_stage(self, stage):
+        """Démarre une étape; retourne sa tranche en secondes (None si pas de limite)."""
+        self._stage = stage
+        if not self.enabled:
+            self._stage_deadline = None
+            return None
+        names = [name for name, _ in self.stage_weights]
+        weights = dict(self.stage_weights)
+        following = names[names.index(stage):] if stage in weights else [stage]
+        total_weight = sum(weights.get(name, 0.0) for name in following) or 1.0
+        share = self.remaining() * weights.get(stage, 0.0) / total_weight if stage in weights else self.remaining()
+        self._stage_deadline = time.monotonic() + share
+        return share
+
+    def stage_remaining(self):
+        """Secondes restantes sur la tranche de l'étape courante (None si pas de limite)."""
+        if self._stage_deadline is None:
+            return None
+        return max(0.0, self._stage_deadline - time.monotonic())
+
+    def stage_expired(self, margin_seconds=0.0):
+        remaining = self.stage_remaining()
+        return remaining is not None and remaining <= margin_seconds
+
+    def degrade(self, stage, reason):
+        """Consigne le repli local d'une étape."""
+        self.degraded_stages.append({
+            "stage": stage,
+            "label": STAGE_LABELS.get(stage, stage),
+            "reason": reason,
+            "elapsed_s": round(time.monotonic() - self.started_at, 1),
+        })
+
+    def elapsed(self):
+        return time.monotonic() - self.started_at
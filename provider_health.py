@@ -0,0 +1,89 @@
+"""
+Module de suivi de santé des fournisseurs externes (géocodage, routage)
+Disjoncteur par fournisseur: après plusieurs échecs consécutifs, le fournisseur
+est ignoré pendant une période de refroidissement au lieu d'être réessayé pour
+chaque ville ou chaque relance.
+"""
+
+import threading
+import time
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Disjoncteur simple (fermé → ouvert → semi-ouvert)
+
+    - fermé: les appels passent, les échecs consécutifs sont comptés
+    - ouvert: les appels sont refusés jusqu'à la fin du refroidissement
+    - semi-ouvert: un seul appel d'essai; succès → fermé, échec → ouvert à nouveau
+    """
+
+    def __init__(self, name, failure_threshold=3, cooldown_seconds=300):
+        self.name = name
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.cooldown_seconds = float(cooldown_seconds)
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state_locked()
+
+    def _state_locked(self):
+        if self._opened_at is None:
+            return STATE_CLOSED
+        if time.monotonic() - self._opened_at >= self.cooldown_seconds:
+            return STATE_HALF_OPEN
+        return STATE_OPEN
+
+    def allow(self):
+        """True si un appel au fournisseur est autorisé maintenant."""
+        with self._lock:
+            state = self._state_locked()
+            if state == STATE_CLOSED:
+                return True
+            if state == STATE_HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def remaining_cooldown(self):
+        """Secondes restantes avant un nouvel essai (0 si le circuit est fermé)."""
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(0.0, self.cooldown_seconds - (time.monotonic() - self._opened_at))
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name, failure_threshold=3, cooldown_seconds=300):
+    """Disjoncteur partagé (par processus) pour un fournisseur donné."""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, failure_threshold, cooldown_seconds)
+            _breakers[name] = breaker
+        return breaker
@@ -0,0 +1,142 @@
+"""
+Module d'exécution concurrente des fournisseurs (mode "course")
+Les fournisseurs sont lancés en parallèle, avec un décalage configurable. Un résultat
+valide n'est retenu qu'une fois les fournisseurs préférés encore en cours terminés
+(ou après un délai de grâce borné); les fournisseurs de repli (payants) ne sont lancés
+que si tous les autres ont échoué ou tardent trop.
+Les fournisseurs plus lents sont ignorés (leurs threads se terminent en arrière-plan).
+"""
+
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def race_providers(providers, validate=None, stagger_seconds=1.0, timeout_seconds=None, wrap=None,
+                   grace_seconds=3.0, fallback_providers=None, fallback_after_seconds=None):
+    """
+    Lance les fournisseurs de façon décalée et retourne le meilleur résultat valide
+
+    Args:
+        providers: liste de (nom, fonction sans argument), dans l'ordre de préférence
+        validate: fonction résultat -> bool (par défaut: résultat non None)
+        stagger_seconds: délai entre deux lancements; un fournisseur est lancé
+            immédiatement si tous ceux déjà lancés ont échoué
+        timeout_seconds: durée maximale de la course (None = sans limite)
+        wrap: fonction appliquée à chaque callable avant soumission (ex. contexte Streamlit)
+        grace_seconds: après un premier résultat valide, attente maximale des fournisseurs
+            préférés encore en cours
+        fallback_providers: liste de (nom, fonction), moins préférés que providers, lancés
+            seulement si tous les providers ont échoué ou après fallback_after_seconds
+            sans résultat valide
+        fallback_after_seconds: délai avant le lancement des fournisseurs de repli
+            (None = uniquement après l'échec de tous les providers)
+
+    Returns:
+        tuple: (nom, résultat, erreurs) — (None, None, erreurs) si aucun résultat valide;
+            erreurs = {nom: message}
+    """
+    if validate is None:
+        validate = lambda result: result is not None
+    primaries = list(providers or [])
+    candidates = primaries + list(fallback_providers or [])
+    if not candidates:
+        return None, None, {}
+
+    done = queue.Queue()
+    errors = {}
+    start = time.monotonic()
+    deadline = None if timeout_seconds is None else start + float(timeout_seconds)
+    stagger = float(stagger_seconds)
+    executor = ThreadPoolExecutor(max_workers=len(candidates), thread_name_prefix="provider-race")
+    launched = 0
+    pending = set()
+    fallback_start = None
+    best = None
+    grace_end = None
+
+    def _launch():
+        nonlocal launched, fallback_start
+        k = launched
+        if k >= len(primaries) and fallback_start is None:
+            fallback_start = time.monotonic()
+        fn = candidates[k][1]
+        future = executor.submit(wrap(fn) if wrap else fn)
+        future.add_done_callback(lambda f, k=k: done.put((k, f)))
+        pending.add(k)
+        launched += 1
+
+    def _next_launch_at(now):
+        """Instant du prochain lancement (now = immédiat), None si aucun n'est prévu."""
+        if best is not None or launched >= len(candidates):
+            # Un résultat est acquis: aucun fournisseur moins préféré n'est lancé
+            return None
+        if launched < len(primaries):
+            return now if not pending else start + launched * stagger
+        offset = (launched - len(primaries)) * stagger
+        if not any(k < len(primaries) for k in pending):
+            # Tous les fournisseurs principaux ont échoué
+            return now if not pending else fallback_start + offset
+        if fallback_after_seconds is None:
+            return None
+        first = start + float(fallback_after_seconds)
+        return first if fallback_start is None else max(first, fallback_start + offset)
+
+    def _outcome(k, future):
+        name = candidates[k][0]
+        try:
+            result = future.result()
+        except Exception as e:
+            errors[name] = str(e)
+            return None
+        try:
+            ok = validate(result)
+        except Exception as e:
+            errors[name] = f"Résultat invalide: {e}"
+            return None
+        if not ok:
+            errors.setdefault(name, "Résultat invalide")
+            return None
+        return result
+
+    try:
+        while True:
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                break
+            if best is not None and (
+                not any(k < best[0] for k in pending) or now >= grace_end
+            ):
+                break
+            launch_at = _next_launch_at(now)
+            if launch_at is not None and now >= launch_at:
+                _launch()
+                continue
+            if not pending:
+                break
+            waits = [t - now for t in (launch_at, deadline, grace_end) if t is not None]
+            try:
+                item = done.get(timeout=max(0.0, min(waits)) if waits else None)
+            except queue.Empty:
+                continue
+            batch = [item]
+            while True:
+                try:
+                    batch.append(done.get_nowait())
+                except queue.Empty:
+                    break
+            for k, future in batch:
+                pending.discard(k)
+                result = _outcome(k, future)
+                if result is not None and (best is None or k < best[0]):
+                    best = (k, result)
+                    if grace_end is None:
+                        grace_end = time.monotonic() + max(0.0, float(grace_seconds))
+        for k in pending:
+            if best is None or k < best[0]:
+                errors.setdefault(candidates[k][0], "Délai dépassé")
+        if best is not None:
+            return candidates[best[0]][0], best[1], errors
+        return None, None, errors
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
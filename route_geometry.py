@@ -0,0 +1,217 @@
+"""
+Module de gestion des tracés d'itinéraire
+- encodage/décodage au format "encoded polyline" (Google, précision 5)
+- simplification Douglas–Peucker avec tolérance adaptée au niveau de zoom
+- cache SQLite des tracés, indexé par la liste ordonnée des étapes
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from math import cos, radians
+
+import numpy as np
+
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+
+POLYLINE_PRECISION = 5
+
+# Mètres par pixel à l'équateur au zoom 0 (tuiles Web Mercator de 256 px)
+_METERS_PER_PIXEL_Z0 = 156543.03392
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS route_geometry (
+    provider     TEXT NOT NULL,
+    waypoints    TEXT NOT NULL,
+    polyline     TEXT NOT NULL,
+    legs         TEXT,
+    created_at   REAL NOT NULL,
+    expires_at   REAL NOT NULL,
+    PRIMARY KEY (provider, waypoints)
+)
+"""
+
+
+def _encode_value(value):
+    value = ~(value << 1) if value < 0 else value << 1
+    chunks = []
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+    return "".join(chunks)
+
+
+def encode_polyline(points, precision=POLYLINE_PRECISION):
+    """Encode une liste [[lat, lon], ...] au format encoded polyline."""
+    factor = 10 ** precision
+    out = []
+    prev_lat = prev_lon = 0
+    for lat, lon in points:
+        ilat, ilon = int(round(lat * factor)), int(round(lon * factor))
+        out.append(_encode_value(ilat - prev_lat))
+        out.append(_encode_value(ilon - prev_lon))
+        prev_lat, prev_lon = ilat, ilon
+    return "".join(out)
+
+
+def decode_polyline(encoded, precision=POLYLINE_PRECISION):
+    """Décode une encoded polyline en liste [[lat, lon], ...]."""
+    factor = float(10 ** precision)
+    points = []
+    index = lat = lon = 0
+    length = len(encoded or "")
+    while index < length:
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        points.append([lat / factor, lon / factor])
+    return points
+
+
+def tolerance_for_zoom(zoom, latitude=0.0, pixels=0.5):
+    """Tolérance (m) correspondant à une fraction de pixel au zoom donné."""
+    return _METERS_PER_PIXEL_Z0 * cos(radians(latitude)) / (2 ** zoom) * pixels
+
+
+def simplify_polyline(points, tolerance_m):
+    """
+    Simplification Douglas–Peucker d'un tracé [[lat, lon], ...]
+
+    Les distances sont calculées dans une projection équirectangulaire locale
+    (suffisante à l'échelle d'un pays); les extrémités sont toujours conservées.
+    """
+    if points is None or len(points) < 3 or not tolerance_m or tolerance_m <= 0:
+        return [list(p) for p in (points or [])]
+    pts = np.asarray(points, dtype=np.float64)
+    lat0 = radians(float(pts[:, 0].mean()))
+    xy = np.empty_like(pts)
+    xy[:, 0] = np.radians(pts[:, 1]) * cos(lat0) * 6371000.0
+    xy[:, 1] = np.radians(pts[:, 0]) * 6371000.0
+
+    keep = np.zeros(len(pts), dtype=bool)
+    keep[0] = keep[-1] = True
+    # Pile explicite plutôt que récursion (tracés de plusieurs dizaines de milliers de points)
+    stack = [(0, len(pts) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        seg = xy[end] - xy[start]
+        inner = xy[start + 1:end]
+        rel = inner - xy[start]
+        seg_len2 = float(seg @ seg)
+        if seg_len2 == 0.0:
+            dists = np.hypot(rel[:, 0], rel[:, 1])
+        else:
+            dists = np.abs(seg[0] * rel[:, 1] - seg[1] * rel[:, 0]) / np.sqrt(seg_len2)
+        k = int(np.argmax(dists))
+        if dists[k] > tolerance_m:
+            idx = start + 1 + k
+            keep[idx] = True
+            stack.append((start, idx))
+            stack.append((idx, end))
+    return pts[keep].tolist()
+
+
+def simplify_for_zoom(points, zoom, pixels=0.5):
+    """Simplifie un tracé pour un affichage au zoom donné."""
+    if not points:
+        return []
+    latitude = sum(p[0] for p in points) / len(points)
+    return simplify_polyline(points, tolerance_for_zoom(zoom, latitude, pixels))
+
+
+def waypoints_key(waypoints, digits=POLYLINE_PRECISION):
+    """Clé stable d'une liste ordonnée d'étapes (lon, lat), coordonnées arrondies."""
+    text = ";".join(f"{float(c[0]):.{digits}f},{float(c[1]):.{digits}f}" for c in waypoints)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class RouteGeometryStore:
+    """
+    Cache durable des tracés d'itinéraire (encoded polyline + tronçons)
+
+    Une copie mémoire évite de relire SQLite à chaque réexécution Streamlit.
+    """
+
+    def __init__(self, db_path, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.db_path = db_path
+        self.ttl_seconds = int(ttl_seconds)
+        self._lock = threading.Lock()
+        self._memory = {}
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(_SCHEMA)
+            self._conn.commit()
+
+    def get(self, provider, waypoints):
+        """
+        Tracé en cache pour cette suite d'étapes
+
+        Returns:
+            dict: {"points": [[lat, lon], ...], "legs": [(durée_s, distance_m), ...] ou None} ou None
+        """
+        key = (provider, waypoints_key(waypoints))
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if not entry or entry[2] <= now:
+                row = self._conn.execute(
+                    "SELECT polyline, legs, expires_at FROM route_geometry "
+                    "WHERE provider = ? AND waypoints = ? AND expires_at > ?",
+                    (key[0], key[1], now)
+                ).fetchone()
+                if not row:
+                    return None
+                entry = row
+                self._memory[key] = entry
+        polyline, legs, _ = entry
+        return {
+            "points": decode_polyline(polyline),
+            "legs": [tuple(leg) for leg in json.loads(legs)] if legs else None,
+        }
+
+    def put(self, provider, waypoints, points, legs=None, ttl_seconds=None):
+        """Enregistre le tracé (encodé) et les tronçons d'une suite d'étapes."""
+        if not points:
+            return False
+        key = (provider, waypoints_key(waypoints))
+        now = time.time()
+        expires_at = now + (self.ttl_seconds if ttl_seconds is None else int(ttl_seconds))
+        polyline = encode_polyline(points)
+        legs_json = json.dumps([[float(d), float(m)] for d, m in legs]) if legs else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO route_geometry "
+                "(provider, waypoints, polyline, legs, created_at, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key[0], key[1], polyline, legs_json, now, expires_at)
+            )
+            self._conn.commit()
+            self._memory[key] = (polyline, legs_json, expires_at)
+        return True
+
+    def purge_expired(self):
+        """Supprime les tracés expirés. Retourne le nombre de lignes supprimées."""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM route_geometry WHERE expires_at <= ?", (now,))
+            self._conn.commit()
+            self._memory = {k: v for k, v in self._memory.items() if v[2] > now}
+            return cur.rowcount
@@ -0,0 +1,724 @@
+"""
+Module de planification des journées (sans effet de bord ni appel Streamlit)
+build_itinerary produit le planning détaillé affiché (schedule_itinerary l'enveloppe):
+heures de voyage et d'activité, report au lendemain, tolérance des activités
+prolongeables, pauses déjeuner/prière et week-ends.
+simulate_schedule en reproduit les règles en secondes, sans construire l'itinéraire,
+pour comparer des milliers d'ordres candidats dans la recherche locale.
+"""
+
+import time as time_module
+from datetime import datetime, timedelta
+
+# Valeurs de repli du planning pour un segment inconnu
+DEFAULT_TRAVEL_SECONDS = 3600
+DEFAULT_TRAVEL_METERS = 50000
+# Fenêtre de prière: 2h à partir de son début (comme le planning détaillé)
+PRAYER_WINDOW_SECONDS = 2 * 3600
+DAY_SECONDS = 24 * 3600
+
+
+def _seconds(t):
+    """datetime.time → secondes depuis minuit (None conservé)."""
+    if t is None:
+        return None
+    return t.hour * 3600 + t.minute * 60 + t.second
+
+
+class ScheduleParams:
+    """
+    Paramètres horaires du planning, convertis en secondes depuis minuit
+
+    lunch: (début fenêtre, fin fenêtre, durée en min) ou None;
+    prayer: (début fenêtre, durée en min) ou None;
+    start_weekday: jour de la semaine du premier jour (0 = lundi);
+    end_day_early_threshold: heures de voyage restantes en deçà desquelles la journée
+    s'arrête après une visite (comme build_itinerary, sans étirement des journées).
+    """
+
+    def __init__(self, start_activity, end_activity, start_travel, end_travel,
+                 lunch=None, prayer=None, tolerance_hours=1.0, start_weekday=0,
+                 allow_weekend_travel=True, allow_weekend_activities=True,
+                 end_day_early_threshold=1.5):
+        self.start_activity = _seconds(start_activity)
+        self.end_activity = _seconds(end_activity)
+        self.start_travel = _seconds(start_travel)
+        self.end_travel = _seconds(end_travel)
+        self.tolerance = float(tolerance_hours or 0) * 3600
+        self.end_day_early_threshold = float(end_day_early_threshold)
+        self.start_weekday = int(start_weekday)
+        self.allow_weekend_travel = bool(allow_weekend_travel)
+        self.allow_weekend_activities = bool(allow_weekend_activities)
+        if lunch and lunch[0] and lunch[1]:
+            self.lunch = (_seconds(lunch[0]), _seconds(lunch[1]), int(lunch[2] or 60) * 60)
+        else:
+            self.lunch = None
+        if prayer and prayer[0]:
+            start = _seconds(prayer[0])
+            self.prayer = (start, start + PRAYER_WINDOW_SECONDS, int(prayer[1] or 20) * 60)
+        else:
+            self.prayer = None
+
+
+def simulate_schedule(order, durations, distances, service, can_continue, params, overnight=None):
+    """
+    Nombre de jours et distance totale d'un ordre de visite
+
+    Mêmes règles que build_itinerary (planning sans étirement, max_days=0), en secondes
+    depuis minuit du premier jour. Les particularités du planning détaillé sont
+    conservées pour que les deux comptes de jours coïncident (voir tests/test_schedule_sim.py).
+
+    Args:
+        order: indices des sites dans l'ordre de visite
+        durations, distances: matrices (listes imbriquées) en secondes et en mètres
+        service: durée de visite de chaque site (secondes)
+        can_continue: pour chaque site, activité prolongeable/reportable au lendemain
+        params: ScheduleParams
+        overnight: pour chaque site, nuitée possible (None = partout)
+
+    Returns:
+        tuple: (nombre de jours, distance totale en mètres)
+    """
+    p = params
+    lunch, prayer = p.lunch, p.prayer
+    day = 1
+    clock = p.start_travel
+    day_end = p.end_travel
+    total_m = 0.0
+    lunch_days = set()
+    prayer_days = set()
+    # Comme dans le planning détaillé, la fenêtre de déjeuner et la décision
+    # "déjeuner après la visite" persistent d'un site au suivant
+    lunch_window = None
+    lunch_after = combine = False
+    last = len(order) - 1
+
+    def midnight(t):
+        return (t // DAY_SECONDS) * DAY_SECONDS
+
+    def weekend(t):
+        return (p.start_weekday + int(t // DAY_SECONDS)) % 7 >= 5
+
+    def next_day(start):
+        nonlocal day, clock, day_end
+        day += 1
+        clock = (day - 1) * DAY_SECONDS + start
+        day_end = (day - 1) * DAY_SECONDS + p.end_travel
+
+    prev = None
+    for idx, node in enumerate(order):
+        if prev is not None:
+            if not p.allow_weekend_travel:
+                while weekend(clock):
+                    next_day(p.start_travel)
+            travel = durations[prev][node]
+            meters = distances[prev][node]
+            if travel <= 0:
+                travel = DEFAULT_TRAVEL_SECONDS
+            if meters <= 0:
+                meters = DEFAULT_TRAVEL_METERS
+            travel = int(travel)
+            total_m += meters
+            travel_end = clock + travel
+            if travel_end > midnight(clock) + p.end_travel:
+                # Trajet reporté au lendemain
+                next_day(p.start_travel)
+                travel_end = clock + travel
+            lunch_window = (midnight(clock) + lunch[0], midnight(clock) + lunch[1]) if lunch else None
+            if lunch and day not in lunch_days:
+                if clock < lunch_window[1] and travel_end > lunch_window[0]:
+                    if lunch_window[0] <= travel_end <= lunch_window[1]:
+                        # Déjeuner à l'arrivée (prière combinée si les fenêtres se chevauchent)
+                        lunch_end = min(travel_end + lunch[2], lunch_window[1])
+                        if prayer and day not in prayer_days:
+                            prayer_start = midnight(travel_end) + prayer[0]
+                            if travel_end < prayer_start + PRAYER_WINDOW_SECONDS and lunch_end > prayer_start:
+                                prayer_days.add(day)
+                        lunch_days.add(day)
+                        travel_end = lunch_end
+                    else:
+                        # Déjeuner pendant le trajet
+                        lunch_time = max(clock, lunch_window[0])
+                        lunch_days.add(day)
+                        remaining = max(0, travel_end - lunch_time)
+                        clock = min(lunch_time + lunch[2], lunch_window[1])
+                        travel_end = clock + remaining
+            elif prayer and day not in prayer_days:
+                prayer_start = midnight(clock) + prayer[0]
+                prayer_end_window = prayer_start + PRAYER_WINDOW_SECONDS
+                if clock < prayer_end_window and travel_end > prayer_start:
+                    prayer_time = max(clock, prayer_start)
+                    prayer_days.add(day)
+                    remaining = travel_end - prayer_time
+                    clock = min(prayer_time + prayer[2], prayer_end_window)
+                    travel_end = clock + remaining
+            clock = travel_end
+        prev = node
+
+        visit = service[node]
+        if visit <= 0:
+            continue
+        if not p.allow_weekend_activities:
+            while weekend(clock):
+                next_day(p.start_activity)
+        visit_end = clock + visit
+        activity_end = midnight(clock) + p.end_activity
+        night = True if overnight is None else overnight[node]
+        if visit_end > activity_end:
+            if can_continue[node] and visit_end <= activity_end + p.tolerance:
+                pass
+            elif can_continue[node] and night:
+                # Suite de l'activité le lendemain
+                remaining = visit_end - activity_end
+                next_day(p.start_activity)
+                visit_end = clock + remaining
+            elif can_continue[node]:
+                # Sans nuitée: le reste est compté depuis la fin d'activité de la veille
+                next_day(p.start_activity)
+                remaining = visit - (activity_end - clock)
+                visit_end = clock + remaining if remaining > 0 else clock
+            else:
+                # Activité écourtée à l'heure limite, ou reportée si la journée est finie
+                visit_end = activity_end
+                if clock >= activity_end:
+                    next_day(p.start_activity)
+                    visit_end = clock + visit
+
+        if visit_end <= activity_end:
+            base = midnight(clock)
+            lunch_window = (base + lunch[0], base + lunch[1]) if lunch else None
+            lunch_after = bool(
+                lunch and day not in lunch_days
+                and clock < lunch_window[1] and visit_end > lunch_window[0]
+            )
+            combine = False
+            if prayer:
+                prayer_start = base + prayer[0]
+                prayer_end_window = prayer_start + PRAYER_WINDOW_SECONDS
+                if lunch_after and day not in prayer_days:
+                    # Déjeuner après la visite: prière combinée si les fenêtres se chevauchent
+                    planned = max(visit_end, lunch_window[0])
+                    planned_end = min(planned + lunch[2], lunch_window[1])
+                    combine = planned < prayer_end_window and planned_end > prayer_start
+                if day not in prayer_days and not combine:
+                    if clock < prayer_end_window and visit_end > prayer_start:
+                        # Prière pendant la visite: la visite est scindée
+                        prayer_time = max(clock, prayer_start)
+                        prayer_days.add(day)
+                        remaining = visit_end - prayer_time
+                        clock = min(prayer_time + prayer[2], prayer_end_window)
+                        visit_end = clock + remaining
+        if clock < visit_end:
+            clock = visit_end
+
+        if lunch_after and day not in lunch_days:
+            lunch_time = max(clock, lunch_window[0])
+            if lunch_time < lunch_window[1]:
+                if combine and prayer and day not in prayer_days:
+                    prayer_days.add(day)
+                lunch_days.add(day)
+                clock = min(lunch_time + lunch[2], lunch_window[1])
+
+        if idx < last and (day_end - clock) / 3600 <= p.end_day_early_threshold:
+            # Fin de journée anticipée
+            next_day(p.start_activity)
+    return day, total_m
+
+
+def build_itinerary(coords, sites, order, segments_summary,
+                    start_date, start_activity_time, end_activity_time,
+                    start_travel_time, end_travel_time,
+                    use_lunch, lunch_start_time, lunch_end_time,
+                    use_prayer, prayer_start_time, prayer_duration_min,
+                    max_days=0, tolerance_hours=1.0, base_location=None, 
+                    stretch_days=False, end_day_early_threshold=1.5,
+                    allow_weekend_travel=True, allow_weekend_activities=True,
+                    lunch_duration_min=60):
+    """
+    Génère le planning détaillé avec horaires différenciés pour activités et voyages
+
+    Version sans Streamlit du planning affiché (schedule_itinerary l'enveloppe);
+    simulate_schedule en reproduit les règles pour la recherche locale.
+
+    Returns:
+        tuple: (itinéraire [(jour, début, fin, description)], sites ordonnés,
+            coordonnées ordonnées, statistiques {total_days, total_km, total_visit_hours})
+    """
+    sites_ordered = [sites[i] for i in order]
+    coords_ordered = [coords[i] for i in order]
+    
+    current_datetime = datetime.combine(start_date, start_travel_time)  # Start with travel time
+    day_end_time = datetime.combine(start_date, end_travel_time)  # End with travel time
+    day_count = 1
+    itinerary = []
+    
+    # Suivi des pauses par jour pour éviter les doublons
+    daily_lunch_added = {}  # {day_count: bool}
+    daily_prayer_added = {}  # {day_count: bool}
+    
+    total_km = 0
+    total_visit_hours = 0
+    
+    for idx, site in enumerate(sites_ordered):
+        # Handle travel to this site (except for first site)
+        if idx > 0:
+            # Weekend skip for travel if disabled
+            if not allow_weekend_travel:
+                while current_datetime.weekday() >= 5:
+                    itinerary.append((day_count, current_datetime, datetime.combine(current_datetime.date(), end_travel_time), "⛱️ Week-end (pas de voyage)"))
+                    day_count += 1
+                    current_datetime = datetime.combine(start_date + timedelta(days=day_count-1), start_travel_time)
+                    day_end_time = datetime.combine(start_date + timedelta(days=day_count-1), end_travel_time)
+            seg_idx = idx - 1
+            if seg_idx < len(segments_summary):
+                seg = segments_summary[seg_idx]
+                travel_sec = seg.get("duration", 0)
+                travel_km = seg.get("distance", 0) / 1000.0
+                
+                # Si les données sont nulles, utiliser des valeurs par défaut simples
+                if travel_sec <= 0:
+                    travel_sec = DEFAULT_TRAVEL_SECONDS  # 1 heure par défaut
+                if travel_km <= 0:
+                    travel_km = DEFAULT_TRAVEL_METERS / 1000.0  # 50 km par défaut
+                
+                total_km += travel_km
+                
+                travel_duration = timedelta(seconds=int(travel_sec))
+                travel_end = current_datetime + travel_duration
+                
+                from_city = sites_ordered[idx-1]['Ville']
+                to_city = site['Ville']
+                
+                # Format travel time for display
+                travel_hours = travel_sec / 3600
+                if travel_hours >= 1:
+                    travel_time_str = f"{travel_hours:.1f}h"
+                else:
+                    travel_minutes = travel_sec / 60
+                    travel_time_str = f"{travel_minutes:.0f}min"
+                
+                travel_desc = f"🚗 {from_city} → {to_city} ({travel_km:.1f} km, {travel_time_str})"
+                
+                # Check if travel extends beyond travel hours
+                travel_end_time = datetime.combine(current_datetime.date(), end_travel_time)
+                
+                if travel_end > travel_end_time:
+                    # Travel extends beyond allowed hours - split across days
+                    itinerary.append((day_count, current_datetime, travel_end_time, "🏁 Fin de journée"))
+                    prev_site = sites_ordered[idx-1]
+                    prev_city = prev_site['Ville']
+                    prev_overnight_allowed = prev_site.get('Possibilité de nuitée', True)
+                    if prev_overnight_allowed:
+                        itinerary.append((day_count, travel_end_time, travel_end_time, f"🏨 Nuitée à {prev_city}"))
+                    else:
+                        # Pas d'hébergement autorisé à la ville précédente -> avertissement + nuitée de repli
+                        itinerary.append((day_count, travel_end_time, travel_end_time, f"⚠️ Déplacement nécessaire - pas d'hébergement à {prev_city}"))
+                        fallback_city = None
+                        for j in range(idx, len(sites_ordered)):
+                            if sites_ordered[j].get('Possibilité de nuitée', True):
+                                fallback_city = sites_ordered[j]['Ville']
+                                break
+                        if not fallback_city and base_location:
+                            fallback_city = base_location
+                        if fallback_city:
+                            itinerary.append((day_count, travel_end_time, travel_end_time, f"🏨 Nuitée à {fallback_city}"))
+                    
+                    day_count += 1
+                    current_datetime = datetime.combine(start_date + timedelta(days=day_count-1), start_travel_time)
+                    day_end_time = datetime.combine(start_date + timedelta(days=day_count-1), end_travel_time)
+                    travel_end = current_datetime + travel_duration
+                
+                # Handle lunch break during travel
+                lunch_window_start = datetime.combine(current_datetime.date(), lunch_start_time) if use_lunch else None
+                lunch_window_end = datetime.combine(current_datetime.date(), lunch_end_time) if use_lunch else None
+                
+                travel_added = False
+                
+                if use_lunch and lunch_window_start and lunch_window_end and not daily_lunch_added.get(day_count, False):
+                    if current_datetime < lunch_window_end and travel_end > lunch_window_start:
+                        # Si l'arrivée se situe dans la fenêtre de déjeuner, placer la pause à l'arrivée
+                        if lunch_window_start <= travel_end <= lunch_window_end:
+                            # Ajouter le trajet en une seule fois jusqu'à l'arrivée
+                            itinerary.append((day_count, current_datetime, travel_end, travel_desc))
+                            travel_added = True
+                            
+                            # Placer le déjeuner immédiatement à l'arrivée
+                            lunch_time = max(travel_end, lunch_window_start)
+                            lunch_end_time_actual = min(lunch_time + timedelta(minutes=lunch_duration_min), lunch_window_end)
+                            desc_text = f"🍽️ Déjeuner (≤{lunch_duration_min} min)"
+                            if use_prayer and prayer_start_time and not daily_prayer_added.get(day_count, False):
+                                prayer_window_start = datetime.combine(lunch_time.date(), prayer_start_time)
+                                prayer_window_end = prayer_window_start + timedelta(hours=2)
+                                if lunch_time < prayer_window_end and lunch_end_time_actual > prayer_window_start:
+                                    desc_text = f"🍽️ Déjeuner (≤{lunch_duration_min} min) + 🙏 Prière (≤{prayer_duration_min} min)"
+                                    daily_prayer_added[day_count] = True
+                            itinerary.append((day_count, lunch_time, lunch_end_time_actual, desc_text))
+                            daily_lunch_added[day_count] = True
+                            
+                            # Mettre à jour l'heure courante à la fin du déjeuner
+                            current_datetime = lunch_end_time_actual
+                            # Le trajet est terminé, éviter tout ajout résiduel
+                            travel_end = current_datetime
+                        else:
+                            # Sinon, conserver l’ancienne logique (pause pendant le trajet)
+                            lunch_time = max(current_datetime, lunch_window_start)
+                            lunch_end_time_actual = min(lunch_time + timedelta(minutes=lunch_duration_min), lunch_window_end)
+                            
+                            # Ajouter la partie de trajet avant la pause si nécessaire
+                            if lunch_time > current_datetime:
+                                itinerary.append((day_count, current_datetime, lunch_time, travel_desc))
+                                travel_added = True
+                            
+                            # Ajouter la pause déjeuner
+                            itinerary.append((day_count, lunch_time, lunch_end_time_actual, f"🍽️ Déjeuner (≤{lunch_duration_min} min)"))
+                            daily_lunch_added[day_count] = True
+                            
+                            # Reprendre le trajet après la pause
+                            current_datetime = lunch_end_time_actual
+                            remaining_travel = travel_end - lunch_time
+                            if remaining_travel.total_seconds() < 0:
+                                remaining_travel = timedelta(seconds=0)
+                            travel_end = current_datetime + remaining_travel
+                
+                # Handle prayer break during travel (only if no lunch break)
+                elif use_prayer and prayer_start_time and not daily_prayer_added.get(day_count, False):
+                    prayer_window_start = datetime.combine(current_datetime.date(), prayer_start_time)
+                    prayer_window_end = prayer_window_start + timedelta(hours=2)
+                    
+                    if current_datetime < prayer_window_end and travel_end > prayer_window_start:
+                        prayer_time = max(current_datetime, prayer_window_start)
+                        prayer_end_time = prayer_time + timedelta(minutes=prayer_duration_min)
+                        
+                        if prayer_end_time > prayer_window_end:
+                            prayer_end_time = prayer_window_end
+                        
+                        # Add travel before prayer if needed
+                        if prayer_time > current_datetime:
+                            itinerary.append((day_count, current_datetime, prayer_time, travel_desc))
+                            travel_added = True
+                        
+                        # Add prayer break
+                        itinerary.append((day_count, prayer_time, prayer_end_time, "🙏 Prière (≤20 min)"))
+                        daily_prayer_added[day_count] = True  # Marquer la prière comme ajoutée pour ce jour
+                        current_datetime = prayer_end_time
+                        
+                        # Recalculate remaining travel time
+                        remaining_travel = travel_end - prayer_time
+                        travel_end = current_datetime + remaining_travel
+                
+                # Add remaining travel time (include post-break remaining travel if any)
+                if current_datetime < travel_end:
+                    itinerary.append((day_count, current_datetime, travel_end, travel_desc))
+                
+                current_datetime = travel_end
+        
+        visit_hours = float(site.get("Durée (h)", 0)) if site.get("Durée (h)") else 0
+        
+        if visit_hours > 0:
+            # Weekend skip for activities if disabled
+            if not allow_weekend_activities:
+                while current_datetime.weekday() >= 5:
+                    itinerary.append((day_count, current_datetime, datetime.combine(current_datetime.date(), end_activity_time), "⛱️ Week-end (pas d'activités)"))
+                    day_count += 1
+                    current_datetime = datetime.combine(start_date + timedelta(days=day_count-1), start_activity_time)
+                    day_end_time = datetime.combine(start_date + timedelta(days=day_count-1), end_travel_time)
+            total_visit_hours += visit_hours
+            visit_duration = timedelta(hours=visit_hours)
+            visit_end = current_datetime + visit_duration
+            
+            type_site = site.get('Type', 'Site')
+            activite = site.get('Activité', 'Visite')
+            city = site['Ville'].upper()
+            
+            visit_desc = f"{city} – {activite}"
+            if type_site not in ["Base"]:
+                visit_desc = f"{city} – Visite {type_site}"
+            
+            # Check if visit extends beyond activity hours
+            activity_end_time = datetime.combine(current_datetime.date(), end_activity_time)
+            tolerance_end_time = activity_end_time + timedelta(hours=tolerance_hours)
+            
+            # Vérifier si l'activité peut continuer (nouvelle option)
+            can_continue = site.get('Peut continuer', False)  # Par défaut False
+            
+            # Vérifier si la nuitée est possible dans cette zone
+            overnight_allowed = site.get('Possibilité de nuitée', True)  # Par défaut True
+            
+            # Handle visit that extends beyond activity hours
+            if visit_end > activity_end_time:
+                # Si l'activité se termine dans le seuil de tolérance, elle peut continuer le même jour
+                if visit_end <= tolerance_end_time and can_continue:
+                    # L'activité continue sur le même jour malgré le dépassement
+                    pass  # Pas de division, traitement normal
+                elif can_continue and overnight_allowed:
+                    # L'activité dépasse le seuil de tolérance et peut être divisée, ET la nuitée est autorisée
+                    if current_datetime < activity_end_time:
+                        # Add partial visit for current day
+                        itinerary.append((day_count, current_datetime, activity_end_time, f"{visit_desc} (à continuer)"))
+                    
+                    # End current day
+                    itinerary.append((day_count, activity_end_time, activity_end_time, "🏁 Fin de journée"))
+                    if overnight_allowed:
+                        itinerary.append((day_count, activity_end_time, activity_end_time, f"🏨 Nuitée à {city}"))
+                    else:
+                        itinerary.append((day_count, activity_end_time, activity_end_time, f"⚠️ Déplacement nécessaire - pas d'hébergement à {city}"))
+                        # Nuitée de repli vers un site prochain autorisé ou la base
+                        fallback_city = None
+                        for j in range(idx+1, len(sites_ordered)):
+                            if sites_ordered[j].get('Possibilité de nuitée', True):
+                                fallback_city = sites_ordered[j]['Ville']
+                                break
+                        if not fallback_city and base_location:
+                            fallback_city = base_location
+                        if fallback_city:
+                            itinerary.append((day_count, activity_end_time, activity_end_time, f"🏨 Nuitée à {fallback_city}"))
+                    
+                    # Start next day
+                    remaining = visit_end - activity_end_time
+                    day_count += 1
+                    current_datetime = datetime.combine(start_date + timedelta(days=day_count-1), start_activity_time)
+                    day_end_time = datetime.combine(start_date + timedelta(days=day_count-1), end_travel_time)
+                    visit_end = current_datetime + remaining
+                    visit_desc = f"Suite {visit_desc}"
+                elif can_continue and not overnight_allowed:
+                    # L'activité peut continuer mais la nuitée n'est pas autorisée - chercher un site proche avec nuitée
+                    # Pour l'instant, on force la fin de l'activité et on ajoute un avertissement
+                    visit_end = activity_end_time
+                    if current_datetime < activity_end_time:
+                        itinerary.append((day_count, current_datetime, activity_end_time, f"{visit_desc} (interrompu - pas de nuitée possible)"))
+                    
+                    # End current day et chercher un hébergement ailleurs
+                    itinerary.append((day_count, activity_end_time, activity_end_time, "🏁 Fin de journée"))
+                    itinerary.append((day_count, activity_end_time, activity_end_time, f"⚠️ Déplacement nécessaire - pas d'hébergement à {city}"))
+                    
+                    # Start next day
+                    day_count += 1
+                    current_datetime = datetime.combine(start_date + timedelta(days=day_count-1), start_activity_time)
+                    day_end_time = datetime.combine(start_date + timedelta(days=day_count-1), end_travel_time)
+                    # Reprendre l'activité restante le jour suivant
+                    remaining_hours = (visit_duration - (activity_end_time - current_datetime)).total_seconds() / 3600
+                    if remaining_hours > 0:
+                        visit_end = current_datetime + timedelta(hours=remaining_hours)
+                        visit_desc = f"Suite {visit_desc}"
+                    else:
+                        # L'activité était déjà terminée
+                        visit_end = current_datetime
+                else:
+                    # L'activité ne peut pas continuer - la forcer à se terminer à l'heure limite
+                    visit_end = activity_end_time
+                    if current_datetime >= activity_end_time:
+                        # Si on est déjà en dehors des heures, terminer la journée et ajouter la nuitée (avec fallback si nécessaire)
+                        itinerary.append((day_count, current_datetime, current_datetime, "🏁 Fin de journée"))
+                        if overnight_allowed:
+                            itinerary.append((day_count, current_datetime, current_datetime, f"🏨 Nuitée à {city}"))
+                        else:
+                            itinerary.append((day_count, current_datetime, current_datetime, f"⚠️ Déplacement nécessaire - pas d'hébergement à {city}"))
+                            # Chercher une nuitée autorisée dans les sites suivants ou la base
+                            fallback_city = None
+                            for j in range(idx+1, len(sites_ordered)):
+                                if sites_ordered[j].get('Possibilité de nuitée', True):
+                                    fallback_city = sites_ordered[j]['Ville']
+                                    break
+                            if not fallback_city and base_location:
+                                fallback_city = base_location
+                            if fallback_city:
+                                itinerary.append((day_count, current_datetime, current_datetime, f"🏨 Nuitée à {fallback_city}"))
+                        
+                        # Reporter au jour suivant
+                        day_count += 1
+                        current_datetime = datetime.combine(start_date + timedelta(days=day_count-1), start_activity_time)
+                        day_end_time = datetime.combine(start_date + timedelta(days=day_count-1), end_travel_time)
+                        visit_end = current_datetime + visit_duration
+            
+            # Handle breaks during visit (only if visit fits in current day)
+            if visit_end <= activity_end_time:
+                lunch_window_start = datetime.combine(current_datetime.date(), lunch_start_time) if use_lunch else None
+                lunch_window_end = datetime.combine(current_datetime.date(), lunch_end_time) if use_lunch else None
+                
+                prayer_window_start = datetime.combine(current_datetime.date(), prayer_start_time) if use_prayer else None
+                prayer_window_end = prayer_window_start + timedelta(hours=2) if use_prayer else None
+                
+                # Check for lunch break during visit — do not split, schedule lunch after visit
+                place_lunch_after_visit = False
+                if use_lunch and lunch_window_start and lunch_window_end and not daily_lunch_added.get(day_count, False):
+                    if current_datetime < lunch_window_end and visit_end > lunch_window_start:
+                        place_lunch_after_visit = True
+                # If lunch will be placed after the visit, and prayer window overlaps that lunch window,
+                # combine prayer with lunch instead of splitting the visit
+                combine_prayer_with_lunch = False
+                if place_lunch_after_visit and use_prayer and prayer_window_start and prayer_window_end and not daily_prayer_added.get(day_count, False):
+                    planned_lunch_start = max(visit_end, lunch_window_start)
+                    planned_lunch_end = min(planned_lunch_start + timedelta(minutes=lunch_duration_min), lunch_window_end)
+                    if planned_lunch_start < prayer_window_end and planned_lunch_end > prayer_window_start:
+                        combine_prayer_with_lunch = True
+                
+                # Check for prayer break during visit (skip if it will be combined with lunch after visit)
+                if use_prayer and prayer_window_start and prayer_window_end and not daily_prayer_added.get(day_count, False) and not combine_prayer_with_lunch:
+                    if current_datetime < prayer_window_end and visit_end > prayer_window_start:
+                        prayer_time = max(current_datetime, prayer_window_start)
+                        prayer_end_time = min(prayer_time + timedelta(minutes=prayer_duration_min), prayer_window_end)
+                        
+                        # Add visit part before prayer
+                        if prayer_time > current_datetime:
+                            itinerary.append((day_count, current_datetime, prayer_time, visit_desc))
+                        
+                        # Add prayer break
+                        itinerary.append((day_count, prayer_time, prayer_end_time, "🙏 Prière (≤20 min)"))
+                        daily_prayer_added[day_count] = True  # Marquer la prière comme ajoutée pour ce jour
+                        
+                        # Update timing for remaining visit
+                        current_datetime = prayer_end_time
+                        remaining_visit = visit_end - prayer_time
+                        visit_end = current_datetime + remaining_visit
+                        visit_desc = f"Suite {visit_desc}" if prayer_time > current_datetime else visit_desc
+            
+            # Add final visit segment
+            if current_datetime < visit_end:
+                itinerary.append((day_count, current_datetime, visit_end, visit_desc))
+                current_datetime = visit_end
+            
+            # Place lunch right after the visit if the window overlapped
+            if 'place_lunch_after_visit' in locals() and place_lunch_after_visit and not daily_lunch_added.get(day_count, False):
+                lunch_time = max(current_datetime, lunch_window_start)
+                if lunch_time < lunch_window_end:
+                    lunch_end_time_actual = min(lunch_time + timedelta(minutes=lunch_duration_min), lunch_window_end)
+                    desc_text = f"🍽️ Déjeuner (≤{lunch_duration_min} min)"
+                    if 'combine_prayer_with_lunch' in locals() and combine_prayer_with_lunch and use_prayer and not daily_prayer_added.get(day_count, False):
+                        desc_text = f"🍽️ Déjeuner (≤{lunch_duration_min} min) + 🙏 Prière (≤{prayer_duration_min} min)"
+                        daily_prayer_added[day_count] = True
+                    itinerary.append((day_count, lunch_time, lunch_end_time_actual, desc_text))
+                    daily_lunch_added[day_count] = True
+                    current_datetime = lunch_end_time_actual
+            
+            # Check if we need to end the day early
+            time_until_end = (day_end_time - current_datetime).total_seconds() / 3600
+            
+            # Si on doit étaler, on termine la journée plus tôt pour répartir sur plus de jours
+            if stretch_days and day_count < max_days and idx < len(sites_ordered) - 1:
+                itinerary.append((day_count, current_datetime, current_datetime, f"🏁 Fin de journée"))
+                # Nuitée conditionnelle selon la possibilité
+                if overnight_allowed:
+                    itinerary.append((day_count, current_datetime, current_datetime, f"🏨 Nuitée à {city}"))
+                else:
+                    itinerary.append((day_count, current_datetime, current_datetime, f"⚠️ Déplacement nécessaire - pas d'hébergement à {city}"))
+                    # Chercher une nuitée autorisée dans les sites suivants ou la base
+                    fallback_city = None
+                    for j in range(idx+1, len(sites_ordered)):
+                        if sites_ordered[j].get('Possibilité de nuitée', True):
+                            fallback_city = sites_ordered[j]['Ville']
+                            break
+                    if not fallback_city and base_location:
+                        fallback_city = base_location
+                    if fallback_city:
+                        itinerary.append((day_count, current_datetime, current_datetime, f"🏨 Nuitée à {fallback_city}"))
+
+                # Démarrer le jour suivant
+                day_count += 1
+                current_datetime = datetime.combine(start_date + timedelta(days=day_count-1), start_activity_time)
+                day_end_time = datetime.combine(start_date + timedelta(days=day_count-1), end_travel_time)
+
+            elif time_until_end <= end_day_early_threshold and idx < len(sites_ordered) - 1:
+                # End current day and prepare for next day
+                itinerary.append((day_count, current_datetime, current_datetime, f"🏁 Fin de journée"))
+                # Nuitée conditionnelle selon la possibilité
+                if overnight_allowed:
+                    itinerary.append((day_count, current_datetime, current_datetime, f"🏨 Nuitée à {city}"))
+                else:
+                    itinerary.append((day_count, current_datetime, current_datetime, f"⚠️ Déplacement nécessaire - pas d'hébergement à {city}"))
+                    # Chercher une nuitée autorisée dans les sites suivants ou la base
+                    fallback_city = None
+                    for j in range(idx+1, len(sites_ordered)):
+                        if sites_ordered[j].get('Possibilité de nuitée', True):
+                            fallback_city = sites_ordered[j]['Ville']
+                            break
+                    if not fallback_city and base_location:
+                        fallback_city = base_location
+                    if fallback_city:
+                        itinerary.append((day_count, current_datetime, current_datetime, f"🏨 Nuitée à {fallback_city}"))
+                
+                # Start next day
+                day_count += 1
+                current_datetime = datetime.combine(start_date + timedelta(days=day_count-1), start_activity_time)
+                day_end_time = datetime.combine(start_date + timedelta(days=day_count-1), end_travel_time)
+    
+    # Add final overnight stay for the last day
+    if day_count > 0 and sites_ordered:
+        last_site = sites_ordered[-1]
+        last_city = last_site['Ville']
+        if last_site.get('Possibilité de nuitée', True):
+            itinerary.append((day_count, current_datetime, current_datetime, f"🏨 Nuitée à {last_city}"))
+        else:
+            # Fallback to base_location if overnight is not possible at the last site
+            if base_location:
+                itinerary.append((day_count, current_datetime, current_datetime, f"🏨 Nuitée à {base_location}"))
+
+    # Add final arrival marker
+    if day_count > 0 and sites_ordered:
+        last_city = sites_ordered[-1]['Ville'].upper()
+        
+        itinerary.append((day_count, current_datetime, current_datetime, f"📍 Arrivée {last_city} – Fin de mission"))
+    
+    stats = {
+        "total_days": day_count,
+        "total_km": total_km,
+        "total_visit_hours": total_visit_hours
+    }
+    
+    return itinerary, sites_ordered, coords_ordered, stats
+
+
+def _moves(last):
+    """Mouvements candidats (déplacement puis inversion), générés à la demande."""
+    for i in range(1, last):
+        # j: position d'insertion dans l'ordre privé du site i (l'arrivée reste en dernier)
+        for j in range(1, last):
+            if j != i:
+                yield "relocate", i, j
+    for i in range(1, last - 1):
+        for k in range(i + 1, last):
+            yield "reverse", i, k
+
+
+def _relocate(order, i, j):
+    node = order[i]
+    rest = order[:i] + order[i + 1:]
+    return rest[:j] + [node] + rest[j:]
+
+
+def optimize_days_then_distance(order, durations, distances, service, can_continue, params,
+                                time_budget_s=2.0, max_evaluations=None, overnight=None):
+    """
+    Recherche locale sur l'objectif (nombre de jours, puis distance), départ et arrivée fixes
+
+    Chaque ordre candidat (déplacement d'un site, inversion d'une portion) est
+    évalué par simulate_schedule; premier mouvement améliorant retenu, jusqu'à
+    l'optimum local ou la fin du budget.
+
+    Returns:
+        tuple: (ordre, (jours, mètres) initial, (jours, mètres) final, nombre d'évaluations)
+    """
+    order = list(order)
+    deadline = time_module.monotonic() + max(0.0, float(time_budget_s or 0))
+    initial = best = simulate_schedule(order, durations, distances, service, can_continue, params, overnight)
+    evaluations = 1
+    if len(order) < 4:
+        return order, initial, best, evaluations
+
+    last = len(order) - 1
+    improved = True
+    while improved:
+        improved = False
+        for move, a, b in _moves(last):
+            if time_module.monotonic() >= deadline or (max_evaluations and evaluations >= max_evaluations):
+                return order, initial, best, evaluations
+            if move == "relocate":
+                candidate = _relocate(order, a, b)
+            else:
+                candidate = order[:a] + order[a:b + 1][::-1] + order[b + 1:]
+            score = simulate_schedule(candidate, durations, distances, service, can_continue, params, overnight)
+            evaluations += 1
+            if score < best:
+                order, best = candidate, score
+                improved = True
+                break
+    return order, initial, best, evaluations
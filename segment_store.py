@@ -0,0 +1,178 @@
+"""
+Module de stockage persistant des segments routiers (origine → destination)
+Base SQLite partagée avec le cache de géocodage: chaque paire de points connue
+n'est demandée qu'une seule fois au fournisseur, quelle que soit la matrice
+dans laquelle elle apparaît.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_TTL_SECONDS = 24 * 3600
+
+# Précision des clés: 5 décimales ≈ 1 m, suffisant pour un site de mission
+COORD_DIGITS = 5
+_SCALE = 10 ** COORD_DIGITS
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS segment (
+    provider   TEXT NOT NULL,
+    o_lon      INTEGER NOT NULL,
+    o_lat      INTEGER NOT NULL,
+    d_lon      INTEGER NOT NULL,
+    d_lat      INTEGER NOT NULL,
+    duration   REAL NOT NULL,
+    distance   REAL NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (provider, o_lon, o_lat, d_lon, d_lat)
+)
+"""
+
+
+def quantize_point(coord):
+    """Clé entière (lon, lat) d'un point, arrondie à COORD_DIGITS décimales."""
+    return (int(round(float(coord[0]) * _SCALE)), int(round(float(coord[1]) * _SCALE)))
+
+
+class SegmentStore:
+    """
+    Cache durable des segments (durée en secondes, distance en mètres)
+
+    Les entrées sont indexées par fournisseur (ex. "osrm:https://router...")
+    puis par couple de points quantifiés. Une copie mémoire évite de relire
+    SQLite pour les paires déjà consultées par ce processus.
+    """
+
+    def __init__(self, db_path, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.db_path = db_path
+        self.ttl_seconds = int(ttl_seconds)
+        self._lock = threading.Lock()
+        self._memory = {}
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(_SCHEMA)
+            self._conn.commit()
+
+    def get_many(self, provider, coords):
+        """
+        Segments connus entre les points donnés
+
+        Returns:
+            dict: {(i, j): (duration_s, distance_m)} pour chaque paire i != j en cache
+        """
+        keys = [quantize_point(c) for c in coords]
+        now = time.time()
+        found = {}
+        to_read = []
+        with self._lock:
+            for i, ki in enumerate(keys):
+                for j, kj in enumerate(keys):
+                    if i == j:
+                        continue
+                    entry = self._memory.get((provider, ki, kj))
+                    if entry and entry[2] > now:
+                        found[(i, j)] = (entry[0], entry[1])
+                    else:
+                        to_read.append((i, j))
+            if to_read:
+                # Lecture groupée des origines concernées plutôt qu'une requête par paire
+                origins = sorted({keys[i] for i, _ in to_read})
+                rows = []
+                for o_lon, o_lat in origins:
+                    rows.extend(self._conn.execute(
+                        "SELECT o_lon, o_lat, d_lon, d_lat, duration, distance, expires_at FROM segment "
+                        "WHERE provider = ? AND o_lon = ? AND o_lat = ? AND expires_at > ?",
+                        (provider, o_lon, o_lat, now)
+                    ).fetchall())
+                for o_lon, o_lat, d_lon, d_lat, duration, distance, expires_at in rows:
+                    self._memory[(provider, (o_lon, o_lat), (d_lon, d_lat))] = (duration, distance, expires_at)
+                for i, j in to_read:
+                    entry = self._memory.get((provider, keys[i], keys[j]))
+                    if entry and entry[2] > now:
+                        found[(i, j)] = (entry[0], entry[1])
+        return found
+
+    def get_pairs(self, provider, pairs):
+        """
+        Segments connus pour des couples de points précis
+
+        Args:
+            pairs: itérable de (origine (lon, lat), destination (lon, lat))
+
+        Returns:
+            dict: {(origine, destination): (duration_s, distance_m)} pour les couples en cache
+        """
+        now = time.time()
+        found = {}
+        with self._lock:
+            for origin, destination in pairs:
+                ko, kd = quantize_point(origin), quantize_point(destination)
+                entry = self._memory.get((provider, ko, kd))
+                if not entry or entry[2] <= now:
+                    row = self._conn.execute(
+                        "SELECT duration, distance, expires_at FROM segment "
+                        "WHERE provider = ? AND o_lon = ? AND o_lat = ? AND d_lon = ? AND d_lat = ? AND expires_at > ?",
+                        (provider, ko[0], ko[1], kd[0], kd[1], now)
+                    ).fetchone()
+                    if not row:
+                        continue
+                    entry = row
+                    self._memory[(provider, ko, kd)] = entry
+                found[(origin, destination)] = (entry[0], entry[1])
+        return found
+
+    def put_many(self, provider, segments, ttl_seconds=None):
+        """
+        Enregistre des segments
+
+        Args:
+            segments: itérable de (origine (lon, lat), destination (lon, lat), duration_s, distance_m)
+        """
+        now = time.time()
+        expires_at = now + (self.ttl_seconds if ttl_seconds is None else int(ttl_seconds))
+        rows = []
+        for origin, destination, duration, distance in segments:
+            if duration is None or distance is None:
+                continue
+            ko, kd = quantize_point(origin), quantize_point(destination)
+            if ko == kd:
+                continue
+            rows.append((provider, ko[0], ko[1], kd[0], kd[1], float(duration), float(distance), now, expires_at))
+        if not rows:
+            return 0
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO segment "
+                "(provider, o_lon, o_lat, d_lon, d_lat, duration, distance, created_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+            for provider_id, o_lon, o_lat, d_lon, d_lat, duration, distance, _, exp in rows:
+                self._memory[(provider_id, (o_lon, o_lat), (d_lon, d_lat))] = (duration, distance, exp)
+        return len(rows)
+
+    def purge_expired(self):
+        """Supprime les segments expirés. Retourne le nombre de lignes supprimées."""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM segment WHERE expires_at <= ?", (now,))
+            self._conn.commit()
+            self._memory = {k: v for k, v in self._memory.items() if v[2] > now}
+            return cur.rowcount
+
+    def stats(self):
+        """Nombre de segments valides par fournisseur."""
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT provider, COUNT(*) FROM segment WHERE expires_at > ? GROUP BY provider",
+                (now,)
+            ).fetchall()
+        return {provider: count for provider, count in rows}
@@ -0,0 +1,106 @@
+"""
+La simulation rapide (simulate_schedule) doit compter les mêmes jours et kilomètres
+que le planning détaillé (build_itinerary, utilisé par schedule_itinerary).
+"""
+
+import os
+import random
+import sys
+from datetime import date, time, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from schedule_sim import ScheduleParams, build_itinerary, optimize_days_then_distance, simulate_schedule
+
+
+def _random_mission(rng):
+    n = rng.randint(3, 14)
+    durations = [[0 if i == j or rng.random() < 0.05 else rng.randint(600, 6 * 3600) for j in range(n)]
+                 for i in range(n)]
+    distances = [[d * rng.uniform(15, 30) for d in row] for row in durations]
+    sites = [{
+        "Ville": f"Ville {i}",
+        "Durée (h)": rng.choice([0, 0.5, 1, 1.5, 2, 3, 4, 6, 9, 12]),
+        "Peut continuer": rng.random() < 0.4,
+        "Possibilité de nuitée": rng.random() < 0.7,
+        "Type": "Site",
+        "Activité": "Visite",
+    } for i in range(n)]
+    settings = dict(
+        start_date=date(2026, 10, 1) + timedelta(days=rng.randint(0, 6)),
+        start_activity_time=time(rng.choice([7, 8, 9]), rng.choice([0, 30])),
+        end_activity_time=time(rng.choice([16, 17, 18]), rng.choice([0, 30])),
+        start_travel_time=time(rng.choice([6, 7]), 30),
+        end_travel_time=time(rng.choice([18, 19, 20])),
+        use_lunch=rng.random() < 0.7,
+        lunch_start_time=time(12, 30),
+        lunch_end_time=time(14, 0),
+        use_prayer=rng.random() < 0.6,
+        prayer_start_time=time(rng.choice([13, 14]), rng.choice([0, 30])),
+        prayer_duration_min=20,
+        lunch_duration_min=rng.choice([30, 60, 90]),
+        tolerance_hours=rng.choice([0, 0.5, 1, 2]),
+        allow_weekend_travel=rng.random() < 0.6,
+        allow_weekend_activities=rng.random() < 0.6,
+    )
+    return durations, distances, sites, settings
+
+
+def _params(settings):
+    return ScheduleParams(
+        settings["start_activity_time"], settings["end_activity_time"],
+        settings["start_travel_time"], settings["end_travel_time"],
+        lunch=(settings["lunch_start_time"], settings["lunch_end_time"], settings["lunch_duration_min"])
+        if settings["use_lunch"] else None,
+        prayer=(settings["prayer_start_time"], settings["prayer_duration_min"]) if settings["use_prayer"] else None,
+        tolerance_hours=settings["tolerance_hours"],
+        start_weekday=settings["start_date"].weekday(),
+        allow_weekend_travel=settings["allow_weekend_travel"],
+        allow_weekend_activities=settings["allow_weekend_activities"],
+    )
+
+
+def _planned(order, durations, distances, sites, settings):
+    segments = [{"duration": durations[a][b], "distance": distances[a][b]} for a, b in zip(order, order[1:])]
+    _, _, _, stats = build_itinerary([(0.0, 0.0)] * len(sites), sites, order, segments, **settings)
+    return stats["total_days"], stats["total_km"]
+
+
+def _simulated(order, durations, distances, sites, settings):
+    return simulate_schedule(
+        order, durations, distances,
+        [site["Durée (h)"] * 3600 for site in sites],
+        [site["Peut continuer"] for site in sites],
+        _params(settings),
+        [site["Possibilité de nuitée"] for site in sites],
+    )
+
+
+def test_simulation_matches_planner_on_random_orders():
+    rng = random.Random(2026)
+    for _ in range(1500):
+        durations, distances, sites, settings = _random_mission(rng)
+        n = len(sites)
+        order = [0] + rng.sample(range(1, n - 1), n - 2) + [n - 1]
+        days, meters = _simulated(order, durations, distances, sites, settings)
+        planned_days, planned_km = _planned(order, durations, distances, sites, settings)
+        assert days == planned_days
+        assert abs(meters / 1000.0 - planned_km) < 1e-6
+
+
+def test_optimized_order_estimate_matches_planner():
+    rng = random.Random(7)
+    for _ in range(40):
+        durations, distances, sites, settings = _random_mission(rng)
+        n = len(sites)
+        order, initial, best, _ = optimize_days_then_distance(
+            list(range(n)), durations, distances,
+            [site["Durée (h)"] * 3600 for site in sites],
+            [site["Peut continuer"] for site in sites],
+            _params(settings),
+            max_evaluations=300,
+            overnight=[site["Possibilité de nuitée"] for site in sites],
+        )
+        assert order[0] == 0 and order[-1] == n - 1 and sorted(order) == list(range(n))
+        assert best <= initial
+        assert best[0] == _planned(order, durations, distances, sites, settings)[0]
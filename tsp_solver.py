@@ -0,0 +1,450 @@
+"""
+Module de résolution du TSP à départ et arrivée fixes
+Fonctions pures (sans Streamlit) opérant sur une matrice de durées n x n:
+le nœud 0 est le départ, le nœud n-1 l'arrivée.
+"""
+
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Au-delà, la table de programmation dynamique (2^(n-2) x (n-2)) devient trop lourde
+HELD_KARP_MAX_NODES = 18
+# Nombre de départs indépendants par défaut (exécutés l'un après l'autre sur un seul cœur)
+DEFAULT_ILS_STARTS = 4
+# Arrêt d'un départ après ce nombre de perturbations consécutives sans amélioration
+DEFAULT_ILS_MAX_STALL = 20
+# En deçà, le coût de démarrage des processus dépasse le gain du parallélisme
+PARALLEL_MIN_NODES = 60
+
+
+def _as_cost_matrix(matrix):
+    costs = np.asarray(matrix, dtype=np.float64)
+    return np.nan_to_num(costs, nan=np.inf)
+
+
+def _popcounts(size):
+    """Nombre de bits à 1 de chaque entier de 0 à size-1."""
+    counts = np.zeros(size, dtype=np.int8)
+    values = np.arange(size)
+    while values.any():
+        counts += (values & 1).astype(np.int8)
+        values >>= 1
+    return counts
+
+
+def held_karp_fixed_start_end(matrix):
+    """
+    Chemin optimal 0 → ... → n-1 visitant tous les nœuds (programmation dynamique de Held–Karp)
+
+    La table dp[sous-ensemble, dernier nœud] est remplie couche par couche (taille
+    du sous-ensemble croissante), chaque couche étant vectorisée avec NumPy.
+    Matrices asymétriques acceptées.
+
+    Returns:
+        tuple: (chemin [0, ..., n-1], coût total)
+    """
+    costs = _as_cost_matrix(matrix)
+    n = len(costs)
+    if n <= 2:
+        path = list(range(n))
+        return path, float(sum(costs[path[k], path[k + 1]] for k in range(len(path) - 1)))
+    if n > HELD_KARP_MAX_NODES:
+        raise ValueError(f"Held–Karp limité à {HELD_KARP_MAX_NODES} nœuds ({n} demandés)")
+
+    m = n - 2
+    inner = costs[1:n - 1, 1:n - 1]
+    full = 1 << m
+    dp = np.full((full, m), np.inf)
+    parent = np.full((full, m), -1, dtype=np.int8)
+    singles = 1 << np.arange(m)
+    dp[singles, np.arange(m)] = costs[0, 1:n - 1]
+
+    masks = np.arange(full)
+    sizes = _popcounts(full)
+    for size in range(2, m + 1):
+        layer = masks[sizes == size]
+        for j in range(m):
+            sel = layer[(layer >> j) & 1 == 1]
+            prev = sel ^ (1 << j)
+            # dp[prev, k] vaut inf pour k absent de prev: pas de masque explicite
+            candidates = dp[prev] + inner[:, j]
+            best = np.argmin(candidates, axis=1)
+            dp[sel, j] = candidates[np.arange(len(sel)), best]
+            parent[sel, j] = best
+
+    final = dp[full - 1] + costs[1:n - 1, n - 1]
+    last = int(np.argmin(final))
+    total = float(final[last])
+
+    order = []
+    mask = full - 1
+    while last >= 0:
+        order.append(last + 1)
+        prev_last = int(parent[mask, last])
+        mask ^= 1 << last
+        last = prev_last
+    return [0] + order[::-1] + [n - 1], total
+
+
+def path_cost(path, matrix):
+    """Coût total d'un chemin (somme des arcs consécutifs)."""
+    return float(sum(matrix[path[k]][path[k + 1]] for k in range(len(path) - 1)))
+
+
+def neighbor_lists(matrix, k=10):
+    """
+    k plus proches voisins de chaque nœud (listes candidates de la recherche locale)
+
+    La proximité est mesurée par min(c[i][j], c[j][i]) pour rester pertinente
+    sur une matrice asymétrique.
+    """
+    costs = _as_cost_matrix(matrix)
+    n = len(costs)
+    if n <= 1:
+        return [[] for _ in range(n)]
+    k = max(1, min(int(k), n - 1))
+    closeness = np.minimum(costs, costs.T)
+    np.fill_diagonal(closeness, np.inf)
+    nearest = np.argpartition(closeness, k - 1, axis=1)[:, :k]
+    rows = np.arange(n)[:, None]
+    order = np.argsort(closeness[rows, nearest], axis=1)
+    return nearest[rows, order].tolist()
+
+
+class _PathState:
+    """Chemin courant, positions des nœuds et sommes préfixes des coûts aller/retour."""
+
+    def __init__(self, path, costs):
+        self.costs = costs
+        self.reset(path)
+
+    def reset(self, path):
+        c = self.costs
+        self.path = list(path)
+        self.pos = [0] * len(c)
+        for idx, node in enumerate(self.path):
+            self.pos[node] = idx
+        # fwd[t]: coût de path[0..t] dans le sens du parcours; bwd[t]: même portion parcourue à l'envers
+        self.fwd = [0.0] * len(self.path)
+        self.bwd = [0.0] * len(self.path)
+        for t in range(1, len(self.path)):
+            a, b = self.path[t - 1], self.path[t]
+            self.fwd[t] = self.fwd[t - 1] + c[a][b]
+            self.bwd[t] = self.bwd[t - 1] + c[b][a]
+
+    def cost(self):
+        return self.fwd[-1] if self.path else 0.0
+
+    def reversal_extra(self, i, k):
+        """Variation du coût interne de path[i..k] si la portion est inversée."""
+        return (self.bwd[k] - self.bwd[i]) - (self.fwd[k] - self.fwd[i])
+
+
+def _two_opt_delta(state, i, k):
+    """Inversion de path[i..k] (1 <= i < k <= n-2)."""
+    p, c = state.path, state.costs
+    a, b = p[i - 1], p[k + 1]
+    return (c[a][p[k]] + c[p[i]][b] - c[a][p[i]] - c[p[k]][b]) + state.reversal_extra(i, k)
+
+
+def _or_opt_delta(state, i, length, j, reverse):
+    """Déplacement de path[i..i+length-1] entre path[j] et path[j+1] (éventuellement inversé)."""
+    p, c = state.path, state.costs
+    e = i + length - 1
+    first, last = (p[e], p[i]) if reverse else (p[i], p[e])
+    removed = c[p[i - 1]][p[i]] + c[p[e]][p[e + 1]] + c[p[j]][p[j + 1]]
+    added = c[p[i - 1]][p[e + 1]] + c[p[j]][first] + c[last][p[j + 1]]
+    extra = state.reversal_extra(i, e) if reverse else 0.0
+    return added - removed + extra
+
+
+def _apply_or_opt(path, i, length, j, reverse):
+    segment = path[i:i + length]
+    if reverse:
+        segment = segment[::-1]
+    rest = path[:i] + path[i + length:]
+    insert_at = j + 1 if j < i else j + 1 - length
+    return rest[:insert_at] + segment + rest[insert_at:]
+
+
+def _improve_two_opt(state, neighbors, eps):
+    improved = False
+    last = len(state.path) - 1
+    for a in list(state.path[:-2]):
+        for v in neighbors[a]:
+            p, pos = state.path, state.pos
+            ia = pos[a]
+            # Nouvel arc a -> v: inversion de path[ia+1 .. pos[v]];
+            # nouvel arc v -> a: inversion de path[pos[v] .. ia-1]
+            for i, k in ((ia + 1, pos[v]), (pos[v], ia - 1)):
+                if 1 <= i < k <= last - 1 and _two_opt_delta(state, i, k) < -eps:
+                    state.reset(p[:i] + p[i:k + 1][::-1] + p[k + 1:])
+                    improved = True
+                    break
+    return improved
+
+
+def _improve_or_opt(state, neighbors, eps, max_length=3):
+    improved = False
+    last = len(state.path) - 1
+    for length in range(1, max_length + 1):
+        for i in range(1, last - length + 1):
+            e = i + length - 1
+            moved = True
+            while moved:
+                moved = False
+                p, pos = state.path, state.pos
+                for end_node, reverse in ((p[i], False), (p[e], True), (p[e], False), (p[i], True)):
+                    if length == 1 and reverse:
+                        continue
+                    for v in neighbors[end_node]:
+                        pv = pos[v]
+                        # Le voisin devient prédécesseur (j = pv) ou successeur (j = pv - 1) de la portion
+                        for j in (pv, pv - 1):
+                            if j < 0 or j >= last or i - 1 <= j <= e:
+                                continue
+                            if _or_opt_delta(state, i, length, j, reverse) < -eps:
+                                state.reset(_apply_or_opt(p, i, length, j, reverse))
+                                improved = moved = True
+                                break
+                        if moved:
+                            break
+                    if moved:
+                        break
+    return improved
+
+
+def local_search(path, matrix, neighbors=None, k=10, max_rounds=None, eps=1e-9):
+    """
+    Recherche locale 2-opt + Or-opt (segments de 1 à 3 nœuds, dont le simple
+    déplacement "relocate") à départ et arrivée fixes
+
+    Chaque mouvement est évalué en O(1) par différence de coûts (sommes préfixes
+    pour les inversions, valables sur matrice asymétrique); seuls les mouvements
+    créant un arc vers l'un des k plus proches voisins sont examinés.
+
+    Returns:
+        tuple: (chemin amélioré, coût)
+    """
+    if not path or len(path) < 4:
+        return list(path or []), path_cost(path or [], matrix)
+    costs = _as_cost_matrix(matrix).tolist()
+    if neighbors is None:
+        neighbors = neighbor_lists(matrix, k)
+    state = _PathState(path, costs)
+    rounds = 0
+    while max_rounds is None or rounds < max_rounds:
+        rounds += 1
+        improved = _improve_two_opt(state, neighbors, eps)
+        improved = _improve_or_opt(state, neighbors, eps) or improved
+        if not improved:
+            break
+    return state.path, state.cost()
+
+
+def randomized_greedy(matrix, rng, candidates=3):
+    """Plus proche voisin randomisé: choix aléatoire parmi les `candidates` nœuds les plus proches."""
+    n = len(matrix)
+    unvisited = set(range(1, n - 1))
+    path = [0]
+    current = 0
+    while unvisited:
+        row = matrix[current]
+        closest = sorted(unvisited, key=lambda x: row[x])[:max(1, candidates)]
+        nxt = rng.choice(closest)
+        path.append(nxt)
+        unvisited.remove(nxt)
+        current = nxt
+    path.append(n - 1)
+    return path
+
+
+def double_bridge(path, rng):
+    """Perturbation "double bridge" de la partie intérieure du chemin (extrémités fixes)."""
+    inner = path[1:-1]
+    if len(inner) < 8:
+        inner = inner[:]
+        rng.shuffle(inner)
+        return [path[0]] + inner + [path[-1]]
+    a, b, c = sorted(rng.sample(range(1, len(inner)), 3))
+    return [path[0]] + inner[:a] + inner[b:c] + inner[a:b] + inner[c:] + [path[-1]]
+
+
+def available_cpus():
+    """Cœurs réellement utilisables: affinité du processus et quota CPU du conteneur (cgroup v2)."""
+    try:
+        count = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        count = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as fh:
+            quota, period = fh.read().split()[:2]
+        if quota != "max":
+            count = min(count, max(1, -(-int(quota) // int(period))))
+    except (OSError, ValueError):
+        pass
+    return max(1, count)
+
+
+def ils_run(matrix, seed, deadline, k=10, max_stall=DEFAULT_ILS_MAX_STALL):
+    """
+    Une recherche locale itérée: départ glouton randomisé, puis perturbation
+    double bridge + recherche locale jusqu'à l'échéance (heure absolue, time.time())
+    ou après max_stall perturbations consécutives sans amélioration.
+    Exécutable dans un processus de travail (arguments et résultat sérialisables).
+
+    Returns:
+        tuple: (meilleur chemin, coût, nombre d'itérations)
+    """
+    rng = random.Random(seed)
+    costs = _as_cost_matrix(matrix)
+    rows = costs.tolist()
+    neighbors = neighbor_lists(costs, k)
+    best_path, best_cost = local_search(randomized_greedy(rows, rng), costs, neighbors=neighbors)
+    current_path, current_cost = best_path, best_cost
+    iterations = stall = 0
+    while time.time() < deadline and (not max_stall or stall < max_stall):
+        iterations += 1
+        stall += 1
+        candidate, cost = local_search(double_bridge(current_path, rng), costs, neighbors=neighbors)
+        if cost < current_cost:
+            current_path, current_cost = candidate, cost
+            if cost < best_cost:
+                best_path, best_cost = candidate, cost
+                stall = 0
+    return best_path, best_cost, iterations
+
+
+def multi_start_ils(matrix, time_budget_s=5.0, n_starts=None, max_workers=None, seed=None,
+                    max_stall=DEFAULT_ILS_MAX_STALL):
+    """
+    Recherche locale itérée multi-départs
+
+    Chaque départ indépendant s'arrête à la fin du budget ou après max_stall
+    perturbations sans amélioration; le meilleur chemin est retenu. Les départs sont
+    répartis sur un pool de processus (lancés par "spawn", sans fork du serveur)
+    seulement si plusieurs cœurs sont disponibles et l'instance assez grande;
+    sinon, ou si les processus sont indisponibles, ils s'exécutent l'un après l'autre.
+
+    Returns:
+        dict: {"path", "cost", "costs" (coût final de chaque départ), "spread"
+            (min, médiane, max, écart relatif), "starts", "iterations", "workers"}
+    """
+    costs = _as_cost_matrix(matrix)
+    n = len(costs)
+    if n <= 3:
+        path = list(range(n))
+        cost = path_cost(path, costs)
+        return {"path": path, "cost": cost, "costs": [cost], "spread": _spread([cost]),
+                "starts": 1, "iterations": 0, "workers": 0}
+    workers = max_workers or available_cpus()
+    n_starts = max(1, int(n_starts or max(DEFAULT_ILS_STARTS, workers)))
+    base_seed = seed if seed is not None else random.randrange(1 << 30)
+    seeds = [base_seed + s for s in range(n_starts)]
+    budget = max(0.0, float(time_budget_s or 0))
+    started = time.time()
+
+    results = []
+    if workers > 1 and n_starts > 1 and n >= PARALLEL_MIN_NODES:
+        try:
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=min(workers, n_starts), mp_context=context) as pool:
+                deadline = started + budget
+                futures = [pool.submit(ils_run, costs, s, deadline, 10, max_stall) for s in seeds]
+                results = [f.result() for f in futures]
+        except Exception:
+            results = []
+            workers = 1
+    if not results:
+        workers = 1
+        # Budget partagé entre les départs exécutés l'un après l'autre
+        slice_s = budget / n_starts
+        for idx, s in enumerate(seeds):
+            results.append(ils_run(costs, s, started + slice_s * (idx + 1), max_stall=max_stall))
+
+    best_path, best_cost, _ = min(results, key=lambda r: r[1])
+    final_costs = [r[1] for r in results]
+    return {
+        "path": best_path,
+        "cost": best_cost,
+        "costs": final_costs,
+        "spread": _spread(final_costs),
+        "starts": len(results),
+        "iterations": sum(r[2] for r in results),
+        "workers": workers,
+    }
+
+
+def _spread(values):
+    values = sorted(values)
+    low, high = values[0], values[-1]
+    return {
+        "min": low,
+        "median": float(np.median(values)),
+        "max": high,
+        "gap_pct": (high - low) / low * 100 if low else 0.0,
+    }
+
+
+def split_tour_balanced(order, matrix, service_times=None, k=2, day_capacity=None):
+    """
+    Répartit une tournée géante [départ, ..., arrivée] entre k équipes
+
+    Les sites intérieurs sont découpés en k groupes consécutifs (programmation
+    dynamique) minimisant la charge maximale d'une équipe: départ → groupe → arrivée,
+    trajets + durées de visite (secondes). Avec day_capacity (secondes de travail
+    par jour), l'équilibrage porte d'abord sur le nombre de jours estimé, puis sur la charge.
+
+    Returns:
+        list: k listes de nœuds intérieurs (moins si la tournée compte moins de k sites)
+    """
+    start, end = order[0], order[-1]
+    sites = list(order[1:-1])
+    m = len(sites)
+    k = max(1, min(int(k), m))
+    if m == 0:
+        return [[]]
+    service = [float(service_times[s] or 0) if service_times else 0.0 for s in sites]
+    # Préfixes: trajets internes et visites de sites[0..t-1]
+    inner = [0.0] * m
+    visits = [0.0] * (m + 1)
+    for t in range(m):
+        visits[t + 1] = visits[t] + service[t]
+        if t > 0:
+            inner[t] = inner[t - 1] + float(matrix[sites[t - 1]][sites[t]])
+
+    def load(a, b):
+        return (float(matrix[start][sites[a]]) + inner[b] - inner[a]
+                + visits[b + 1] - visits[a] + float(matrix[sites[b]][end]))
+
+    def key(value):
+        if day_capacity:
+            return (-(-value // day_capacity), value)
+        return (0, value)
+
+    inf = (float("inf"), float("inf"))
+    # best[g][b]: meilleure charge maximale pour sites[0..b] en g+1 groupes
+    best = [[inf] * m for _ in range(k)]
+    cut = [[-1] * m for _ in range(k)]
+    for b in range(m):
+        best[0][b] = key(load(0, b))
+    for g in range(1, k):
+        for b in range(g, m):
+            for a in range(g, b + 1):
+                candidate = max(best[g - 1][a - 1], key(load(a, b)))
+                if candidate < best[g][b]:
+                    best[g][b] = candidate
+                    cut[g][b] = a
+    groups = []
+    b = m - 1
+    for g in range(k - 1, 0, -1):
+        a = cut[g][b]
+        groups.append(sites[a:b + 1])
+        b = a - 1
+    groups.append(sites[:b + 1])
+    return groups[::-1]